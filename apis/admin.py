@@ -1,19 +1,307 @@
+import secrets
 from django import forms
-from django.contrib import admin
-from .models import User, FingerprintMapping, Course, Department, Faculty, CourseEnrollment, Semester, CurrentSemester, AttendanceSession, AttendanceRecord, EnrollmentTask
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+from .models import User, FingerprintMapping, Course, Department, Faculty, CourseEnrollment, Semester, CurrentSemester, AttendanceSession, AttendanceRecord, EnrollmentTask, EnrollmentCampaign, SensorGroup, Device, FingerprintTemplate, SemesterArchive, AttendanceRollup, PendingDeletion
+from .deletion import deletion_blockers, schedule_deletion
+from .sensors import DEFAULT_GROUP_NAME, forget_device
 # Register your models here.
 
-# admin.site.register(User)
-admin.site.register(FingerprintMapping)
-admin.site.register(Course)
-admin.site.register(Department)
-admin.site.register(Faculty)
+# Unfiltered tables bigger than this show the planner's row estimate instead of a COUNT(*)
+ESTIMATE_COUNT_ABOVE = 100000
+
+admin.site.register(Faculty, search_fields=('name',))
 admin.site.register(CurrentSemester)
-admin.site.register(Semester)
-admin.site.register(CourseEnrollment)
-admin.site.register(AttendanceSession)
-admin.site.register(AttendanceRecord)
-admin.site.register(EnrollmentTask)
+admin.site.register(EnrollmentCampaign)
+admin.site.register(SensorGroup)
+admin.site.register(FingerprintTemplate)
+admin.site.register(SemesterArchive)
+admin.site.register(AttendanceRollup, list_select_related=('course', 'department__faculty'), list_filter=('semester',))
+
+
+def table_row_count(model, using='default', estimate_above=ESTIMATE_COUNT_ABOVE):
+    """
+    The planner's row estimate for a table (summed over partitions, from the
+    last ANALYZE) when it is above estimate_above, otherwise an exact COUNT(*).
+    One query either way: the count only runs when the estimate is small.
+    None on databases other than PostgreSQL.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH estimate AS (
+                SELECT CASE WHEN c.relkind = 'p' THEN (
+                    SELECT COALESCE(SUM(GREATEST(p.reltuples, 0)), 0) FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid WHERE i.inhparent = c.oid
+                ) ELSE GREATEST(c.reltuples, 0) END::bigint AS row_count
+                FROM pg_class c WHERE c.oid = %s::regclass
+            )
+            SELECT CASE WHEN row_count > %s THEN row_count ELSE (SELECT COUNT(*) FROM {table}) END FROM estimate
+            """,
+            [model._meta.db_table, estimate_above],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counting every row of a table with millions of them takes seconds, so an
+    unfiltered changelist uses the estimate. Filtered or searched lists are counted exactly.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and not queryset.query.distinct:
+            count = table_row_count(queryset.model, queryset.db)
+            if count is not None:
+                return count
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "N total" on filtered lists
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class BackgroundDeleteAdmin(admin.ModelAdmin):
+    """
+    Hides deleted objects at once and deletes them, and everything that
+    refers to them, in the background (see apis/deletion.py).
+    """
+    def get_deleted_objects(self, objs, request):
+        # Only what was picked: collecting every related row to list it is what made these deletes time out
+        protected = [f"{obj}: {reason}" for obj in objs for reason in deletion_blockers(obj)]
+        return [str(obj) for obj in objs], {}, set(), protected
+
+    def delete_model(self, request, obj):
+        schedule_deletion(obj, requested_by=request.user)
+        self.message_user(request, "Its attendance history is deleted in the background; see Pending deletions.", messages.INFO)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            schedule_deletion(obj, requested_by=request.user)
+        self.message_user(request, "Their attendance history is deleted in the background; see Pending deletions.", messages.INFO)
+
+
+@admin.register(Semester)
+class SemesterAdmin(BackgroundDeleteAdmin):
+    search_fields = ('session', 'name')
+
+
+@admin.register(PendingDeletion)
+class PendingDeletionAdmin(admin.ModelAdmin):
+    list_display = ('label', 'model', 'status', 'step', 'rows_deleted', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'model')
+    list_select_related = ('requested_by__department__faculty',)
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Retry failed deletions")
+    def retry(self, request, queryset):
+        count = queryset.filter(status=PendingDeletion.Status.FAILED).update(status=PendingDeletion.Status.PENDING)
+        self.message_user(request, f"{count} deletion(s) will be retried.")
+
+
+@admin.register(Department)
+class DepartmentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'faculty')
+    list_select_related = ('faculty',)
+    list_filter = ('faculty',)
+    search_fields = ('name',)
+
+
+@admin.register(Course)
+class CourseAdmin(BackgroundDeleteAdmin):
+    list_display = ('course_code', 'course_name', 'minimum_level')
+    search_fields = ('course_code', 'course_name')
+    autocomplete_fields = ('departments', 'lecturers', 'available_semesters')
+
+
+@admin.register(FingerprintMapping)
+class FingerprintMappingAdmin(LargeTableAdmin):
+    list_display = ('fingerprint_id', 'sensor_group', 'user_name', 'user_role')
+    # User.__str__ shows the department and its faculty
+    list_select_related = ('user__department__faculty', 'sensor_group')
+    list_filter = ('sensor_group',)
+    # Exact lookups, so the unique indexes are used
+    search_fields = ('user__matric_number__exact', 'user__email__exact')
+    autocomplete_fields = ('user',)
+
+    @admin.display(description='User', ordering='user__last_name')
+    def user_name(self, mapping):
+        return mapping.user.get_full_name
+
+    @admin.display(description='Role')
+    def user_role(self, mapping):
+        return mapping.user.user_role
+
+
+@admin.register(CourseEnrollment)
+class CourseEnrollmentAdmin(LargeTableAdmin):
+    list_display = ('enrolmentID', 'student_name', 'matric_number', 'course_code', 'semester')
+    list_select_related = ('student__department__faculty', 'course', 'semester')
+    list_filter = ('semester',)
+    search_fields = ('student__matric_number__exact', 'course__course_code__iexact')
+    autocomplete_fields = ('student', 'course')
+
+    @admin.display(description='Student', ordering='student__last_name')
+    def student_name(self, enrollment):
+        return enrollment.student.get_full_name
+
+    @admin.display(description='Matric Number')
+    def matric_number(self, enrollment):
+        return enrollment.student.matric_number
+
+    @admin.display(description='Course', ordering='course__course_code')
+    def course_code(self, enrollment):
+        return enrollment.course.course_code
+
+
+class AttendeePageFormSet(BaseInlineFormSet):
+    """
+    One page of a session's attendees, picked by ?attendees_page=.
+    The change form posts back to the same URL, so a save edits the page that was shown.
+    """
+    per_page = 50
+    page_number = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_page'):
+            # semester keeps the scan to the session's partition
+            records = super().get_queryset().filter(semester_id=self.instance.semester_id).select_related('student__department__faculty')
+            self._page = Paginator(records.order_by('student__last_name', 'student__first_name', 'pk'), self.per_page).get_page(self.page_number)
+            self._page.object_list = list(self._page.object_list)
+            for record in self._page.object_list:
+                # Every record is in this session; saves reloading it per row
+                record.session = self.instance
+        return self._page.object_list
+
+    @property
+    def page(self):
+        self.get_queryset()
+        return self._page
+
+
+class AttendeeInline(admin.TabularInline):
+    model = AttendanceRecord
+    formset = AttendeePageFormSet
+    template = 'admin/apis/attendancesession/attendee_inline.html'
+    fields = ('student_name', 'matric_number', 'timestamp', 'marks_awarded')
+    readonly_fields = ('student_name', 'matric_number', 'timestamp')
+    extra = 0
+    verbose_name_plural = 'Attendees'
+
+    def has_add_permission(self, request, obj=None):
+        # Attendance is added from the Attendance records list
+        return False
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_number = request.GET.get('attendees_page', 1)
+        return formset
+
+    @admin.display(description='Student')
+    def student_name(self, record):
+        return record.student.get_full_name
+
+    @admin.display(description='Matric Number')
+    def matric_number(self, record):
+        return record.student.matric_number
+
+
+@admin.register(AttendanceSession)
+class AttendanceSessionAdmin(LargeTableAdmin):
+    list_display = ('session_id', 'course_code', 'lecturer_name', 'semester', 'start_time', 'end_time', 'is_active')
+    list_select_related = ('course', 'lecturer', 'semester')
+    # Both indexed: the partial active-session indexes and the semester foreign key
+    list_filter = ('is_active', 'semester')
+    search_fields = ('course__course_code__iexact',)
+    autocomplete_fields = ('course', 'lecturer')
+    ordering = ('-session_id',)
+    inlines = [AttendeeInline]
+
+    @admin.display(description='Course', ordering='course__course_code')
+    def course_code(self, session):
+        return session.course.course_code
+
+    @admin.display(description='Lecturer', ordering='lecturer__last_name')
+    def lecturer_name(self, session):
+        return session.lecturer.get_full_name
+
+
+class AttendanceRecordChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        # Only the columns the list shows (the change form still loads whole rows)
+        return super().get_queryset(request, exclude_parameters).only(
+            'record_id', 'timestamp', 'marks_awarded',
+            'student__first_name', 'student__last_name', 'student__matric_number', 'student__user_role',
+            'student__department__name', 'student__department__faculty__name',
+            'session__course__course_code', 'semester__name', 'semester__session',
+        )
+
+
+@admin.register(AttendanceRecord)
+class AttendanceRecordAdmin(LargeTableAdmin):
+    list_display = ('record_id', 'student_name', 'matric_number', 'course_code', 'semester', 'timestamp', 'marks_awarded')
+    list_select_related = ('student__department__faculty', 'session__course', 'semester')
+    # semester is the partition key, so filtering on it reads one partition
+    list_filter = ('semester',)
+    search_fields = ('student__matric_number__exact', 'student__email__exact')
+    raw_id_fields = ('session',)
+    autocomplete_fields = ('student',)
+    ordering = ('-record_id',)
+
+    def get_changelist(self, request, **kwargs):
+        return AttendanceRecordChangeList
+
+    def get_readonly_fields(self, request, obj=None):
+        # Copied from the session on save
+        return ('semester',)
+
+    @admin.display(description='Student', ordering='student__last_name')
+    def student_name(self, record):
+        return record.student.get_full_name
+
+    @admin.display(description='Matric Number')
+    def matric_number(self, record):
+        return record.student.matric_number
+
+    @admin.display(description='Course')
+    def course_code(self, record):
+        return record.session.course.course_code
+
+
+@admin.register(EnrollmentTask)
+class EnrollmentTaskAdmin(LargeTableAdmin):
+    list_display = ('id', 'sensor_group', 'slot_id', 'status', 'user', 'campaign', 'updated_at')
+    list_select_related = ('sensor_group', 'user__department__faculty', 'campaign__department__faculty')
+    list_filter = ('status', 'sensor_group')
+    raw_id_fields = ('campaign',)
+    autocomplete_fields = ('user',)
+
+
+class DepartmentListFilter(admin.RelatedFieldListFilter):
+    """
+    Department choices with their faculties, which Department.__str__ shows.
+    """
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        return [(department.pk, str(department)) for department in Department.objects.select_related('faculty').order_by(*ordering)]
 
 
 class UserAdminForm(forms.ModelForm):
@@ -43,14 +331,14 @@ class UserAdminForm(forms.ModelForm):
         return user
 
 
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(BackgroundDeleteAdmin):
     form = UserAdminForm
     add_form = UserAdminForm
 
     model = User
 
     list_display = ('email', 'first_name', 'last_name', 'user_role', 'is_staff')
-    list_filter = ('user_role', 'faculty', 'department')
+    list_filter = ('user_role', 'faculty', ('department', DepartmentListFilter))
     ordering = ('email',)
 
     # Hide password fields from the admin form
@@ -69,4 +357,42 @@ class UserAdmin(admin.ModelAdmin):
 
     search_fields = ('email', 'matric_number', 'first_name', 'last_name')
 
-admin.site.register(User, UserAdmin)
\ No newline at end of file
+    def get_queryset(self, request):
+        # __str__ shows the department and its faculty, in the list and in autocomplete results
+        return super().get_queryset(request).select_related('department__faculty')
+
+admin.site.register(User, UserAdmin)
+
+
+class DeviceAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'name', 'sensor_group', 'has_vault_key')
+    list_filter = ('sensor_group',)
+    search_fields = ('device_id', 'name')
+    actions = ['issue_vault_key', 'revoke_vault_key']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # The scanner should use its new group straight away, not when the cache expires
+        forget_device(obj.device_id)
+
+    @admin.display(boolean=True, description="Vault key")
+    def has_vault_key(self, obj):
+        return bool(obj.vault_key)
+
+    @admin.action(description="Issue vault key")
+    def issue_vault_key(self, request, queryset):
+        # Only shown once; the scanner has to be given it now
+        for device in queryset.select_related('sensor_group'):
+            if device.sensor_group.name == DEFAULT_GROUP_NAME:
+                self.message_user(request, f"{device}: move it out of the {DEFAULT_GROUP_NAME} group first.", messages.ERROR)
+                continue
+            device.vault_key = secrets.token_hex(32)
+            device.save(update_fields=['vault_key'])
+            self.message_user(request, f"{device}: vault key {device.vault_key}", messages.WARNING)
+
+    @admin.action(description="Revoke vault key")
+    def revoke_vault_key(self, request, queryset):
+        count = queryset.update(vault_key='')
+        self.message_user(request, f"{count} scanner(s) can no longer use the template vault.")
+
+admin.site.register(Device, DeviceAdmin)
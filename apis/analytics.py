@@ -0,0 +1,219 @@
+"""
+Semester-wide attendance analytics.
+
+A whole semester is loaded in three queries (enrollments, sessions held
+and attendance records joined to their session) into NumPy arrays, and
+every rate is worked out with array operations instead of one aggregate
+query per course. Archived semesters are read from their archive file.
+
+The attendance "matrix" is kept sparse: one entry per (student, course)
+enrollment, since a dense students x courses array would mostly be zeros.
+"""
+from itertools import chain
+import numpy as np
+from django.conf import settings
+from . import archive
+from .models import AttendanceRecord, AttendanceSession, Course, CourseEnrollment, User
+
+# Lateness histogram buckets, in minutes after the session started
+LATENESS_BINS = [0, 5, 10, 15, 30, 60, np.inf]
+FETCH_CHUNK_SIZE = 10000
+
+
+def _fetch(queryset, fields):
+    """
+    Streams integer columns from a query into a rows x fields int64 array.
+    """
+    rows = queryset.values_list(*fields).iterator(chunk_size=FETCH_CHUNK_SIZE)
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, len(fields))
+
+
+def _seconds_late(rows):
+    for student_id, course_id, timestamp, start_time in rows:
+        yield from (student_id, course_id, int((timestamp - start_time).total_seconds()))
+
+
+def _load_live(semester, faculty):
+    """
+    (sessions' course IDs, records as [student, course, seconds late]) from the database.
+    """
+    session_courses = _fetch(AttendanceSession.objects.filter(semester=semester), ['course_id'])[:, 0]
+    records = AttendanceRecord.objects.filter(semester=semester)
+    if faculty is not None:
+        records = records.filter(student__department__faculty=faculty)
+    rows = (
+        records.values_list('student_id', 'session__course_id', 'timestamp', 'session__start_time')
+        .iterator(chunk_size=FETCH_CHUNK_SIZE)
+    )
+    records = np.fromiter(_seconds_late(rows), dtype=np.int64).reshape(-1, 3)
+    return session_courses, records
+
+
+def _load_archived(semester):
+    """
+    The same arrays as _load_live, read column by column from the semester's archive.
+    """
+    index = archive.read_index(semester.pk)
+    session_courses, records = [], []
+    for course_id in index['courses']:
+        sessions = archive.read_columns(semester.pk, course_id, 'sessions', ['session_id', 'start_time'], index=index)
+        course_records = archive.read_columns(semester.pk, course_id, 'records', ['session_id', 'student_id', 'timestamp'], index=index)
+
+        session_ids = np.asarray(sessions['session_id'], dtype=np.int64)
+        session_courses.append(np.full(len(session_ids), int(course_id), dtype=np.int64))
+
+        # Sessions are stored in start order, not ID order, so look start times up through a sort
+        order = np.argsort(session_ids)
+        position = order[np.searchsorted(session_ids, np.asarray(course_records['session_id'], dtype=np.int64), sorter=order)]
+        start_times = np.asarray(sessions['start_time'], dtype=np.int64)[position]
+        seconds_late = (np.asarray(course_records['timestamp'], dtype=np.int64) - start_times) // 1_000_000
+
+        student_ids = np.asarray(course_records['student_id'], dtype=np.int64)
+        records.append(np.column_stack([student_ids, np.full(len(student_ids), int(course_id), dtype=np.int64), seconds_late]))
+
+    return (
+        np.concatenate(session_courses) if session_courses else np.empty(0, dtype=np.int64),
+        np.concatenate(records) if records else np.empty((0, 3), dtype=np.int64),
+    )
+
+
+def _lookup(sorted_ids, values):
+    """
+    Positions of values in sorted_ids, and a mask of the ones that are actually there.
+    """
+    position = np.searchsorted(sorted_ids, values)
+    position = np.minimum(position, len(sorted_ids) - 1)
+    return position, sorted_ids[position] == values if len(sorted_ids) else np.zeros(len(values), dtype=bool)
+
+
+def _number(value):
+    # NaN (nothing to measure) becomes None for the template
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _rate(attended, held):
+    # Percent, NaN where nothing was held yet
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(held > 0, attended * 100.0 / held, np.nan)
+
+
+def semester_report(semester, faculty=None, threshold=None):
+    """
+    Attendance for every student enrolled in the semester (optionally only
+    students of one faculty). Returns a dict with:
+
+      at_risk   students below threshold percent in at least one course, lowest overall rate first
+      courses   per-course enrolment, sessions held, rate and median / 90th percentile lateness
+      lateness  histogram of minutes late, as (bucket label, count)
+      and totals for the summary line.
+    """
+    threshold = settings.ATTENDANCE_THRESHOLD if threshold is None else threshold
+
+    # Enrollments define who should have attended what: the sparse student x course matrix.
+    # Courses and students waiting to be deleted are left out; their records then count for nothing.
+    enrollments = CourseEnrollment.objects.filter(semester=semester, student__pending_delete=False, course__pending_delete=False)
+    if faculty is not None:
+        enrollments = enrollments.filter(student__department__faculty=faculty)
+    enrollments = _fetch(enrollments, ['student_id', 'course_id'])
+    if archive.is_archived(semester):
+        session_courses, records = _load_archived(semester)
+    else:
+        session_courses, records = _load_live(semester, faculty)
+
+    student_ids = np.unique(enrollments[:, 0])
+    course_ids = np.unique(enrollments[:, 1])
+    course_count = max(len(course_ids), 1)
+
+    # Sessions held per course
+    position, found = _lookup(course_ids, session_courses)
+    held = np.bincount(position[found], minlength=len(course_ids))
+
+    # One cell per enrollment, keyed student_index * course_count + course_index
+    pair_students = np.searchsorted(student_ids, enrollments[:, 0])
+    pair_courses = np.searchsorted(course_ids, enrollments[:, 1])
+    pair_keys, first = np.unique(pair_students * course_count + pair_courses, return_index=True)
+    pair_students, pair_courses = pair_students[first], pair_courses[first]
+
+    # Attended count per cell. Records for courses the student isn't enrolled in are ignored.
+    record_students, student_found = _lookup(student_ids, records[:, 0])
+    record_courses, course_found = _lookup(course_ids, records[:, 1])
+    record_keys = record_students * course_count + record_courses
+    cell, cell_found = _lookup(pair_keys, record_keys)
+    counted = student_found & course_found & cell_found
+    attended = np.bincount(cell[counted], minlength=len(pair_keys))
+
+    pair_held = held[pair_courses]
+    pair_rate = _rate(attended, pair_held)
+
+    # Per student, over all their courses
+    student_attended = np.bincount(pair_students, weights=attended, minlength=len(student_ids))
+    student_held = np.bincount(pair_students, weights=pair_held, minlength=len(student_ids))
+    student_rate = _rate(student_attended, student_held)
+
+    # Per course, over all its students
+    course_enrolled = np.bincount(pair_courses, minlength=len(course_ids))
+    course_attended = np.bincount(pair_courses, weights=attended, minlength=len(course_ids))
+    course_rate = _rate(course_attended, course_enrolled * held)
+
+    # Lateness in minutes; scanner clocks can be slightly early
+    minutes_late = np.maximum(records[counted, 2], 0) / 60.0
+    histogram, _ = np.histogram(minutes_late, bins=LATENESS_BINS)
+    late_courses = record_courses[counted]
+    order = np.lexsort((minutes_late, late_courses))
+    late_courses, minutes_late = late_courses[order], minutes_late[order]
+    late_course_index, starts, counts = np.unique(late_courses, return_index=True, return_counts=True)
+    course_median = np.full(len(course_ids), np.nan)
+    course_p90 = np.full(len(course_ids), np.nan)
+    course_median[late_course_index] = minutes_late[starts + (counts - 1) // 2]
+    course_p90[late_course_index] = minutes_late[starts + (counts - 1) * 9 // 10]
+
+    # Only the flagged students and the courses are turned back into model objects
+    below = (pair_held > 0) & (pair_rate < threshold)
+    flagged = np.unique(pair_students[below])
+    flagged = flagged[np.argsort(student_rate[flagged], kind='stable')]
+    users = User.objects.select_related('department').in_bulk(student_ids[flagged].tolist())
+    courses = Course.objects.in_bulk(course_ids.tolist())
+
+    below_by_student = {}
+    for s, c in zip(pair_students[below].tolist(), np.flatnonzero(below).tolist()):
+        below_by_student.setdefault(s, []).append(c)
+
+    at_risk = [
+        {
+            'student': users[int(student_ids[s])],
+            'attended': int(student_attended[s]),
+            'held': int(student_held[s]),
+            'rate': _number(student_rate[s]),
+            'courses': [
+                {'course': courses[int(course_ids[pair_courses[c]])], 'attended': int(attended[c]), 'held': int(pair_held[c]), 'rate': _number(pair_rate[c])}
+                for c in below_by_student[s] if int(course_ids[pair_courses[c]]) in courses
+            ],
+        }
+        for s in flagged.tolist() if int(student_ids[s]) in users
+    ]
+
+    labels = [f"{int(low)}-{int(high)} min" if np.isfinite(high) else f"{int(low)}+ min" for low, high in zip(LATENESS_BINS, LATENESS_BINS[1:])]
+    return {
+        'threshold': threshold,
+        'student_count': len(student_ids),
+        'at_risk_count': len(at_risk),
+        'record_count': int(counted.sum()),
+        'rate': _number(_rate(student_attended.sum(), student_held.sum())),
+        'at_risk': at_risk,
+        'courses': sorted(
+            (
+                {
+                    'course': courses[int(course_ids[c])],
+                    'enrolled': int(course_enrolled[c]),
+                    'held': int(held[c]),
+                    'rate': _number(course_rate[c]),
+                    'median_late': _number(course_median[c]),
+                    'p90_late': _number(course_p90[c]),
+                }
+                for c in range(len(course_ids)) if int(course_ids[c]) in courses
+            ),
+            key=lambda row: row['course'].course_code,
+        ),
+        'lateness': list(zip(labels, histogram.tolist())),
+    }
@@ -0,0 +1,287 @@
+"""
+Cold storage for closed semesters.
+
+archive_semester writes a semester's sessions and attendance records to
+one compressed, column-oriented file under ATTENDANCE_ARCHIVE_DIR and
+then deletes the rows from the database. Reports for that semester read
+the file instead (see course_sessions and attendance_counts).
+
+File layout:
+
+    MAGIC | column blocks ... | index (zlib JSON) | index length (uint32, big-endian) | MAGIC
+
+Each course is a row group with a "sessions" and a "records" table. Every
+column of a table is stored as its own zlib-compressed block of
+little-endian integers (times are microseconds since the Unix epoch), so
+a report reads only the course and columns it needs. The index at the
+end gives each block's offset, length and crc32.
+"""
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from .models import AttendanceSession, AttendanceRecord, CurrentSemester, SemesterArchive, User
+from .partitions import drop_partition, is_partitioned, list_partitions
+
+MAGIC = b'ATTARC1\n'
+INDEX_LENGTH = struct.Struct('>I')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+NULL_TIME = -1  # end_time of a session that was never ended
+
+# (column, array typecode) for each table
+SESSION_COLUMNS = (('session_id', 'q'), ('lecturer_id', 'q'), ('start_time', 'q'), ('end_time', 'q'))
+RECORD_COLUMNS = (('record_id', 'q'), ('session_id', 'q'), ('student_id', 'q'), ('timestamp', 'q'), ('marks_awarded', 'H'))
+TIME_COLUMNS = {'start_time', 'end_time', 'timestamp'}
+
+
+class ArchiveError(Exception):
+    """Raised when a semester can't be archived or its archive can't be read."""
+
+
+def archive_path(semester_id):
+    return os.path.join(settings.ATTENDANCE_ARCHIVE_DIR, f"semester-{int(semester_id)}.arc")
+
+
+def _to_micros(value):
+    return NULL_TIME if value is None else (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return None if value == NULL_TIME else EPOCH + timedelta(microseconds=value)
+
+
+def _encode(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return zlib.compress(column.tobytes(), 9)
+
+
+def _decode(typecode, data):
+    column = array(typecode)
+    column.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def _write_table(out, columns, rows):
+    """
+    Writes one table's columns as blocks and returns its index entry.
+    """
+    entry = {'rows': len(rows), 'columns': {}}
+    for position, (name, typecode) in enumerate(columns):
+        values = [row[position] for row in rows]
+        if name in TIME_COLUMNS:
+            values = [_to_micros(value) for value in values]
+        block = _encode(typecode, values)
+        entry['columns'][name] = [out.tell(), len(block), zlib.crc32(block)]
+        out.write(block)
+    return entry
+
+
+def write_archive(semester):
+    """
+    Writes the semester's sessions and records to its archive file, one row group per course.
+    The file is written under a temporary name and moved into place once complete.
+    Returns (session count, record count).
+    """
+    course_ids = (
+        AttendanceSession.objects.filter(semester=semester)
+        .order_by('course_id').values_list('course_id', flat=True).distinct()
+    )
+    path = archive_path(semester.pk)
+    os.makedirs(settings.ATTENDANCE_ARCHIVE_DIR, exist_ok=True)
+
+    index = {'semester': semester.pk, 'created': datetime.now(dt_timezone.utc).isoformat(), 'courses': {}}
+    session_count = record_count = 0
+    with open(path + '.tmp', 'wb') as out:
+        out.write(MAGIC)
+        # One course in memory at a time
+        for course_id in course_ids:
+            sessions = list(
+                AttendanceSession.objects.filter(semester=semester, course_id=course_id)
+                .order_by('start_time', 'pk').values_list(*(name for name, _ in SESSION_COLUMNS))
+            )
+            records = list(
+                AttendanceRecord.objects.filter(semester=semester, session__course_id=course_id)
+                .order_by('session_id', 'timestamp', 'pk').values_list(*(name for name, _ in RECORD_COLUMNS))
+            )
+            index['courses'][str(course_id)] = {
+                'sessions': _write_table(out, SESSION_COLUMNS, sessions),
+                'records': _write_table(out, RECORD_COLUMNS, records),
+            }
+            session_count += len(sessions)
+            record_count += len(records)
+
+        packed_index = zlib.compress(json.dumps(index).encode())
+        out.write(packed_index)
+        out.write(INDEX_LENGTH.pack(len(packed_index)))
+        out.write(MAGIC)
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(path + '.tmp', path)
+    return session_count, record_count
+
+
+def read_index(semester_id):
+    with open(archive_path(semester_id), 'rb') as archive:
+        if archive.read(len(MAGIC)) != MAGIC:
+            raise ArchiveError(f"{archive.name} is not an attendance archive.")
+        archive.seek(-(INDEX_LENGTH.size + len(MAGIC)), os.SEEK_END)
+        (length,) = INDEX_LENGTH.unpack(archive.read(INDEX_LENGTH.size))
+        if archive.read(len(MAGIC)) != MAGIC:
+            raise ArchiveError(f"{archive.name} is incomplete.")
+        archive.seek(-(length + INDEX_LENGTH.size + len(MAGIC)), os.SEEK_END)
+        return json.loads(zlib.decompress(archive.read(length)))
+
+
+def read_columns(semester_id, course_id, table, columns=None, index=None):
+    """
+    Returns {column: array} for one course's sessions or records, with times
+    left as microseconds. Only the requested columns are read and decompressed.
+    """
+    index = index or read_index(semester_id)
+    entry = index['courses'].get(str(course_id))
+    typecodes = dict(SESSION_COLUMNS if table == 'sessions' else RECORD_COLUMNS)
+    columns = columns or list(typecodes)
+    if entry is None:
+        return {name: array(typecodes[name]) for name in columns}
+
+    result = {}
+    with open(archive_path(semester_id), 'rb') as archive:
+        for name in columns:
+            offset, length, checksum = entry[table]['columns'][name]
+            archive.seek(offset)
+            block = archive.read(length)
+            if zlib.crc32(block) != checksum:
+                raise ArchiveError(f"Column {table}.{name} of course {course_id} in {archive.name} is damaged.")
+            result[name] = _decode(typecodes[name], block)
+    return result
+
+
+def read_table(semester_id, course_id, table, columns=None):
+    """
+    Like read_columns, but as lists with times turned back into datetimes.
+    """
+    return {
+        name: [_from_micros(v) for v in values] if name in TIME_COLUMNS else list(values)
+        for name, values in read_columns(semester_id, course_id, table, columns).items()
+    }
+
+
+def verify_archive(semester_id, session_count, record_count):
+    """
+    Re-reads every block of the archive and checks the row counts before anything is deleted.
+    """
+    index = read_index(semester_id)
+    sessions = records = 0
+    for course_id in index['courses']:
+        sessions += len(read_table(semester_id, course_id, 'sessions')['session_id'])
+        records += len(read_table(semester_id, course_id, 'records')['record_id'])
+    if (sessions, records) != (session_count, record_count):
+        raise ArchiveError(
+            f"Archive has {sessions} sessions and {records} records, expected {session_count} and {record_count}."
+        )
+
+
+def purge_semester(semester):
+    """
+    Deletes the semester's attendance from the database. On Postgres the
+    semester's record partition is dropped instead of deleting row by row.
+    """
+    with transaction.atomic():
+        if is_partitioned():
+            drop_partition(semester.pk)
+        else:
+            AttendanceRecord.objects.filter(semester=semester).delete()
+        AttendanceSession.objects.filter(semester=semester).delete()
+
+
+def archive_semester(semester, purge=True):
+    """
+    Archives a closed semester and (unless purge is False) removes its rows from the database.
+    A semester archived without purging is written again from its rows, so a later run can finish the job.
+    """
+    if CurrentSemester.objects.filter(semester=semester).exists():
+        raise ArchiveError(f"{semester} is the current semester.")
+    if AttendanceSession.objects.filter(semester=semester, is_active=True).exists():
+        raise ArchiveError(f"{semester} still has an active session.")
+    if SemesterArchive.objects.filter(semester=semester, purged=True).exists():
+        raise ArchiveError(f"{semester} is already archived.")
+    if any(semester_id == semester.pk and not attached for semester_id, _, attached, _ in list_partitions()):
+        # Its records aren't visible through the live table, so they'd be left out and then dropped
+        raise ArchiveError(f"{semester}'s attendance partition is detached. Attach it before archiving.")
+
+    session_count, record_count = write_archive(semester)
+    verify_archive(semester.pk, session_count, record_count)
+
+    with transaction.atomic():
+        archive, _ = SemesterArchive.objects.update_or_create(semester=semester, defaults={
+            'file_name': os.path.basename(archive_path(semester.pk)),
+            'session_count': session_count,
+            'record_count': record_count,
+            'purged': purge,
+        })
+        if purge:
+            purge_semester(semester)
+    return archive
+
+
+def is_archived(semester):
+    """
+    Whether the semester's attendance has to be read from its archive file.
+    """
+    return SemesterArchive.objects.filter(semester=semester, purged=True).exists()
+
+
+def course_sessions(semester, course):
+    """
+    The course's archived sessions, newest first, as unsaved AttendanceSession
+    objects. Each has an attendee_list of AttendanceRecord objects, like the
+    live report builds.
+    """
+    sessions = read_table(semester.pk, course.pk, 'sessions')
+    records = read_table(semester.pk, course.pk, 'records')
+    students = User.objects.in_bulk(set(records['student_id']))
+
+    attendees = {}
+    for record_id, session_id, student_id, timestamp, marks in zip(*(records[name] for name, _ in RECORD_COLUMNS)):
+        if student_id not in students:
+            continue  # Account deleted since the semester closed
+        attendees.setdefault(session_id, []).append(AttendanceRecord(
+            record_id=record_id, session_id=session_id, student=students[student_id],
+            semester=semester, timestamp=timestamp, marks_awarded=marks,
+        ))
+
+    result = []
+    for session_id, lecturer_id, start_time, end_time in zip(*(sessions[name] for name, _ in SESSION_COLUMNS)):
+        session = AttendanceSession(
+            session_id=session_id, course=course, lecturer_id=lecturer_id, semester=semester,
+            start_time=start_time, end_time=end_time, is_active=False,
+        )
+        session.attendee_list = attendees.get(session_id, [])
+        result.append(session)
+    result.reverse()
+    return result
+
+
+def attendance_counts(semester, course):
+    """
+    {student ID: sessions attended} for the course, from the student column alone.
+    """
+    counts = {}
+    for student_id in read_table(semester.pk, course.pk, 'records', ['student_id'])['student_id']:
+        counts[student_id] = counts.get(student_id, 0) + 1
+    return counts
+
+
+def session_count(semester, course):
+    entry = read_index(semester.pk)['courses'].get(str(course.pk))
+    return entry['sessions']['rows'] if entry else 0
@@ -0,0 +1,89 @@
+"""
+The course catalog for student course registration.
+
+A student may enroll in the courses offered this semester to their department
+at or below their level. That list changes a couple of times a term, but is
+read on every visit to the registration page, so it is cached per
+(semester, department, level). The first miss for a semester builds the
+lists for every department and level in one query.
+
+Cached lists are never updated in place. Signals (apis/signals.py) bump the
+catalog version when a course, its departments or its semesters change, which
+retires every cached list at once. Entries also expire after
+COURSE_CATALOG_CACHE_TIMEOUT, in case the tables are changed outside Django.
+
+The version only retires lists for every worker when CACHE_URL is shared.
+With a per-process cache, a change made in one worker isn't seen by the
+others, so lists are kept for COURSE_CATALOG_LOCAL_CACHE_TIMEOUT instead.
+"""
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from .checks import is_local_cache
+from .models import LEVEL_CHOICES, Course
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_KEY = 'catalog:{version}:{semester}:{department}:{level}'
+LEVELS = [level for level, _ in LEVEL_CHOICES]
+
+
+def _version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # A fresh number, so lists cached under an evicted version never come back
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def _timeout():
+    if is_local_cache():
+        return settings.COURSE_CATALOG_LOCAL_CACHE_TIMEOUT
+    return settings.COURSE_CATALOG_CACHE_TIMEOUT
+
+
+def invalidate_catalog():
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _build(semester_id):
+    """
+    {(department ID, level): [(course ID, code, name, minimum level), ...]} for a semester, in one query.
+    """
+    links = Course.departments.through.objects.filter(
+        course__available_semesters=semester_id, course__pending_delete=False,
+    ).values_list(
+        'department_id', 'course_id', 'course__course_code', 'course__course_name', 'course__minimum_level',
+    ).order_by('course__course_code')
+
+    courses = defaultdict(list)
+    for department_id, *course in links:
+        minimum_level = int(course[-1])
+        for level in LEVELS:
+            if minimum_level <= int(level):
+                courses[department_id, level].append(tuple(course))
+    return courses
+
+
+def eligible_courses(semester_id, department_id, level):
+    """
+    The courses a student of this department and level can enroll in this
+    semester, as (course ID, code, name, minimum level) ordered by code.
+    """
+    if not (semester_id and department_id and level):
+        return []
+    version = _version()
+    key = CATALOG_KEY.format(version=version, semester=semester_id, department=department_id, level=level)
+    courses = cache.get(key)
+    if courses is None:
+        catalog = _build(semester_id)
+        courses = catalog.get((department_id, level), [])
+        # Store every list of the semester, and this one even if it's empty
+        entries = {
+            CATALOG_KEY.format(version=version, semester=semester_id, department=department, level=department_level): entry
+            for (department, department_level), entry in catalog.items()
+        }
+        entries[key] = courses
+        cache.set_many(entries, timeout=_timeout())
+    return courses
@@ -0,0 +1,28 @@
+"""
+System checks for settings that only show up as wrong behavior in production.
+Run with `manage.py check --deploy`.
+"""
+from django.conf import settings
+from django.core import checks
+
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+def is_local_cache(alias='default'):
+    """
+    True if the cache isn't shared between worker processes.
+    """
+    return settings.CACHES[alias]['BACKEND'] in LOCAL_CACHE_BACKENDS
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if not is_local_cache():
+        return []
+    return [checks.Warning(
+        "CACHE_URL is a per-process cache, so each worker enforces device rate limits "
+        "and DEVICE_MAX_CONCURRENCY on its own, and only sees course catalog changes "
+        "after COURSE_CATALOG_LOCAL_CACHE_TIMEOUT.",
+        hint="Set CACHE_URL to a shared backend such as redis://.",
+        id='apis.W001',
+    )]
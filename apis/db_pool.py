@@ -0,0 +1,141 @@
+"""
+Pooled Postgres connections, through Django's "pool" database option
+(psycopg_pool). Turned on with DATABASE_POOL; see settings.py for sizing.
+
+Connections are health-checked as they leave the pool and go back at the
+end of each request. A connection that isn't returned within
+DATABASE_POOL_LEAK_SECONDS is logged as a leak, together with the stack
+that took it, by a watchdog thread.
+"""
+import logging
+import os
+import threading
+import time
+import traceback
+import weakref
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+LEAK_CHECK_INTERVAL = 5  # Seconds between watchdog passes
+
+# id(database wrapper) -> [weakref to the wrapper, psycopg connection, checked out at, stack, reported]
+_checkouts = {}
+_checkouts_lock = threading.Lock()
+_leaks_reported = 0
+_watchdog = None
+
+
+def _is_pooled(wrapper):
+    return wrapper.vendor == 'postgresql' and wrapper.pool is not None
+
+
+def track_checkout(wrapper):
+    """
+    Called (from the connection_created signal) each time a request takes a connection from the pool.
+    """
+    if not _is_pooled(wrapper):
+        return
+    stack = ''.join(traceback.format_stack(limit=15)[:-3])
+    with _checkouts_lock:
+        _checkouts[id(wrapper)] = [weakref.ref(wrapper), wrapper.connection, time.monotonic(), stack, False]
+    _start_watchdog()
+
+
+def held_connections():
+    """
+    [(alias, seconds held, entry)] for connections still checked out.
+    Forgets the ones that have gone back to the pool.
+    """
+    now = time.monotonic()
+    held = []
+    with _checkouts_lock:
+        for key, entry in list(_checkouts.items()):
+            wrapper = entry[0]()
+            # Django drops its reference once the connection is returned
+            if wrapper is None or wrapper.connection is not entry[1]:
+                del _checkouts[key]
+                continue
+            held.append((wrapper.alias, now - entry[2], entry))
+    return held
+
+
+def check_for_leaks():
+    global _leaks_reported
+    for alias, seconds, entry in held_connections():
+        if seconds > settings.DATABASE_POOL_LEAK_SECONDS and not entry[4]:
+            entry[4] = True
+            _leaks_reported += 1
+            logger.warning(
+                "Pooled '%s' connection held for %.0fs (limit %ss). Taken at:\n%s",
+                alias, seconds, settings.DATABASE_POOL_LEAK_SECONDS, entry[3],
+            )
+
+
+def _watch():
+    while True:
+        time.sleep(LEAK_CHECK_INTERVAL)
+        try:
+            check_for_leaks()
+        except Exception:
+            logger.exception("Connection leak check failed")
+
+
+def _start_watchdog():
+    global _watchdog
+    if _watchdog is None:
+        with _checkouts_lock:
+            if _watchdog is None:
+                _watchdog = threading.Thread(target=_watch, name='db-pool-watchdog', daemon=True)
+                _watchdog.start()
+
+
+def release_connections():
+    """
+    Gives this thread's connections back now, like the end of a request
+    would, before a response that streams for a long time. One inside a
+    transaction (a test's, say) is kept, since closing it would end the transaction.
+    """
+    for wrapper in connections.all(initialized_only=True):
+        if not wrapper.in_atomic_block:
+            wrapper.close_if_unusable_or_obsolete()
+
+
+def pool_stats():
+    """
+    Pool size, waiters, checkout latency and saturation for each pooled
+    database in this worker process, plus connections held past the leak limit.
+    """
+    pools = {}
+    long_held = {}
+    for alias, seconds, entry in held_connections():
+        if seconds > settings.DATABASE_POOL_LEAK_SECONDS:
+            long_held.setdefault(alias, []).append(round(seconds, 1))
+
+    for alias in connections:
+        wrapper = connections[alias]
+        if not _is_pooled(wrapper):
+            continue
+        stats = wrapper.pool.get_stats()
+        in_use = stats['pool_size'] - stats['pool_available']
+        checkouts = stats.get('requests_num', 0)
+        pools[alias] = {
+            'min_size': stats['pool_min'],
+            'max_size': stats['pool_max'],
+            'size': stats['pool_size'],
+            'in_use': in_use,
+            'idle': stats['pool_available'],
+            'saturation': round(in_use / stats['pool_max'], 3),
+            'waiting': stats.get('requests_waiting', 0),
+            'checkouts': checkouts,
+            # Only checkouts that had to wait are timed by the pool
+            'queued_checkouts': stats.get('requests_queued', 0),
+            'avg_checkout_wait_ms': round(stats.get('requests_wait_ms', 0) / checkouts, 2) if checkouts else 0,
+            'checkout_errors': stats.get('requests_errors', 0),
+            'connections_opened': stats.get('connections_num', 0),
+            'connection_errors': stats.get('connections_errors', 0),
+            'connections_lost': stats.get('connections_lost', 0),
+            'held_too_long_seconds': long_held.get(alias, []),
+        }
+    return {'pid': os.getpid(), 'pools': pools, 'leaks_reported': _leaks_reported}
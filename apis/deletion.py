@@ -0,0 +1,203 @@
+"""
+Deleting courses, users and semesters in the background.
+
+Deleting one of them the usual way cascades through every session, record
+and enrollment that refers to it in a single transaction, after Django has
+loaded all of those rows to work out what to delete. For a course with
+years of attendance that is more memory than the web process has, and
+locks held for longer than the request may take.
+
+schedule_deletion instead marks the row pending_delete, which hides it at
+once (see LiveManager), frees its unique course code or email for reuse,
+and closes its active sessions. The delete_pending housekeeping job then
+deletes the rows that refer to it, batch by batch through their indexes,
+each batch in its own short transaction, and finally the row itself.
+Progress is kept on its PendingDeletion.
+
+A job that fails is left FAILED with the error and is run again once
+retried from the admin. Every step only deletes what is left, so a job
+that was interrupted just carries on.
+"""
+import logging
+import os
+import time
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .archive import archive_path
+from .catalog import invalidate_catalog
+from .models import (
+    AttendanceRecord, AttendanceRollup, AttendanceSession, Course, CourseEnrollment, CurrentSemester,
+    PendingDeletion, Semester, SemesterArchive, User,
+)
+from .partitions import drop_partition, is_partitioned
+
+logger = logging.getLogger(__name__)
+
+MODELS = {'course': Course, 'user': User, 'semester': Semester}
+
+
+class DeletionError(Exception):
+    """Raised when something can't be scheduled for deletion."""
+
+
+def deletion_blockers(obj):
+    """
+    Why obj can't be deleted, as a list of messages. Empty if it can.
+    """
+    blockers = []
+    if isinstance(obj, Semester):
+        if CurrentSemester.objects.filter(semester=obj).exists():
+            blockers.append("It is the current semester.")
+        # CourseEnrollment.semester is PROTECT
+        if CourseEnrollment.objects.filter(semester=obj).exists():
+            blockers.append("Course enrollments still belong to it.")
+    return blockers
+
+
+def _tombstone(model, pk):
+    """
+    Field values that free a hidden row's unique values, so a new course or
+    user can take them before the old one is gone.
+    """
+    if model == 'course':
+        return {'course_code': f"deleted-{pk}"}
+    if model == 'user':
+        return {'email': f"deleted-{pk}@deleted.invalid", 'matric_number': None, 'is_active': False}
+    return {}
+
+
+def schedule_deletion(obj, requested_by=None):
+    """
+    Hides a course, user or semester and queues it for deletion.
+    Returns its PendingDeletion.
+    """
+    model = obj._meta.model_name
+    if model not in MODELS:
+        raise DeletionError(f"{obj._meta.verbose_name.capitalize()}s are deleted the usual way.")
+    blockers = deletion_blockers(obj)
+    if blockers:
+        raise DeletionError(f"{obj} can't be deleted. {' '.join(blockers)}")
+
+    existing = PendingDeletion.objects.filter(model=model, object_id=obj.pk).exclude(status=PendingDeletion.Status.DONE).first()
+    if existing:
+        return existing
+
+    now = timezone.now()
+    session_owner = {'course': 'course_id', 'user': 'lecturer_id', 'semester': 'semester_id'}[model]
+    with transaction.atomic():
+        job = PendingDeletion.objects.create(model=model, object_id=obj.pk, label=str(obj)[:255], requested_by=requested_by)
+        MODELS[model].all_objects.filter(pk=obj.pk).update(pending_delete=True, **_tombstone(model, obj.pk))
+        # No more scans into its classes
+        AttendanceSession.objects.filter(**{session_owner: obj.pk}, is_active=True).update(is_active=False, end_time=now)
+        if model != 'user':
+            transaction.on_commit(invalidate_catalog)
+    return job
+
+
+def _drop_semester_records(semester_id):
+    # One statement on Postgres, however many records the semester has
+    drop_partition(semester_id)
+    return 0
+
+
+def _delete_archive(semester_id):
+    deleted, _ = SemesterArchive.objects.filter(semester_id=semester_id).delete()
+    if os.path.exists(archive_path(semester_id)):
+        os.remove(archive_path(semester_id))
+    return deleted
+
+
+def _steps(model, pk):
+    """
+    [(step, rows)] to delete before the row itself. rows is a queryset to
+    delete in batches, or a function that deletes and returns how many rows it did.
+    """
+    if model == 'course':
+        return [
+            # First what students see on their registration page
+            ('course enrollments', CourseEnrollment.objects.filter(course_id=pk)),
+            ('attendance records', AttendanceRecord.objects.filter(session__course_id=pk)),
+            ('attendance sessions', AttendanceSession.objects.filter(course_id=pk)),
+            ('attendance rollups', AttendanceRollup.objects.filter(course_id=pk)),
+        ]
+    if model == 'user':
+        return [
+            ('course enrollments', CourseEnrollment.objects.filter(student_id=pk)),
+            ('attendance records', AttendanceRecord.objects.filter(student_id=pk)),
+            # A lecturer's sessions take everyone's attendance in them along
+            ('attendance in their sessions', AttendanceRecord.objects.filter(session__lecturer_id=pk)),
+            ('attendance sessions', AttendanceSession.objects.filter(lecturer_id=pk)),
+        ]
+    records = (
+        (lambda: _drop_semester_records(pk)) if is_partitioned()
+        else AttendanceRecord.objects.filter(semester_id=pk)
+    )
+    return [
+        ('attendance records', records),
+        ('attendance sessions', AttendanceSession.objects.filter(semester_id=pk)),
+        ('attendance rollups', AttendanceRollup.objects.filter(semester_id=pk)),
+        ('archive', lambda: _delete_archive(pk)),
+    ]
+
+
+def _progress(job, step=None, deleted=0):
+    changes = {'rows_deleted': F('rows_deleted') + deleted}
+    if step is not None:
+        changes['step'] = step
+    PendingDeletion.objects.filter(pk=job.pk).update(**changes)
+
+
+def _delete_in_batches(job, rows, batch_size, pause):
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            pks = list(rows.values_list('pk', flat=True)[:batch_size])
+            if pks:
+                count, _ = rows.model._base_manager.filter(pk__in=pks).delete()
+                _progress(job, deleted=count)
+                deleted += count
+        if len(pks) < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def run_deletion(job, batch_size, pause=0):
+    """
+    Deletes what refers to the job's row, then the row. Returns the number of rows deleted.
+    """
+    PendingDeletion.objects.filter(pk=job.pk).update(status=PendingDeletion.Status.RUNNING, error='')
+    deleted = 0
+    for step, rows in _steps(job.model, job.object_id):
+        _progress(job, step=step)
+        if callable(rows):
+            with transaction.atomic():
+                count = rows()
+                _progress(job, deleted=count)
+            deleted += count
+        else:
+            deleted += _delete_in_batches(job, rows, batch_size, pause)
+
+    with transaction.atomic():
+        # Whatever is left is small: memberships, fingerprint, enrollment tasks, ...
+        count, _ = MODELS[job.model].all_objects.filter(pk=job.object_id).delete()
+        PendingDeletion.objects.filter(pk=job.pk).update(
+            status=PendingDeletion.Status.DONE, step='', rows_deleted=F('rows_deleted') + count, finished_at=timezone.now(),
+        )
+    return deleted + count
+
+
+def process_pending_deletions(batch_size, pause=0):
+    """
+    Runs every pending deletion. Returns the number of rows deleted.
+    """
+    deleted = 0
+    jobs = PendingDeletion.objects.filter(status__in=(PendingDeletion.Status.PENDING, PendingDeletion.Status.RUNNING)).order_by('pk')
+    for job in jobs:
+        try:
+            deleted += run_deletion(job, batch_size, pause)
+        except Exception as exc:
+            # The rows deleted so far stay deleted; a retry carries on from there
+            logger.exception("Deleting %s %s failed", job.model, job.object_id)
+            PendingDeletion.objects.filter(pk=job.pk).update(status=PendingDeletion.Status.FAILED, error=str(exc))
+    return deleted
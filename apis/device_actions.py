@@ -0,0 +1,320 @@
+"""
+The scanner's business logic, shared by the HTTP views and the WebSocket endpoint.
+
+Each action takes the decoded payload (long field names) and the sensor
+group of the calling scanner, since fingerprint slots are numbered per group,
+and returns a (data, status, compact) tuple ready for device_response().
+"""
+import base64
+import binascii
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .live import SessionFeed, set_task_state
+from .template_vault import TemplateError, store_template
+from .models import User, CurrentSemester, CourseEnrollment, Course, AttendanceSession, AttendanceRecord, EnrollmentTask, FingerprintMapping
+
+
+def reply(data, status=200, compact=None):
+    return data, status, compact
+
+
+def slot_number(value):
+    """
+    The fingerprint slot in a payload field, or None unless it is a positive
+    whole number (an int, or digits when it came as text).
+    """
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+
+def start_session(data, sensor_group_id):
+    """
+    Starts an attendance session.
+    Expected data: {"fingerprint_id": 123, "course_code": "CSC101"}
+    """
+    try:
+        fingerprint_id = data.get('fingerprint_id')
+        course_code = data.get('course_code')
+
+        if not fingerprint_id or not course_code:
+            return reply({'error': 'fingerprint_id and course_code are required.'}, status=400)
+        fingerprint_id = slot_number(fingerprint_id)
+        if fingerprint_id is None:
+            return reply({'error': 'fingerprint_id must be a positive whole number.'}, status=400)
+
+        # 1. Identify the user and verify they are a lecturer
+        # department__faculty is joined in because str(lecturer) is sent back to the device
+        lecturer = User.objects.select_related('department__faculty').get(
+            fingerprintmapping__sensor_group_id=sensor_group_id, fingerprintmapping__fingerprint_id=fingerprint_id, user_role='Lecturer'
+        )
+
+        # 2. Validate that the course exists and is assigned to this lecturer
+        course = lecturer.assigned_courses.get(course_code__iexact=course_code)
+
+        # 3. Get the current semester
+        current = CurrentSemester.objects.select_related('semester').first()
+        if not current or not current.semester:
+            return reply({'error': 'System error: Current semester is not set.'}, status=500)
+
+        # 4. Create and save the new attendance session. The database allows one
+        # active session per lecturer and per course, so two scans racing can't both win.
+        try:
+            with transaction.atomic():
+                session = AttendanceSession.objects.create(
+                    course=course,
+                    lecturer=lecturer,
+                    semester=current.semester,
+                    is_active=True
+                )
+        except IntegrityError:
+            if AttendanceSession.objects.filter(lecturer=lecturer, is_active=True).exists():
+                return reply({'error': 'You already have an active session. Please end it first.'}, status=409)
+            return reply({'error': f'{course.course_code} already has an active session.'}, status=409)
+
+        return reply({
+            'message': 'Attendance session started successfully!',
+            'session_id': session.session_id,
+            'course': course.course_name,
+            'lecturer': str(lecturer)
+        }, status=201, compact={'course': None, 'lecturer': None}) # The device already knows both
+
+    except User.DoesNotExist:
+        return reply({'error': 'Invalid fingerprint or user is not a lecturer.'}, status=403)
+    except Course.DoesNotExist:
+        return reply({'error': 'Invalid course code or you are not assigned to this course.'}, status=403)
+    except Exception as e:
+        return reply({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+
+
+def session_status(sensor_group_id):
+    """
+    Checks if there is an active attendance session.
+    """
+    # The most recent active session started by a lecturer enrolled on this scanner's sensor group.
+    # The slot comes from the same join, so there is no mapping to go missing.
+    active_session = AttendanceSession.objects.filter(
+        is_active=True, lecturer__fingerprintmapping__sensor_group_id=sensor_group_id,
+    ).order_by('-start_time').values('course__course_code', 'lecturer__fingerprintmapping__fingerprint_id').first()
+
+    if active_session:
+        # If a session is active, return its details
+        return reply({
+            "status": "active",
+            "course_code": active_session['course__course_code'],
+            "lecturer_fingerprint_id": active_session['lecturer__fingerprintmapping__fingerprint_id'],
+        })
+
+    # If no session is active
+    return reply({"status": "inactive"})
+
+
+def mark_attendance(data, sensor_group_id):
+    """
+    Marks a student's attendance.
+    Expected data: {"fingerprint_id": 456, "course_code": "CSC101"}
+    """
+    try:
+        fingerprint_id = data.get('fingerprint_id')
+        course_code = data.get('course_code')
+
+        if not fingerprint_id or not course_code:
+            return reply({'error': 'fingerprint_id and course_code are required.'}, status=400)
+        fingerprint_id = slot_number(fingerprint_id)
+        if fingerprint_id is None:
+            return reply({'error': 'fingerprint_id must be a positive whole number.'}, status=400)
+
+        # 1. Find the currently active session for the given course
+        # (at most one, see AttendanceSession.Meta.constraints)
+        active_session = AttendanceSession.objects.select_related('course').get(course__course_code__iexact=course_code, is_active=True)
+
+        # 2. Identify the student
+        # department__faculty is joined in because str(student) is sent back to the device
+        student = User.objects.select_related('department__faculty').get(
+            fingerprintmapping__sensor_group_id=sensor_group_id, fingerprintmapping__fingerprint_id=fingerprint_id, user_role='Student'
+        )
+
+        # 3. Verify the student is enrolled in this course for the current semester
+        is_enrolled = CourseEnrollment.objects.filter(
+            student=student,
+            course=active_session.course,
+            semester=active_session.semester
+        ).exists()
+
+        if not is_enrolled:
+            return reply({'error': f'Access Denied: You are not enrolled in {active_session.course.course_code}.'}, status=403)
+
+        # 4. Create the attendance record. get_or_create prevents duplicates.
+        # semester routes both the lookup and the insert to the current partition
+        record, created = AttendanceRecord.objects.get_or_create(
+            session=active_session,
+            student=student,
+            semester_id=active_session.semester_id
+        )
+
+        if created:
+            # Wake the live board for this session, if anyone in this process is watching
+            SessionFeed.notify(active_session.session_id)
+            return reply({
+                'message': 'Attendance marked successfully!',
+                'student': str(student),
+                'course': active_session.course.course_code,
+                'time': record.timestamp.strftime('%H:%M:%S')
+            }, status=201, compact={'student': student.get_full_name, 'course': None})
+
+        return reply({'message': 'You have already marked your attendance for this session.'})
+
+    except AttendanceSession.DoesNotExist:
+        return reply({'error': 'No active attendance session found for this course or session has ended.'}, status=404)
+    except User.DoesNotExist:
+        return reply({'error': 'Invalid fingerprint or user is not a student.'}, status=403)
+    except Exception as e:
+        return reply({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+
+
+def end_session(data, sensor_group_id):
+    """
+    Ends the lecturer's active attendance session.
+    Expected data: {"fingerprint_id": 123}
+    """
+    try:
+        fingerprint_id = data.get('fingerprint_id')
+
+        if not fingerprint_id:
+            return reply({'error': 'fingerprint_id is required.'}, status=400)
+        fingerprint_id = slot_number(fingerprint_id)
+        if fingerprint_id is None:
+            return reply({'error': 'fingerprint_id must be a positive whole number.'}, status=400)
+
+        # 1. Identify the lecturer
+        lecturer = User.objects.get(fingerprintmapping__sensor_group_id=sensor_group_id, fingerprintmapping__fingerprint_id=fingerprint_id, user_role='Lecturer')
+
+        # 2. Find the session they started that is currently active
+        session_to_end = AttendanceSession.objects.select_related('course').get(lecturer=lecturer, is_active=True)
+
+        # 3. Close the session
+        session_to_end.is_active = False
+        session_to_end.end_time = timezone.now()
+        session_to_end.save()
+        SessionFeed.notify(session_to_end.session_id)
+
+        # 4. Get total attendance count for feedback
+        attendance_count = AttendanceRecord.objects.filter(session=session_to_end, semester_id=session_to_end.semester_id).count()
+
+        return reply({
+            'message': 'Session ended successfully.',
+            'course': session_to_end.course.course_code,
+            'total_students_marked': attendance_count
+        })
+
+    except User.DoesNotExist:
+        return reply({'error': 'Invalid fingerprint or user is not a lecturer.'}, status=403)
+    except AttendanceSession.DoesNotExist:
+        return reply({'error': 'You do not have an active session to end.'}, status=404)
+    except Exception as e:
+        return reply({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+
+
+def next_device_command(sensor_group_id):
+    """
+    Hands the oldest pending enrollment task for the device's sensor group to the device.
+    """
+    with transaction.atomic():
+        # Find the oldest pending task and lock it for update
+        task = EnrollmentTask.objects.select_for_update(of=('self',)).select_related('user').filter(sensor_group_id=sensor_group_id, status=EnrollmentTask.Status.PENDING).order_by('created_at', 'id').first()
+
+        if task:
+            # If a task is found, mark it as processing so no other device picks it up
+            task.status = EnrollmentTask.Status.PROCESSING
+            task.save()
+
+    if task:
+        # Tell the browser waiting on this task, now that the change is committed
+        set_task_state(task)
+
+        # Send the command to the ESP32
+        command = {'command': 'enroll', 'slot': task.slot_id, 'task_id': task.id}
+        if task.user:
+            command['student'] = task.user.get_full_name  # Campaign task: show who should be at the scanner
+        return reply(command)
+
+    # No jobs pending
+    return reply({'command': 'none'})
+
+
+def report_enrollment_result(data, sensor_group_id):
+    """
+    Records the outcome of an enrollment task.
+    Expected data: {"task_id": 1, "status": "success", "message": "..."}
+    """
+    try:
+        task_id = data.get('task_id')
+        result_status = data.get('status') # e.g., "success" or "error"
+        message = data.get('message')
+
+        # A device can only report on tasks for its own group
+        task = EnrollmentTask.objects.get(id=task_id, sensor_group_id=sensor_group_id)
+
+        if result_status == 'success':
+            task.status = EnrollmentTask.Status.SUCCESS
+        else:
+            task.status = EnrollmentTask.Status.FAILED
+        task.result_message = message
+
+        with transaction.atomic():
+            if task.status == EnrollmentTask.Status.SUCCESS and task.user_id:
+                # Campaign tasks know their student, so save the mapping here
+                # instead of waiting for the browser to do it
+                try:
+                    with transaction.atomic():
+                        FingerprintMapping.objects.get_or_create(
+                            user_id=task.user_id, defaults={'sensor_group_id': task.sensor_group_id, 'fingerprint_id': task.slot_id}
+                        )
+                except IntegrityError:
+                    task.status = EnrollmentTask.Status.FAILED
+                    task.result_message = f'Slot {task.slot_id} is already mapped to another user.'
+            task.save()
+        set_task_state(task)
+
+        return reply({'status': 'result_recorded'})
+
+    except EnrollmentTask.DoesNotExist:
+        return reply({'error': 'Task not found'}, status=404)
+    except Exception as e:
+        return reply({'error': str(e)}, status=500)
+
+
+def upload_template(data, sensor_group_id):
+    """
+    Stores the server's copy of an enrolled slot's template.
+    Expected data: {"slot": 5, "template": <bytes>}, with the template
+    as MessagePack binary, or base64 text when sent as JSON.
+    """
+    slot = data.get('slot')
+    template = data.get('template')
+
+    if not slot or not template:
+        return reply({'error': 'slot and template are required.'}, status=400)
+    slot = slot_number(slot)
+    if slot is None:
+        return reply({'error': 'slot must be a positive whole number.'}, status=400)
+
+    if isinstance(template, str):
+        try:
+            template = base64.b64decode(template, validate=True)
+        except binascii.Error:
+            return reply({'error': 'template must be base64 encoded.'}, status=400)
+
+    # Only keep templates for slots someone is actually enrolled on
+    if not FingerprintMapping.objects.filter(sensor_group_id=sensor_group_id, fingerprint_id=slot).exists():
+        return reply({'error': f'Slot {slot} is not enrolled in this sensor group.'}, status=404)
+
+    try:
+        store_template(sensor_group_id, slot, template)
+    except TemplateError as e:
+        return reply({'error': str(e)}, status=400)
+
+    return reply({'status': 'template_stored'}, status=201)
+
@@ -0,0 +1,305 @@
+"""
+Encoding and decoding of scanner payloads.
+
+Devices may talk JSON (the default) or a compact MessagePack encoding with
+short field codes, picked by the Content-Type and Accept headers.
+Only the subset of MessagePack the device API needs is implemented:
+nil, booleans, integers, floats, strings, binary, arrays and maps.
+"""
+import json
+import struct
+from django.http import HttpResponse, JsonResponse
+
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+MSGPACK_CONTENT_TYPE = MSGPACK_CONTENT_TYPES[0]
+
+# Long field names used by the views -> short codes sent over the wire
+FIELD_CODES = {
+    'fingerprint_id': 'f',
+    'course_code': 'c',
+    'course': 'n',
+    'task_id': 't',
+    'status': 's',
+    'message': 'm',
+    'error': 'e',
+    'session_id': 'i',
+    'lecturer': 'l',
+    'student': 'u',
+    'time': 'h',
+    'total_students_marked': 'k',
+    'lecturer_fingerprint_id': 'lf',
+    'command': 'x',
+    'slot': 'o',
+    'template': 'tp',
+    'idempotency_key': 'ik',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+# Deepest nesting of arrays and maps accepted. Real payloads are one or two
+# levels deep; the cap keeps hostile input from exhausting the Python stack.
+MAX_NESTING_DEPTH = 32
+
+
+class PayloadError(ValueError):
+    """Raised when a device request body can't be decoded."""
+
+
+# MESSAGEPACK ENCODER
+
+def msgpack_encode(obj):
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        _pack_int(obj, out)
+    elif isinstance(obj, float):
+        out.append(0xcb)
+        out += struct.pack('>d', obj)
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        size = len(data)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 0x100:
+            out += struct.pack('>BB', 0xd9, size)
+        elif size < 0x10000:
+            out += struct.pack('>BH', 0xda, size)
+        else:
+            out += struct.pack('>BI', 0xdb, size)
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        size = len(obj)
+        if size < 0x100:
+            out += struct.pack('>BB', 0xc4, size)
+        elif size < 0x10000:
+            out += struct.pack('>BH', 0xc5, size)
+        else:
+            out += struct.pack('>BI', 0xc6, size)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(len(obj), 0x90, 0xdc, 0xdd, out)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack_header(len(obj), 0x80, 0xde, 0xdf, out)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"Cannot encode {type(obj).__name__} as MessagePack")
+
+
+def _pack_header(size, fix, code16, code32, out):
+    if size < 16:
+        out.append(fix | size)
+    elif size < 0x10000:
+        out += struct.pack('>BH', code16, size)
+    else:
+        out += struct.pack('>BI', code32, size)
+
+
+def _pack_int(value, out):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out += struct.pack('>b', value)
+    elif value >= 0:
+        for code, fmt, limit in ((0xcc, 'B', 0x100), (0xcd, 'H', 0x10000), (0xce, 'I', 0x100000000), (0xcf, 'Q', 1 << 64)):
+            if value < limit:
+                out += struct.pack('>B' + fmt, code, value)
+                return
+        raise OverflowError("Integer too large for MessagePack")
+    else:
+        for code, fmt, limit in ((0xd0, 'b', 1 << 7), (0xd1, 'h', 1 << 15), (0xd2, 'i', 1 << 31), (0xd3, 'q', 1 << 63)):
+            if value >= -limit:
+                out += struct.pack('>B' + fmt, code, value)
+                return
+        raise OverflowError("Integer too large for MessagePack")
+
+
+# MESSAGEPACK DECODER
+
+# Fixed-size types: first byte -> (struct format, size)
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# Length-prefixed types: first byte -> (kind, length format, length size)
+_SIZED = {
+    0xc4: ('bin', '>B', 1), 0xc5: ('bin', '>H', 2), 0xc6: ('bin', '>I', 4),
+    0xd9: ('str', '>B', 1), 0xda: ('str', '>H', 2), 0xdb: ('str', '>I', 4),
+    0xdc: ('array', '>H', 2), 0xdd: ('array', '>I', 4),
+    0xde: ('map', '>H', 2), 0xdf: ('map', '>I', 4),
+}
+
+
+def msgpack_decode(data):
+    try:
+        obj, offset = _unpack(memoryview(data), 0, 0)
+    except (IndexError, struct.error, UnicodeDecodeError, TypeError) as e:
+        raise PayloadError("Invalid MessagePack payload.") from e
+    if offset != len(data):
+        raise PayloadError("Invalid MessagePack payload.")
+    return obj
+
+
+def _unpack(data, offset, depth):
+    code = data[offset]
+    offset += 1
+
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if 0xa0 <= code <= 0xbf:
+        return _read_str(data, offset, code & 0x1f)
+    if 0x90 <= code <= 0x9f:
+        return _read_array(data, offset, code & 0x0f, depth)
+    if 0x80 <= code <= 0x8f:
+        return _read_map(data, offset, code & 0x0f, depth)
+    if code == 0xc0:
+        return None, offset
+    if code in (0xc2, 0xc3):
+        return code == 0xc3, offset
+    if code in _FIXED:
+        fmt, size = _FIXED[code]
+        return struct.unpack_from(fmt, data, offset)[0], offset + size
+    if code in _SIZED:
+        kind, fmt, size = _SIZED[code]
+        length = struct.unpack_from(fmt, data, offset)[0]
+        offset += size
+        if kind == 'str':
+            return _read_str(data, offset, length)
+        if kind == 'bin':
+            if offset + length > len(data):
+                raise IndexError("Truncated binary")
+            return bytes(data[offset:offset + length]), offset + length
+        if kind == 'array':
+            return _read_array(data, offset, length, depth)
+        return _read_map(data, offset, length, depth)
+
+    raise PayloadError("Unsupported MessagePack type.")
+
+
+def _read_str(data, offset, length):
+    if offset + length > len(data):
+        raise IndexError("Truncated string")
+    return str(data[offset:offset + length], 'utf-8'), offset + length
+
+
+def _check_depth(depth):
+    if depth >= MAX_NESTING_DEPTH:
+        raise PayloadError("MessagePack payload is nested too deeply.")
+
+
+def _read_array(data, offset, length, depth):
+    _check_depth(depth)
+    items = []
+    for _ in range(length):
+        item, offset = _unpack(data, offset, depth + 1)
+        items.append(item)
+    return items, offset
+
+
+def _read_map(data, offset, length, depth):
+    _check_depth(depth)
+    result = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset, depth + 1)
+        value, offset = _unpack(data, offset, depth + 1)
+        result[key] = value
+    return result, offset
+
+
+def json_decode(text):
+    """
+    json.loads, raising PayloadError for bad input. Nesting deep enough to
+    hit Python's recursion limit is bad input too.
+    """
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, RecursionError) as e:
+        raise PayloadError("Invalid JSON format.") from e
+
+
+# FIELD CODES
+
+def expand_fields(obj):
+    """Turns short field codes back into the long names the views use."""
+    if isinstance(obj, dict):
+        return {FIELD_NAMES.get(k, k): expand_fields(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [expand_fields(item) for item in obj]
+    return obj
+
+
+def compact_fields(obj):
+    """Replaces long field names with their short codes."""
+    if isinstance(obj, dict):
+        return {FIELD_CODES.get(k, k): compact_fields(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [compact_fields(item) for item in obj]
+    return obj
+
+
+# REQUEST / RESPONSE HELPERS
+
+def is_msgpack_request(request):
+    return request.content_type in MSGPACK_CONTENT_TYPES
+
+
+def wants_msgpack(request):
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return any(content_type in accept for content_type in MSGPACK_CONTENT_TYPES)
+
+
+def decode_payload(request, many=False):
+    """
+    Decodes a device request body into a dict with long field names,
+    whatever the encoding. With many=True a list of dicts is also accepted,
+    for batched requests. Raises PayloadError on bad input.
+    """
+    if is_msgpack_request(request):
+        data = expand_fields(msgpack_decode(request.body))
+    else:
+        data = json_decode(request.body)
+
+    if isinstance(data, dict):
+        return data
+    if many and isinstance(data, list) and all(isinstance(item, dict) for item in data):
+        return data
+    raise PayloadError("Payload must be an object or a list of objects." if many else "Payload must be an object.")
+
+
+def pack_message(data, compact=None):
+    """
+    Encodes a reply as MessagePack with short field codes.
+
+    `compact` holds overrides used only for MessagePack, e.g. a short
+    student name instead of the full description. A value of None drops the field.
+    """
+    if compact and isinstance(data, dict):
+        data = {**data, **compact}
+        data = {k: v for k, v in data.items() if v is not None}
+    return msgpack_encode(compact_fields(data))
+
+
+def device_response(request, data, status=200, compact=None):
+    """
+    Builds a response in the encoding the device asked for.
+    See pack_message() for `compact`.
+    """
+    if not wants_msgpack(request):
+        return JsonResponse(data, status=status, safe=isinstance(data, dict))
+
+    return HttpResponse(pack_message(data, compact), status=status, content_type=MSGPACK_CONTENT_TYPE)
@@ -0,0 +1,273 @@
+"""
+Persistent WebSocket connection for scanners (ws://<server>/ws/device/).
+
+A device keeps one socket open instead of paying a TCP connect and HTTP
+round trip per scan. Every frame is a request tagged with an `id` and an `op`:
+
+    {"id": 7, "op": "mark", "fingerprint_id": 456, "course_code": "CSC101"}
+
+and the reply carries the same `id`, the HTTP-equivalent status as `code`,
+and the same fields the HTTP endpoint would return. Requests are handled
+concurrently, so replies may arrive out of order. Binary frames use
+MessagePack with short field codes, text frames use JSON.
+
+A frame may carry an `idempotency_key`. It shares the idempotency cache
+with the op's HTTP endpoint, so when the device gives up waiting and
+retries over HTTP with the same key, the request only runs once.
+
+While the device says it is idle (`{"op": "idle"}`), enrollment commands
+are pushed down the same socket as {"op": "command", ...} frames.
+"""
+import asyncio
+import json
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import reverse
+from . import device_actions
+from .device_codec import PayloadError, expand_fields, json_decode, msgpack_decode, pack_message
+from .idempotency import MAX_KEY_LENGTH, IdempotencyConflict, _cache_key, claim, payload_hash, release, remember, stored_reply
+from .sensors import get_sensor_group_id
+from .throttling import take_token
+
+logger = logging.getLogger(__name__)
+
+# op -> (action, throttle scope)
+OPERATIONS = {
+    'start': (device_actions.start_session, 'session'),
+    'mark': (device_actions.mark_attendance, 'mark'),
+    'end': (device_actions.end_session, 'session'),
+    'status': (lambda data, sensor_group_id: device_actions.session_status(sensor_group_id), 'command'),
+    'result': (device_actions.report_enrollment_result, 'command'),
+    # Templates are only taken over signed HTTP requests (see upload_fingerprint_template)
+}
+# op -> URL name of the HTTP endpoint whose idempotency keys it shares
+IDEMPOTENT_OPERATIONS = {
+    'start': 'api-start-session',
+    'mark': 'api-mark-attendance',
+    'end': 'api-end-session',
+    'result': 'report-enrollment-result',
+}
+# Frame fields that aren't part of the request itself
+FRAME_FIELDS = ('id', 'op', 'idempotency_key')
+
+# Event loops and events of the sockets in this process waiting for commands
+_listeners = set()
+_listeners_lock = threading.Lock()
+
+
+def wake_device_sockets():
+    """
+    Tells the connected devices in this process that a command is waiting,
+    so it is pushed right away instead of at the next poll. Safe to call from sync views.
+    """
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for loop, event in listeners:
+        loop.call_soon_threadsafe(event.set)
+
+
+def _run_action(action, *args):
+    # Runs in a worker thread, so manage the DB connection like a request would
+    close_old_connections()
+    try:
+        return action(*args)
+    finally:
+        close_old_connections()
+
+
+run_action = sync_to_async(_run_action, thread_sensitive=False)
+
+
+def _device_id(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'x-device-id':
+            return value.decode('latin-1')
+    return None
+
+
+def _device_identity(scope):
+    device_id = _device_id(scope)
+    if device_id:
+        return f"device:{device_id}"
+    client = scope.get('client') or ('unknown',)
+    return f"ip:{client[0]}"
+
+
+class DeviceConnection:
+    def __init__(self, scope, send):
+        self.identity = _device_identity(scope)
+        self.device_id = _device_id(scope)
+        self.sensor_group_id = None  # Looked up on first use, see get_sensor_group_id()
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self._pipeline = asyncio.Semaphore(settings.DEVICE_SOCKET_PIPELINE_DEPTH)
+        self._tasks = set()
+        self._binary = True  # Pushed frames use the encoding the device last used
+        self._idle = False
+        self._wakeup = asyncio.Event()
+
+    async def send_frame(self, data, compact=None, binary=None):
+        if binary is None:
+            binary = self._binary
+        if binary:
+            frame = {'type': 'websocket.send', 'bytes': pack_message(data, compact)}
+        else:
+            frame = {'type': 'websocket.send', 'text': json.dumps(data)}
+        async with self._send_lock:
+            await self._send(frame)
+
+    def receive_frame(self, message):
+        self._binary = message.get('bytes') is not None
+        if self._binary:
+            frame = expand_fields(msgpack_decode(message['bytes']))
+        else:
+            frame = json_decode(message.get('text') or '')
+
+        if not isinstance(frame, dict):
+            raise PayloadError("Each frame must be an object.")
+        return frame
+
+    def dispatch(self, frame):
+        op = frame.get('op')
+        if op in ('idle', 'busy'):
+            # Only push enrollment commands while the device is free to run them
+            self._idle = op == 'idle'
+            if self._idle:
+                self._wakeup.set()
+            return
+
+        task = asyncio.create_task(self.handle(frame, self._binary))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def get_sensor_group_id(self):
+        if self.sensor_group_id is None:
+            self.sensor_group_id = await run_action(get_sensor_group_id, self.device_id)
+        return self.sensor_group_id
+
+    async def handle(self, frame, binary):
+        # Replies use the same encoding as the frame they answer
+        request_id = frame.get('id')
+        try:
+            await self.run_frame(frame, request_id, binary)
+        except PayloadError as e:
+            await self.send_frame({'id': request_id, 'code': 400, 'error': str(e)}, binary=binary)
+        except Exception:
+            # Answer the frame anyway, so the device doesn't wait for a reply that never comes
+            logger.exception("Device socket %s: %s frame failed", self.identity, frame.get('op'))
+            await self.send_frame({'id': request_id, 'code': 500, 'error': 'Server error. Please try again.'}, binary=binary)
+
+    async def run_frame(self, frame, request_id, binary):
+        op = frame.get('op')
+
+        if op not in OPERATIONS:
+            await self.send_frame({'id': request_id, 'code': 400, 'error': f'Unknown op: {op}'}, binary=binary)
+            return
+
+        action, scope = OPERATIONS[op]
+        limits = settings.DEVICE_THROTTLE_SCOPES[scope]
+        allowed, wait = take_token(scope, self.identity, limits['rate'], limits['burst'])
+        if not allowed:
+            await self.send_frame({'id': request_id, 'code': 429, 'error': 'Too many requests from this device. Slow down.', 'retry_after': wait}, binary=binary)
+            return
+
+        sensor_group_id = await self.get_sensor_group_id()
+        if frame.get('idempotency_key') and op in IDEMPOTENT_OPERATIONS:
+            data, status, compact = await self.run_idempotent(action, frame, sensor_group_id, IDEMPOTENT_OPERATIONS[op])
+        else:
+            async with self._pipeline:
+                data, status, compact = await run_action(action, frame, sensor_group_id)
+
+        await self.send_frame({'id': request_id, 'code': status, **data}, compact, binary)
+
+    async def run_idempotent(self, action, frame, sensor_group_id, url_name):
+        # The same cache entry as the HTTP endpoint, see apis/idempotency.py
+        key = frame['idempotency_key']
+        if not isinstance(key, str) or len(key) > MAX_KEY_LENGTH:
+            return {'error': f'idempotency_key must be text of at most {MAX_KEY_LENGTH} characters.'}, 400, None
+
+        cache_key = _cache_key(self.device_id or '', reverse(url_name), key)
+        body_hash = payload_hash({k: v for k, v in frame.items() if k not in FRAME_FIELDS})
+        try:
+            stored = claim(cache_key, body_hash)
+        except IdempotencyConflict as e:
+            return {'error': str(e)}, e.status, None
+        if stored is not None:
+            return stored_reply(stored)
+
+        try:
+            async with self._pipeline:
+                data, status, compact = await run_action(action, frame, sensor_group_id)
+            # Only remember final answers. Server errors should be retried for real.
+            if status < 500:
+                remember(cache_key, {'body_hash': body_hash, 'status': status, 'data': data, 'compact': compact})
+        finally:
+            release(cache_key)
+        return data, status, compact
+
+    async def push_commands(self):
+        loop = asyncio.get_running_loop()
+        with _listeners_lock:
+            _listeners.add((loop, self._wakeup))
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.DEVICE_SOCKET_COMMAND_POLL)
+                except asyncio.TimeoutError:
+                    pass  # Fall back to checking now and then, for tasks queued in other processes
+                self._wakeup.clear()
+
+                if not self._idle:
+                    continue
+
+                try:
+                    sensor_group_id = await self.get_sensor_group_id()
+                    data, status, compact = await run_action(device_actions.next_device_command, sensor_group_id)
+                    if data.get('command') != 'none':
+                        # The device will be busy enrolling until it tells us it is idle again
+                        self._idle = False
+                        await self.send_frame({'op': 'command', **data}, compact)
+                except Exception:
+                    # E.g. the database is briefly unreachable; try again at the next wakeup or poll
+                    logger.exception("Device socket %s: pushing a command failed", self.identity)
+        finally:
+            with _listeners_lock:
+                _listeners.discard((loop, self._wakeup))
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+async def device_socket(scope, receive, send):
+    """
+    ASGI application for the device WebSocket.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    connection = DeviceConnection(scope, send)
+    pusher = asyncio.create_task(connection.push_commands())
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] != 'websocket.receive':
+                continue
+
+            try:
+                frame = connection.receive_frame(message)
+            except PayloadError as e:
+                await connection.send_frame({'code': 400, 'error': str(e)})
+                continue
+
+            connection.dispatch(frame)
+    finally:
+        pusher.cancel()
+        connection.close()
@@ -0,0 +1,155 @@
+"""
+Fingerprint slot allocation and batch enrollment campaigns.
+
+Slots are numbered per sensor group (see SensorGroup), so the number of
+fingerprints grows with the number of groups rather than one sensor's memory.
+"""
+import heapq
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Count, Exists, Max, Min, OuterRef, Q
+from .models import FingerprintMapping, User, EnrollmentTask, EnrollmentCampaign, SensorGroup
+
+# Tasks in these states still hold their slot
+ACTIVE_TASK_STATES = (EnrollmentTask.Status.PENDING, EnrollmentTask.Status.PROCESSING)
+SLOT_LOCK_ID = 0x51075  # Arbitrary key for the Postgres advisory lock below
+
+
+def _lock_slots():
+    """
+    Serialises slot allocation until the end of the transaction,
+    so two admins can't be handed the same slots.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [SLOT_LOCK_ID])
+
+
+def _used_slots():
+    """
+    Returns {sensor group ID: set of slots}. A slot is taken if a fingerprint
+    is mapped to it or an unfinished task is waiting on it.
+    """
+    used = defaultdict(set)
+    for group_id, slot in FingerprintMapping.objects.values_list('sensor_group_id', 'fingerprint_id'):
+        used[group_id].add(slot)
+    for group_id, slot in EnrollmentTask.objects.filter(status__in=ACTIVE_TASK_STATES).values_list('sensor_group_id', 'slot_id'):
+        used[group_id].add(slot)
+    return used
+
+
+def allocate_slots(count, sensor_group_id=None):
+    """
+    Returns up to `count` free (sensor group ID, slot) pairs. Each slot goes
+    to the group with the most room left, so the groups fill evenly.
+    Pass sensor_group_id to allocate from one group only.
+    """
+    groups = SensorGroup.objects.values_list('pk', 'capacity')
+    if sensor_group_id:
+        groups = groups.filter(pk=sensor_group_id)
+    used = _used_slots()
+
+    # Heap of (-free slots, group ID, capacity, lowest slot that might be free)
+    heap = []
+    for group_id, capacity in groups:
+        free = capacity - sum(1 for slot in used[group_id] if slot <= capacity)
+        if free > 0:
+            heap.append((-free, group_id, capacity, 1))
+    heapq.heapify(heap)
+
+    slots = []
+    while heap and len(slots) < count:
+        free, group_id, capacity, slot = heapq.heappop(heap)
+        while slot in used[group_id]:
+            slot += 1
+        slots.append((group_id, slot))
+        if free + 1 < 0:
+            heapq.heappush(heap, (free + 1, group_id, capacity, slot + 1))
+    return slots
+
+
+def students_without_fingerprint(department=None, level=None):
+    """
+    Students with no fingerprint enrolled and no enrollment already queued for them.
+    """
+    students = User.objects.filter(user_role='Student', fingerprintmapping__isnull=True).exclude(
+        enrollment_tasks__status__in=ACTIVE_TASK_STATES
+    )
+    if department:
+        students = students.filter(department=department)
+    if level:
+        students = students.filter(level=level)
+    return students.order_by('matric_number')
+
+
+def create_campaign(department=None, level=None, created_by=None):
+    """
+    Queues an enrollment task for every matching student in one transaction.
+    Returns (campaign, number of students left out because the sensor is full).
+    """
+    with transaction.atomic():
+        _lock_slots()
+
+        students = list(students_without_fingerprint(department, level).only('user_id'))
+        slots = allocate_slots(len(students))
+
+        campaign = EnrollmentCampaign.objects.create(department=department, level=level or '', created_by=created_by)
+
+        # Slots are unique per group, so clear out finished tasks left over on the slots we reuse
+        reused = defaultdict(list)
+        for group_id, slot in slots:
+            reused[group_id].append(slot)
+        for group_id, group_slots in reused.items():
+            EnrollmentTask.objects.filter(sensor_group_id=group_id, slot_id__in=group_slots).exclude(status__in=ACTIVE_TASK_STATES).delete()
+
+        EnrollmentTask.objects.bulk_create([
+            EnrollmentTask(sensor_group_id=group_id, slot_id=slot, user=student, campaign=campaign)
+            for (group_id, slot), student in zip(slots, students)
+        ])
+
+    return campaign, len(students) - len(slots)
+
+
+def campaign_progress(campaign):
+    """
+    Task counts by status, and throughput in enrollments per minute, in one query.
+    """
+    stats = campaign.tasks.aggregate(
+        total=Count('id'),
+        pending=Count('id', filter=Q(status=EnrollmentTask.Status.PENDING)),
+        processing=Count('id', filter=Q(status=EnrollmentTask.Status.PROCESSING)),
+        succeeded=Count('id', filter=Q(status=EnrollmentTask.Status.SUCCESS)),
+        failed=Count('id', filter=Q(status__in=[EnrollmentTask.Status.FAILED, EnrollmentTask.Status.TIMED_OUT])),
+        first_done=Min('updated_at', filter=~Q(status__in=ACTIVE_TASK_STATES)),
+        last_done=Max('updated_at', filter=~Q(status__in=ACTIVE_TASK_STATES)),
+    )
+
+    done = stats['succeeded'] + stats['failed']
+    per_minute = None
+    if done > 1:
+        minutes = (stats['last_done'] - stats['first_done']).total_seconds() / 60
+        if minutes > 0:
+            per_minute = round((done - 1) / minutes, 1)
+
+    return {
+        'total': stats['total'],
+        'pending': stats['pending'],
+        'processing': stats['processing'],
+        'succeeded': stats['succeeded'],
+        'failed': stats['failed'],
+        'per_minute': per_minute,
+    }
+
+
+def requeue_failed(campaign):
+    """
+    Puts the campaign's failed and timed out tasks back in the queue.
+    """
+    return campaign.tasks.filter(
+        status__in=[EnrollmentTask.Status.FAILED, EnrollmentTask.Status.TIMED_OUT]
+    ).exclude(
+        # Skip students enrolled some other way since, and slots taken since
+        Q(user__fingerprintmapping__isnull=False) | Q(Exists(FingerprintMapping.objects.filter(
+            sensor_group_id=OuterRef('sensor_group_id'), fingerprint_id=OuterRef('slot_id')
+        )))
+    ).update(status=EnrollmentTask.Status.PENDING, result_message='')
@@ -1,5 +1,7 @@
 from django import forms
-from .models import CourseEnrollment, Course, CurrentSemester
+from django.db import transaction
+from .models import CourseEnrollment, Course, CurrentSemester, EnrollmentCampaign
+from .catalog import eligible_courses
 
 class StudentEnrollmentForm(forms.Form):
     matric_number = forms.CharField(label="Enter Matric Number")
@@ -9,54 +11,99 @@ class LecturerEnrollmentForm(forms.Form):
     email = forms.EmailField(label="Enter your work email address")
 
 
-class CourseEnrollmentForm(forms.ModelForm):
+class EnrollmentCampaignForm(forms.ModelForm):
     class Meta:
-        model = CourseEnrollment
-        fields = ['course']
+        model = EnrollmentCampaign
+        fields = ['department', 'level']
+        help_texts = {
+            'department': "Leave blank to include every department.",
+            'level': "Leave blank to include every level.",
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Each option's label is str(department), which shows its faculty
+        self.fields['department'].queryset = self.fields['department'].queryset.select_related('faculty')
+
+
+class CourseChoiceField(forms.TypedMultipleChoiceField):
+    def valid_value(self, value):
+        # CourseEnrollmentForm checks each course itself, so every problem is reported at once
+        return True
+
+
+class CourseEnrollmentForm(forms.Form):
+    """
+    Registers a student for several courses at once. The choices and checks
+    come from the cached catalog (apis/catalog.py) and the courses the student
+    is already enrolled in, rather than a Course query per course.
+    """
+    courses = CourseChoiceField(coerce=int, label="Courses", widget=forms.CheckboxSelectMultiple)
 
     def __init__(self, *args, **kwargs):
         # We need the user to perform validation checks
         self.user = kwargs.pop('user', None)
+        # The view has usually loaded these already; otherwise they are looked up
+        self.current_semester = kwargs.pop('semester', None)
+        self.enrolled_course_ids = kwargs.pop('enrolled_course_ids', None)
         super().__init__(*args, **kwargs)
 
-        if not self.user:
-            # If no user is provided, we can't proceed
-            self.fields['course'].queryset = Course.objects.none()
-            return
-            
-        try:
-            # Store current semester for use in the clean method
-            self.current_semester = CurrentSemester.objects.select_related('semester').first().semester
-            # Filter courses to only show those available this semester and for the student's department
-            self.fields['course'].queryset = Course.objects.filter(
-                available_semesters=self.current_semester,
-                departments=self.user.department,
-                minimum_level__lte=self.user.level
-            ).distinct()
-        except (CurrentSemester.DoesNotExist, AttributeError):
-            self.current_semester = None
-            self.fields['course'].queryset = Course.objects.none()
-
-    def clean(self):
-        cleaned_data = super().clean()
-        course = cleaned_data.get('course')
-        student = self.user
-        semester = self.current_semester
-
-        # Ensure all required data is present before validation
-        if not (course and student and semester):
-            # This will be caught by field-level validation, but it's a good safeguard
+        self.catalog = {}
+        if self.user:
+            if self.current_semester is None:
+                current = CurrentSemester.objects.select_related('semester').first()
+                self.current_semester = current.semester if current else None
+            if self.current_semester and self.enrolled_course_ids is None:
+                self.enrolled_course_ids = set(CourseEnrollment.objects.filter(
+                    student=self.user, semester=self.current_semester,
+                ).values_list('course_id', flat=True))
+            # Courses available this semester for the student's department and level
+            if self.current_semester:
+                courses = eligible_courses(self.current_semester.pk, self.user.department_id, self.user.level)
+                self.catalog = {course[0]: course for course in courses}
+        self.fields['courses'].choices = [
+            (course_id, f"{code} - {name}") for course_id, code, name, _ in self.catalog.values()
+            if course_id not in (self.enrolled_course_ids or ())
+        ]
+
+    def clean_courses(self):
+        if not (self.user and self.current_semester):
             raise forms.ValidationError("Could not validate the enrollment. Missing data.")
 
-        # Check for duplicate enrollment
-        if CourseEnrollment.objects.filter(student=student, course=course, semester=semester).exists():
-            self.add_error('course', f"You are already enrolled in {course.course_code}.")
+        courses, errors, unknown = [], [], []
+        for course_id in dict.fromkeys(self.cleaned_data['courses']):
+            course = self.catalog.get(course_id)
+            if course is None:
+                unknown.append(course_id)
+            elif course_id in self.enrolled_course_ids:
+                errors.append(forms.ValidationError(f"You are already enrolled in {course[1]}.", code='enrolled'))
+            else:
+                courses.append(course)
+        if unknown:
+            # Only reached from a stale page or a hand-made request, so the extra query is fine
+            codes = dict(Course.objects.filter(pk__in=unknown).values_list('pk', 'course_code'))
+            errors += [
+                forms.ValidationError(
+                    f"{codes[course_id]} is not open to your department and level this semester." if course_id in codes
+                    else "One of the selected courses no longer exists.",
+                    code='not_eligible',
+                )
+                for course_id in unknown
+            ]
+        if errors:
+            raise forms.ValidationError(errors)
+        return courses
 
-        # Check if student's level is sufficient
-        if student.level and int(student.level) < int(course.minimum_level):
-            self.add_error('course', 
-                f"Your level ({student.level}) is not high enough for this course. "
-                f"Minimum level required: {course.minimum_level}."
+    def save(self):
+        """
+        Enrolls the student in every selected course with one INSERT, and
+        returns their course codes. A course enrolled in by a racing request
+        in the meantime is skipped by the database, leaving the same result.
+        """
+        courses = self.cleaned_data['courses']
+        with transaction.atomic():
+            CourseEnrollment.objects.bulk_create(
+                [CourseEnrollment(student=self.user, course_id=course_id, semester=self.current_semester) for course_id, *_ in courses],
+                ignore_conflicts=True,
             )
-
-        return cleaned_data
\ No newline at end of file
+        return [code for _, code, _, _ in courses]
@@ -0,0 +1,127 @@
+"""
+Periodic clean-up jobs, run by the housekeeping management command.
+
+- close_stale_sessions ends sessions left open longer than
+  ATTENDANCE_SESSION_MAX_MINUTES, for lecturers who forget to scan out.
+- time_out_stale_tasks marks enrollment tasks TIMED_OUT when a device took
+  them and never reported back, or when nobody took an admin's single task,
+  within ENROLLMENT_TASK_TIMEOUT seconds. Campaign tasks waiting their turn
+  in the queue are left alone.
+- purge_finished_tasks deletes tasks finished more than
+  ENROLLMENT_TASK_RETENTION_DAYS ago.
+- purge_expired_sessions deletes expired login sessions from django_session.
+- process_pending_deletions deletes the courses, users and semesters
+  deleted from the admin (see apis/deletion.py).
+
+Rows are handled HOUSEKEEPING_BATCH_SIZE at a time, each batch in its own
+short transaction. No run holds locks for long or leaves one huge pile of
+dead rows for VACUUM at once.
+"""
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .deletion import process_pending_deletions
+from .live import TASK_FINAL_STATES, set_task_state
+from .models import AttendanceSession, EnrollmentTask
+
+HOUSEKEEPING_LOCK_ID = 0x40053  # Arbitrary key for the Postgres advisory lock below
+# Database-backed session engines; the others expire sessions by themselves
+DB_SESSION_ENGINES = ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db')
+
+
+@contextmanager
+def housekeeping_lock():
+    """
+    Yields whether this process may run the jobs: one housekeeper at a time.
+    The lock is only tried, not waited for, so a second daemon started by
+    mistake skips the pass while another one holds it.
+    """
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [HOUSEKEEPING_LOCK_ID])
+        locked = cursor.fetchone()[0]
+    try:
+        yield locked
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [HOUSEKEEPING_LOCK_ID])
+
+
+def _in_batches(queryset, apply, batch_size, pause):
+    """
+    Calls apply(primary keys) on up to batch_size rows of the queryset at a
+    time, each batch in its own transaction, until no rows are left. apply
+    must take the rows out of the queryset. Returns the number of rows handled.
+    """
+    handled = 0
+    while True:
+        with transaction.atomic():
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if pks:
+                handled += apply(pks)
+        if len(pks) < batch_size:
+            return handled
+        time.sleep(pause)
+
+
+def close_stale_sessions(batch_size, pause=0):
+    now = timezone.now()
+    stale = AttendanceSession.objects.filter(
+        is_active=True, start_time__lt=now - timedelta(minutes=settings.ATTENDANCE_SESSION_MAX_MINUTES),
+    ).order_by('pk')
+    # end_time is when the session was closed, so the rollups still pick it up
+    return _in_batches(stale, lambda pks: AttendanceSession.objects.filter(pk__in=pks, is_active=True).update(
+        is_active=False, end_time=now,
+    ), batch_size, pause)
+
+
+def time_out_stale_tasks(batch_size, pause=0):
+    message = "No result from the device in time."
+    stale = EnrollmentTask.objects.filter(
+        Q(status=EnrollmentTask.Status.PROCESSING) | Q(status=EnrollmentTask.Status.PENDING, campaign__isnull=True),
+        updated_at__lt=timezone.now() - timedelta(seconds=settings.ENROLLMENT_TASK_TIMEOUT),
+    ).order_by('pk')
+
+    def time_out(pks):
+        updated = EnrollmentTask.objects.filter(pk__in=pks).update(
+            status=EnrollmentTask.Status.TIMED_OUT, result_message=message, updated_at=timezone.now(),
+        )
+        for pk in pks:
+            # Pages still watching the task see it end
+            set_task_state(EnrollmentTask(id=pk, status=EnrollmentTask.Status.TIMED_OUT, result_message=message))
+        return updated
+
+    return _in_batches(stale, time_out, batch_size, pause)
+
+
+def purge_finished_tasks(batch_size, pause=0):
+    old = EnrollmentTask.objects.filter(
+        status__in=TASK_FINAL_STATES,
+        updated_at__lt=timezone.now() - timedelta(days=settings.ENROLLMENT_TASK_RETENTION_DAYS),
+    ).order_by('pk')
+    return _in_batches(old, lambda pks: EnrollmentTask.objects.filter(pk__in=pks).delete()[0], batch_size, pause)
+
+
+def purge_expired_sessions(batch_size, pause=0):
+    if settings.SESSION_ENGINE not in DB_SESSION_ENGINES:
+        return 0
+    expired = Session.objects.filter(expire_date__lt=timezone.now()).order_by('expire_date')
+    return _in_batches(expired, lambda pks: Session.objects.filter(pk__in=pks).delete()[0], batch_size, pause)
+
+
+# (name, job, seconds between runs)
+JOBS = [
+    ('close_stale_sessions', close_stale_sessions, 60),
+    ('time_out_stale_tasks', time_out_stale_tasks, 60),
+    ('purge_finished_tasks', purge_finished_tasks, 3600),
+    ('purge_expired_sessions', purge_expired_sessions, 3600),
+    ('delete_pending', process_pending_deletions, 60),
+]
@@ -0,0 +1,138 @@
+import hashlib
+import json
+from functools import wraps
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from .device_codec import MSGPACK_CONTENT_TYPES, PayloadError, decode_payload, device_response, expand_fields, msgpack_decode
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 128
+IN_FLIGHT_TIMEOUT = 30  # Seconds before an abandoned in-flight marker expires
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a key can't be used for this request. Carries the HTTP status to answer with."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def _cache_key(device_id, path, key):
+    # Scope keys to the scanner and the endpoint so the same key from two scanners, or on two views, never collides.
+    # Socket frames use their op's HTTP path, so a request retried over HTTP finds the socket's answer.
+    return 'idem:' + hashlib.sha256(f"{device_id}|{path}|{key}".encode()).hexdigest()
+
+
+def payload_hash(data):
+    """
+    Hash of a decoded request payload. The same fields hash the same whether
+    they came as JSON, MessagePack or a socket frame.
+    """
+    encoded = json.dumps(data, sort_keys=True, default=lambda value: value.hex())
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _request_hash(request):
+    try:
+        return payload_hash(decode_payload(request, many=True))
+    except PayloadError:
+        # The view will refuse it; still tell bodies apart
+        return hashlib.sha256(request.body).hexdigest()
+
+
+def claim(cache_key, body_hash):
+    """
+    The stored answer for a key, or None once the caller holds the key's
+    in-flight marker (give it back with release()). Raises IdempotencyConflict
+    if the key was used for another body, or its first request is still running.
+    """
+    cache = caches['idempotency']
+    stored = cache.get(cache_key)
+    if stored is not None:
+        # The same key must not be reused for a different request body
+        if stored['body_hash'] != body_hash:
+            raise IdempotencyConflict('Idempotency-Key was already used with a different request body.', 422)
+        return stored
+
+    # A retry that arrives while the first attempt is still running must not run twice
+    if not cache.add(cache_key + ':lock', True, timeout=IN_FLIGHT_TIMEOUT):
+        raise IdempotencyConflict('A request with this Idempotency-Key is still being processed.', 409)
+    return None
+
+
+def remember(cache_key, answer):
+    caches['idempotency'].set(cache_key, answer)
+
+
+def release(cache_key):
+    caches['idempotency'].delete(cache_key + ':lock')
+
+
+def stored_reply(stored):
+    """
+    A stored answer as (data, status, compact), the shape device actions return.
+    """
+    if 'data' in stored:
+        return stored['data'], stored['status'], stored['compact']
+    if stored['content_type'] in MSGPACK_CONTENT_TYPES:
+        return expand_fields(msgpack_decode(stored['content'])), stored['status'], None
+    return json.loads(stored['content']), stored['status'], None
+
+
+def idempotent(view_func):
+    """
+    Lets the device safely retry a POST by sending an `Idempotency-Key` header.
+
+    The first response for a key is stored in the 'idempotency' cache (the
+    shared CACHE_URL backend, entries expire after IDEMPOTENCY_CACHE_TIMEOUT)
+    and replayed byte-for-byte on retries to any worker, without running the
+    view or touching the database again. Answers to socket frames carrying
+    the same key are replayed too (see apis/device_socket.py).
+    Requests without the header behave exactly as before.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if request.method != 'POST' or not key:
+            return view_func(request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters.'}, status=400)
+
+        cache_key = _cache_key(request.headers.get('X-Device-ID', ''), request.path, key)
+        body_hash = _request_hash(request)
+
+        try:
+            stored = claim(cache_key, body_hash)
+        except IdempotencyConflict as e:
+            response = JsonResponse({'error': str(e)}, status=e.status)
+            if e.status == 409:
+                response['Retry-After'] = '1'
+            return response
+
+        if stored is not None:
+            if 'content' in stored:
+                response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+            else:
+                response = device_response(request, *stored_reply(stored))
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view_func(request, *args, **kwargs)
+
+            # Only remember final answers. Server errors should be retried for real.
+            if response.status_code < 500 and not response.streaming:
+                remember(cache_key, {
+                    'body_hash': body_hash,
+                    'status': response.status_code,
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                })
+        finally:
+            release(cache_key)
+
+        return response
+
+    return wrapper
@@ -0,0 +1,270 @@
+"""
+In-process publishers for server push (Server-Sent Events).
+
+Each watched object gets a single Feed per process. The feed is the only
+thing that queries the database, and it fans every event out to all the
+browsers watching, so extra watchers cost no extra queries.
+Sync code (e.g. the scanner endpoints) can call Feed.notify() to wake
+a feed straight away instead of waiting for its next poll.
+
+Enrollment task states are also kept in the cache (see set_task_state),
+so both the task feed and the polling fallback can answer without a query.
+
+Feeds run on the ASGI event loop, so these streams need the ASGI server.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from .models import AttendanceSession, AttendanceRecord, EnrollmentTask
+
+logger = logging.getLogger(__name__)
+
+# (feed class, key) -> feed, for every feed running in this process
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def _in_db_thread(func):
+    """
+    Runs a blocking DB function in a worker thread, managing its
+    connection like a request would.
+    """
+    def wrapper(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False)
+
+
+class Feed:
+    """
+    Base class for a publisher. Subclasses implement load() to fetch
+    new events from the database.
+    """
+    history_size = None  # Events kept for replay to new subscribers (None keeps all)
+
+    def __init__(self, key):
+        self.key = key
+        self.events = []  # (event id, event name, data)
+        self.finished = False
+        self._subscribers = set()
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+
+    @classmethod
+    def subscribe(cls, key):
+        """
+        Returns (feed, queue). Must be called from the event loop.
+        """
+        with _feeds_lock:
+            feed = _feeds.get((cls, key))
+            if feed is None:
+                feed = _feeds[(cls, key)] = cls(key)
+        queue = asyncio.Queue()
+        feed._subscribers.add(queue)
+        return feed, queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers:
+            # Nobody is watching any more, stop querying
+            with _feeds_lock:
+                if _feeds.get((type(self), self.key)) is self:
+                    del _feeds[(type(self), self.key)]
+            self._task.cancel()
+
+    @classmethod
+    def notify(cls, key):
+        """
+        Wakes the feed for `key` if one is running in this process.
+        Safe to call from any thread.
+        """
+        with _feeds_lock:
+            feed = _feeds.get((cls, key))
+        if feed is not None:
+            feed._loop.call_soon_threadsafe(feed._wakeup.set)
+
+    def replay(self, after_id=None):
+        """Events a new subscriber missed, served from memory."""
+        return [event for event in self.events if after_id is None or event[0] > after_id]
+
+    def publish(self, event_id, name, data):
+        event = (event_id, name, data)
+        self.events.append(event)
+        if self.history_size is not None:
+            del self.events[:-self.history_size]
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def load(self):
+        raise NotImplementedError
+
+    async def _run(self):
+        while not self.finished:
+            try:
+                await self.load()
+            except Exception:
+                # Keep the feed alive through a DB hiccup; try again at the next poll
+                logger.exception("Live feed %s(%s) failed to load", type(self).__name__, self.key)
+            if self.finished:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.LIVE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+class SessionFeed(Feed):
+    """
+    New attendance records for one session.
+    """
+    def __init__(self, session_id):
+        self.last_record_id = 0
+        self.count = 0
+        super().__init__(session_id)
+
+    async def load(self):
+        records, is_active = await _load_session_records(self.key, self.last_record_id)
+
+        for record_id, first_name, last_name, matric_number, timestamp in records:
+            self.last_record_id = record_id
+            self.count += 1
+            self.publish(record_id, 'attendance', {
+                'student': f"{first_name} {last_name}",
+                'matric_number': matric_number,
+                'time': timestamp.strftime('%H:%M:%S'),
+                'count': self.count,
+            })
+
+        if not is_active:
+            self.finished = True
+            self.publish(self.last_record_id, 'ended', {'count': self.count})
+
+
+@_in_db_thread
+def _load_session_records(session_id, after_id):
+    session = AttendanceSession.objects.filter(pk=session_id).values('is_active', 'semester_id').first()
+    if session is None:
+        return [], False
+
+    # semester keeps the scan to the session's partition
+    records = list(
+        AttendanceRecord.objects.filter(session_id=session_id, semester_id=session['semester_id'], record_id__gt=after_id)
+        .order_by('record_id')
+        .values_list('record_id', 'student__first_name', 'student__last_name', 'student__matric_number', 'timestamp')
+    )
+    return records, session['is_active']
+
+
+# Order of task states, used as the SSE event id so a reconnect never goes backwards
+TASK_STEPS = {
+    EnrollmentTask.Status.PENDING: 1,
+    EnrollmentTask.Status.PROCESSING: 2,
+    EnrollmentTask.Status.SUCCESS: 3,
+    EnrollmentTask.Status.FAILED: 3,
+    EnrollmentTask.Status.TIMED_OUT: 3,
+}
+TASK_FINAL_STATES = (EnrollmentTask.Status.SUCCESS, EnrollmentTask.Status.FAILED, EnrollmentTask.Status.TIMED_OUT)
+TASK_STATE_KEY = 'enrollment:task:{task_id}'
+
+
+def set_task_state(task):
+    """
+    Records a task's new state in the cache and wakes its feed.
+    Call this whenever a task's status changes.
+    """
+    state = {'status': task.status, 'message': task.result_message or ''}
+    # Final states never change again, so they can be kept for long. The others
+    # expire quickly in case the change happened in a process we don't share a cache with.
+    timeout = settings.TASK_STATE_FINAL_TIMEOUT if task.status in TASK_FINAL_STATES else settings.TASK_STATE_TIMEOUT
+    cache.set(TASK_STATE_KEY.format(task_id=task.id), state, timeout=timeout)
+    TaskFeed.notify(task.id)
+    return state
+
+
+def get_task_state(task_id):
+    """
+    Returns {'status', 'message'} for a task from the cache, falling back
+    to the database. Returns None if the task doesn't exist.
+    """
+    state = cache.get(TASK_STATE_KEY.format(task_id=task_id))
+    if state is not None:
+        return state
+
+    try:
+        task = EnrollmentTask.objects.only('status', 'result_message').get(id=task_id)
+    except EnrollmentTask.DoesNotExist:
+        return None
+    return set_task_state(task)
+
+
+def task_etag(state):
+    digest = hashlib.md5(f"{state['status']}:{state['message']}".encode()).hexdigest()
+    return f'"{digest[:16]}"'
+
+
+class TaskFeed(Feed):
+    """
+    Status changes of one enrollment task.
+    """
+    history_size = 1  # Only the latest state matters to a new watcher
+
+    def __init__(self, task_id):
+        self.state = None
+        super().__init__(task_id)
+
+    async def load(self):
+        state = await _in_db_thread(get_task_state)(self.key)
+
+        if state is None:
+            self.finished = True
+            self.publish(0, 'missing', {'error': 'Task not found'})
+            return
+
+        if state != self.state:
+            self.state = state
+            self.publish(TASK_STEPS.get(state['status'], 0), 'status', state)
+
+        if state['status'] in TASK_FINAL_STATES:
+            self.finished = True
+
+
+def format_event(event_id, name, data):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(feed_class, key, last_event_id=None):
+    """
+    Async generator of SSE text for a StreamingHttpResponse.
+    """
+    feed, queue = feed_class.subscribe(key)
+    # Take the backlog before the first yield, so nothing published meanwhile is sent twice
+    backlog = feed.replay(last_event_id)
+    try:
+        yield f"retry: {int(settings.LIVE_POLL_INTERVAL * 1000)}\n\n"
+
+        for event in backlog:
+            yield format_event(*event)
+
+        while not (feed.finished and queue.empty()):
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.LIVE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"  # Comment line, lets proxies and the browser know we're alive
+                continue
+            event_id, name, _ = event
+            if name == 'attendance' and last_event_id is not None and event_id <= last_event_id:
+                continue  # Already seen before the browser reconnected
+            yield format_event(*event)
+    finally:
+        feed.unsubscribe(queue)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from apis.archive import ArchiveError, archive_path, archive_semester
+from apis.models import Semester
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves a closed semester's attendance sessions and records into a compressed archive file "
+        "and deletes them from the database. Reports keep reading them from the archive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('semester_ids', nargs='+', type=int)
+        parser.add_argument('--keep-rows', action='store_true', help="Write the archive but leave the rows in the database. A later run without it deletes them.")
+
+    def handle(self, *args, semester_ids, keep_rows, **options):
+        for semester_id in semester_ids:
+            try:
+                semester = Semester.objects.get(pk=semester_id)
+            except Semester.DoesNotExist:
+                raise CommandError(f"Semester {semester_id} does not exist.")
+
+            try:
+                archive = archive_semester(semester, purge=not keep_rows)
+            except ArchiveError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{semester}: {archive.session_count} sessions and {archive.record_count} records "
+                f"archived to {archive_path(semester_id)}" + ("" if keep_rows else " and removed from the database.")
+            ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from apis.models import CurrentSemester, Semester
+from apis.partitions import PartitionError, attach_partition, detach_partition, ensure_partition, is_partitioned, list_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Manages the per-semester partitions of the attendance record table. "
+        "Detach a closed semester to take it out of the live table for archiving or vacuuming."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'create', 'detach', 'attach'])
+        parser.add_argument('semester_ids', nargs='*', type=int, help="Semesters to detach or attach.")
+
+    def handle(self, *args, action, semester_ids, **options):
+        if not is_partitioned():
+            raise CommandError("Attendance records are not partitioned on this database (Postgres only).")
+
+        if action == 'list':
+            semesters = {s.pk: str(s) for s in Semester.objects.all()}
+            for semester_id, name, attached, size in list_partitions():
+                state = "attached" if attached else "DETACHED"
+                self.stdout.write(f"{name:<40} {semesters.get(semester_id, '(deleted semester)'):<30} {state:<9} {size / 1024 / 1024:.1f} MB")
+
+        elif action == 'create':
+            # Semesters made before partitioning, or while the signal wasn't connected
+            for semester_id in Semester.objects.values_list('pk', flat=True):
+                ensure_partition(semester_id)
+            self.stdout.write(self.style.SUCCESS("Every semester has a partition."))
+
+        else:
+            if not semester_ids:
+                raise CommandError(f"Give the IDs of the semesters to {action}.")
+            current = CurrentSemester.objects.values_list('semester_id', flat=True).first()
+
+            for semester_id in semester_ids:
+                if action == 'detach' and semester_id == current:
+                    raise CommandError(f"Semester {semester_id} is the current semester and can't be detached.")
+                try:
+                    (detach_partition if action == 'detach' else attach_partition)(semester_id)
+                except PartitionError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(self.style.SUCCESS(f"Semester {semester_id} {action}ed."))
@@ -0,0 +1,77 @@
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+# Read-only device calls, so the benchmark leaves no rows behind
+ENDPOINTS = (
+    ('command poll', 'get-device-command'),
+    ('session status', 'api-session-status'),
+)
+BENCHMARK_POOL = {'min_size': 2, 'max_size': 4}
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the scanner's polling endpoints with a new database connection per request "
+        "and with the connection pool, in this process. Needs PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint and mode.")
+        parser.add_argument('--warmup', type=int, default=20, help="Untimed requests first, to fill caches and the pool.")
+
+    def _configure(self, pool_options):
+        wrapper = connections['default']
+        wrapper.close()
+        wrapper.close_pool()
+        if pool_options is None:
+            wrapper.settings_dict['OPTIONS'].pop('pool', None)
+        else:
+            wrapper.settings_dict['OPTIONS']['pool'] = pool_options
+
+    def _time(self, client, url, count):
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 500:
+                raise CommandError(f"{url} returned {response.status_code}.")
+        return timings
+
+    def handle(self, *args, requests, warmup, **options):
+        wrapper = connections['default']
+        if wrapper.vendor != 'postgresql':
+            raise CommandError("Connection pooling needs PostgreSQL.")
+
+        original_pool = wrapper.settings_dict['OPTIONS'].get('pool')
+        modes = (('new connection', None), ('pooled', original_pool or BENCHMARK_POOL))
+        # Lift the rate limits so the benchmark measures the database, not the throttle
+        unthrottled = {scope: {'rate': 1e6, 'burst': 1e6} for scope in settings.DEVICE_THROTTLE_SCOPES}
+
+        results = {}
+        try:
+            with override_settings(DEVICE_THROTTLE_SCOPES=unthrottled, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                client = Client()
+                for mode, pool_options in modes:
+                    self._configure(pool_options)
+                    for name, url_name in ENDPOINTS:
+                        url = reverse(url_name)
+                        self._time(client, url, warmup)
+                        results[name, mode] = self._time(client, url, requests)
+        finally:
+            self._configure(original_pool)
+
+        self.stdout.write(f"{'endpoint':<16} {'mode':<15} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, _ in ENDPOINTS:
+            for mode, _ in modes:
+                timings = results[name, mode]
+                p95 = statistics.quantiles(timings, n=20)[-1]
+                self.stdout.write(f"{name:<16} {mode:<15} {statistics.mean(timings):>8.2f} {statistics.median(timings):>8.2f} {p95:>8.2f}")
+            direct, pooled = (statistics.median(results[name, mode]) for mode, _ in modes)
+            self.stdout.write(self.style.SUCCESS(f"{name}: median {direct - pooled:.2f} ms faster pooled ({direct / pooled:.1f}x)"))
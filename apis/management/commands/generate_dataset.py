@@ -0,0 +1,348 @@
+import math
+import multiprocessing
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from apis.models import (
+    LEVEL_CHOICES, AttendanceRecord, AttendanceSession, Course, CourseEnrollment, CurrentSemester,
+    Department, Faculty, FingerprintMapping, SensorGroup, Semester, User,
+)
+from apis.catalog import invalidate_catalog
+from apis.partitions import ensure_partition
+
+# Everything generated is marked with these, so --flush can find it again
+NAME_PREFIX = 'Synthetic'
+EMAIL_DOMAIN = 'synthetic.example'
+COURSE_PREFIX = 'SYN'
+PASSWORD = 'synthetic'  # Every generated user's password
+
+DEFAULT_COUNTS = {
+    'faculties': 10,
+    'departments': 60,
+    'students': 50000,
+    'lecturers': 2000,
+    'courses': 3000,
+}
+FIRST_NAMES = [
+    'Adaeze', 'Chinedu', 'Ngozi', 'Emeka', 'Funmilayo', 'Tunde', 'Aisha', 'Ibrahim', 'Zainab', 'Segun',
+    'Kemi', 'Obinna', 'Halima', 'Yusuf', 'Chiamaka', 'Femi', 'Amaka', 'Musa', 'Bisi', 'Uche',
+]
+LAST_NAMES = [
+    'Okafor', 'Adeyemi', 'Bello', 'Eze', 'Ogunleye', 'Abubakar', 'Nwosu', 'Balogun', 'Okeke', 'Danjuma',
+    'Olawale', 'Ibe', 'Suleiman', 'Afolabi', 'Chukwu', 'Lawal', 'Obi', 'Adebayo', 'Umar', 'Onyekachi',
+]
+LEVELS = [value for value, _ in LEVEL_CHOICES[:5]]
+
+# Set before the session workers fork, and inherited by them: {student ID: chance of attending a class}
+_attendance_propensity = {}
+
+
+@contextmanager
+def _explicit_timestamps():
+    """
+    bulk_create runs auto_now_add, which would stamp every generated row with the current time.
+    """
+    fields = [AttendanceSession._meta.get_field('start_time'), AttendanceRecord._meta.get_field('timestamp')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _semester_start(semester):
+    year = int(semester.session[:4])
+    start = datetime(year, 9, 15) if semester.name == 'First' else datetime(year + 1, 2, 1)
+    return timezone.make_aware(start)
+
+
+def _generate_sessions(job):
+    """
+    Creates the sessions and attendance records of a chunk of courses, for
+    every semester. Runs in a worker process. Each course has its own random
+    stream, so the data doesn't depend on how courses are spread over workers.
+    """
+    seed, courses, weeks, batch_size = job
+    course_ids = [course_id for course_id, _ in courses]
+    semesters = {semester.pk: _semester_start(semester) for semester in Semester.objects.filter(courseenrollment__course__in=course_ids).distinct()}
+
+    enrolled = defaultdict(list)
+    for course_id, semester_id, student_id in (
+        CourseEnrollment.objects.filter(course__in=course_ids).order_by('student_id').values_list('course_id', 'semester_id', 'student_id')
+    ):
+        enrolled[course_id, semester_id].append(student_id)
+    lecturers = defaultdict(list)
+    for course_id, user_id in Course.lecturers.through.objects.filter(course__in=course_ids).order_by('user_id').values_list('course_id', 'user_id'):
+        lecturers[course_id].append(user_id)
+
+    session_count = record_count = 0
+    for course_id, course_number in courses:
+        rng = np.random.default_rng([seed, course_number])
+        meetings = int(rng.integers(1, 3))  # Classes a week
+        hours = rng.choice(np.arange(8, 17), size=meetings, replace=False)
+        days = rng.choice(np.arange(5), size=meetings, replace=False)
+        duration = int(rng.choice([60, 120]))
+        popularity = rng.uniform(0.9, 1.1)  # Some classes are simply better attended
+
+        for semester_id, semester_start in sorted(semesters.items()):
+            students = np.array(enrolled.get((course_id, semester_id), []), dtype=np.int64)
+            if not students.size or not lecturers[course_id]:
+                continue
+            propensity = np.minimum(np.array([_attendance_propensity.get(s, 0.8) for s in students.tolist()]) * popularity, 0.99)
+
+            sessions = []
+            for week in range(weeks):
+                for day, hour in zip(days.tolist(), hours.tolist()):
+                    start = semester_start + timedelta(days=7 * week + day, hours=hour)
+                    sessions.append(AttendanceSession(
+                        course_id=course_id, semester_id=semester_id, lecturer_id=lecturers[course_id][week % len(lecturers[course_id])],
+                        start_time=start, end_time=start + timedelta(minutes=duration), is_active=False,
+                    ))
+
+            with transaction.atomic():
+                with _explicit_timestamps():
+                    AttendanceSession.objects.bulk_create(sessions, batch_size=batch_size)
+
+                rows = []
+                for session in sessions:
+                    present = students[rng.random(students.size) < propensity]
+                    # Most arrive a few minutes either side of the start, the rest trickle in late
+                    late = rng.random(present.size) < 0.3
+                    minutes = np.where(late, rng.exponential(12, present.size), rng.normal(-3, 4, present.size))
+                    minutes = np.clip(minutes, -10, duration - 1)
+                    for student_id, offset in zip(present.tolist(), minutes.tolist()):
+                        rows.append((session.pk, student_id, semester_id, session.start_time + timedelta(minutes=offset)))
+                _insert_records(rows, batch_size)
+
+            session_count += len(sessions)
+            record_count += len(rows)
+
+    connections.close_all()
+    return session_count, record_count
+
+
+def _insert_records(rows, batch_size):
+    if connection.vendor == 'postgresql':
+        # COPY is several times faster than INSERT for millions of rows
+        with connection.cursor() as cursor:
+            with cursor.copy(
+                'COPY apis_attendancerecord (session_id, student_id, semester_id, "timestamp", marks_awarded) FROM STDIN'
+            ) as copy:
+                for row in rows:
+                    copy.write_row((*row, 1))
+        return
+
+    with _explicit_timestamps():
+        AttendanceRecord.objects.bulk_create(
+            [AttendanceRecord(session_id=s, student_id=u, semester_id=sem, timestamp=t) for s, u, sem, t in rows],
+            batch_size=batch_size,
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a reproducible synthetic university (faculties, departments, students, lecturers, "
+        "fingerprints, courses, enrollments, sessions and attendance) for benchmarking. "
+        f"Every generated user's password is '{PASSWORD}'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiplies the default sizes (50k students, 2k lecturers, 3k courses).")
+        for name, default in DEFAULT_COUNTS.items():
+            parser.add_argument(f'--{name}', type=int, help=f"Overrides the scaled count (default {default}).")
+        parser.add_argument('--semesters', type=int, default=2, help="Most recent semesters to fill, ending with the current one.")
+        parser.add_argument('--courses-per-student', type=int, default=6)
+        parser.add_argument('--weeks', type=int, default=13, help="Teaching weeks per semester.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=min(multiprocessing.cpu_count(), 8), help="Processes generating sessions (PostgreSQL only).")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--flush', action='store_true', help="Delete previously generated data first.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.counts = {
+            name: options[name] or max(1, round(default * options['scale']))
+            for name, default in DEFAULT_COUNTS.items()
+        }
+
+        if options['flush']:
+            self.step("Deleting previously generated data", self.flush)
+        elif Faculty.objects.filter(name__startswith=f"{NAME_PREFIX} ").exists():
+            raise CommandError("Synthetic data already exists. Run with --flush to replace it.")
+
+        self.step("Faculties, departments and semesters", self.create_structure)
+        self.step(f"{self.counts['students']} students and {self.counts['lecturers']} lecturers with fingerprints", self.create_users)
+        self.step(f"{self.counts['courses']} courses", self.create_courses)
+        self.step("Course enrollments", self.create_enrollments)
+        self.step("Sessions and attendance records", self.create_sessions)
+        self.stdout.write(self.style.SUCCESS(f"Done. Log in as any generated user with the password '{PASSWORD}'."))
+
+    def step(self, label, func):
+        self.stdout.write(f"{label}...")
+        started = time.monotonic()
+        result = func()
+        self.stdout.write(f"  {result or 'done'} in {time.monotonic() - started:.1f}s")
+
+    def flush(self):
+        courses = Course.objects.filter(course_code__startswith=COURSE_PREFIX)
+        records = AttendanceRecord.objects.filter(session__course__in=courses).delete()[0]
+        AttendanceSession.objects.filter(course__in=courses).delete()
+        CourseEnrollment.objects.filter(course__in=courses).delete()
+        courses.delete()
+        users = User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").delete()[0]
+        SensorGroup.objects.filter(name__startswith=f"{NAME_PREFIX} ").delete()
+        Department.objects.filter(name__startswith=f"{NAME_PREFIX} ").delete()
+        Faculty.objects.filter(name__startswith=f"{NAME_PREFIX} ").delete()
+        return f"{records} records and {users} users and related rows deleted"
+
+    def create_structure(self):
+        batch_size = self.options['batch_size']
+        faculties = Faculty.objects.bulk_create(
+            [Faculty(name=f"{NAME_PREFIX} Faculty {i + 1}") for i in range(self.counts['faculties'])], batch_size=batch_size,
+        )
+        self.departments = Department.objects.bulk_create(
+            [Department(name=f"{NAME_PREFIX} Department {i + 1}", faculty=faculties[i % len(faculties)]) for i in range(self.counts['departments'])],
+            batch_size=batch_size,
+        )
+
+        # The most recent semesters, oldest first, ending with the current academic year's second semester
+        year = timezone.now().year - 1
+        self.semesters = []
+        for i in reversed(range(self.options['semesters'])):
+            session_year = year - (i + 1) // 2 if i % 2 else year - i // 2
+            name = 'First' if i % 2 else 'Second'
+            semester, _ = Semester.objects.get_or_create(name=name, session=f"{session_year}/{session_year + 1}")
+            ensure_partition(semester.pk)
+            self.semesters.append(semester)
+        if not CurrentSemester.objects.exists():
+            CurrentSemester.objects.create(semester=self.semesters[-1])
+        return f"{len(faculties)} faculties, {len(self.departments)} departments, {len(self.semesters)} semesters"
+
+    def create_users(self):
+        batch_size = self.options['batch_size']
+        rng = self.rng
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(PASSWORD)
+        year = timezone.now().year
+
+        def person(role, **fields):
+            department = rng.choice(self.departments)
+            return User(
+                first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES), password=password,
+                faculty_id=department.faculty_id, department=department, user_role=role, **fields,
+            )
+
+        students = [
+            person('Student', email=f"student{i + 1}@{EMAIL_DOMAIN}", matric_number=f"{COURSE_PREFIX}/{year - int(level) // 100}/{i + 1:06d}", level=level)
+            for i, level in ((i, rng.choice(LEVELS)) for i in range(self.counts['students']))
+        ]
+        lecturers = [person('Lecturer', email=f"lecturer{i + 1}@{EMAIL_DOMAIN}") for i in range(self.counts['lecturers'])]
+        self.students = User.objects.bulk_create(students, batch_size=batch_size)
+        self.lecturers = User.objects.bulk_create(lecturers, batch_size=batch_size)
+
+        # Mostly regular attenders, with a tail below the 75% threshold
+        _attendance_propensity.clear()
+        for student in self.students:
+            _attendance_propensity[student.pk] = rng.betavariate(9, 1.5)
+
+        # Fill sensor groups of 1000 slots one after another
+        users = self.students + self.lecturers
+        capacity = SensorGroup._meta.get_field('capacity').default
+        groups = SensorGroup.objects.bulk_create(
+            [SensorGroup(name=f"{NAME_PREFIX} group {i + 1}", capacity=capacity) for i in range(math.ceil(len(users) / capacity))]
+        )
+        FingerprintMapping.objects.bulk_create(
+            [FingerprintMapping(user=user, sensor_group=groups[i // capacity], fingerprint_id=i % capacity + 1) for i, user in enumerate(users)],
+            batch_size=batch_size,
+        )
+        return f"{len(users)} users in {len(groups)} sensor groups"
+
+    def create_courses(self):
+        batch_size = self.options['batch_size']
+        rng = self.rng
+        lecturers_by_department = defaultdict(list)
+        for lecturer in self.lecturers:
+            lecturers_by_department[lecturer.department_id].append(lecturer.pk)
+        departments_by_faculty = defaultdict(list)
+        for department in self.departments:
+            departments_by_faculty[department.faculty_id].append(department)
+
+        self.courses = Course.objects.bulk_create(
+            [
+                Course(course_name=f"{NAME_PREFIX} Course {i + 1}", course_code=f"{COURSE_PREFIX}{i + 1:05d}", minimum_level=rng.choice(LEVELS))
+                for i in range(self.counts['courses'])
+            ],
+            batch_size=batch_size,
+        )
+
+        department_links, lecturer_links, semester_links = [], [], []
+        self.courses_by_department = defaultdict(list)
+        for course in self.courses:
+            home = rng.choice(self.departments)
+            departments = {home}
+            if rng.random() < 0.3:
+                # Shared with a sister department
+                departments.add(rng.choice(departments_by_faculty[home.faculty_id]))
+            for department in departments:
+                department_links.append(Course.departments.through(course_id=course.pk, department_id=department.pk))
+                self.courses_by_department[department.pk].append(course)
+
+            candidates = lecturers_by_department[home.pk] or [lecturer.pk for lecturer in self.lecturers]
+            for lecturer_id in rng.sample(candidates, min(len(candidates), rng.choice([1, 1, 2]))):
+                lecturer_links.append(Course.lecturers.through(course_id=course.pk, user_id=lecturer_id))
+            for semester in self.semesters:
+                semester_links.append(Course.available_semesters.through(course_id=course.pk, semester_id=semester.pk))
+
+        Course.departments.through.objects.bulk_create(department_links, batch_size=batch_size)
+        Course.lecturers.through.objects.bulk_create(lecturer_links, batch_size=batch_size)
+        Course.available_semesters.through.objects.bulk_create(semester_links, batch_size=batch_size)
+        # bulk_create sends no signals, so retire cached course catalogs here
+        invalidate_catalog()
+        return f"{len(self.courses)} courses, {len(lecturer_links)} lecturer assignments"
+
+    def create_enrollments(self):
+        batch_size = self.options['batch_size']
+        rng = self.rng
+        per_student = self.options['courses_per_student']
+        total = 0
+        for semester in self.semesters:
+            enrollments = []
+            for student in self.students:
+                eligible = [course for course in self.courses_by_department[student.department_id] if int(course.minimum_level) <= int(student.level)]
+                for course in rng.sample(eligible, min(per_student, len(eligible))):
+                    enrollments.append(CourseEnrollment(student_id=student.pk, course_id=course.pk, semester_id=semester.pk))
+            CourseEnrollment.objects.bulk_create(enrollments, batch_size=batch_size)
+            total += len(enrollments)
+        return f"{total} enrollments"
+
+    def create_sessions(self):
+        options = self.options
+        workers = options['workers'] if connection.vendor == 'postgresql' else 1  # SQLite has one writer
+        courses = [(course.pk, int(course.course_code[len(COURSE_PREFIX):])) for course in self.courses]
+        chunk = max(1, math.ceil(len(courses) / (workers * 4)))
+        jobs = [(options['seed'], courses[i:i + chunk], options['weeks'], options['batch_size']) for i in range(0, len(courses), chunk)]
+
+        sessions = records = 0
+        if workers == 1:
+            for session_count, record_count in map(_generate_sessions, jobs):
+                sessions += session_count
+                records += record_count
+        else:
+            # Forked workers must not share the parent's connection
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                for done, (session_count, record_count) in enumerate(pool.imap_unordered(_generate_sessions, jobs), 1):
+                    sessions += session_count
+                    records += record_count
+                    self.stdout.write(f"  {done}/{len(jobs)} course batches, {records} records so far")
+        return f"{sessions} sessions and {records} attendance records"
@@ -0,0 +1,82 @@
+import logging
+import signal
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from apis.housekeeping import JOBS, housekeeping_lock
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Closes attendance sessions lecturers forgot to end, times out stuck enrollment tasks, purges "
+        "old tasks and expired login sessions, and finishes deletions started in the admin, in small batches. "
+        "Runs as a long-lived process, each job on its own schedule; --once runs every job once instead, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run every job once and exit.")
+        parser.add_argument('--job', action='append', choices=[name for name, _, _ in JOBS], help="Only run this job. Can be repeated.")
+        parser.add_argument('--batch-size', type=int, help="Rows per transaction (default HOUSEKEEPING_BATCH_SIZE).")
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds between batches, so VACUUM and replicas keep up.")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size'] or settings.HOUSEKEEPING_BATCH_SIZE
+        self.pause = options['pause']
+        self.verbosity = options['verbosity']
+        if self.batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        jobs = [job for job in JOBS if not options['job'] or job[0] in options['job']]
+
+        if options['once']:
+            if not self.run(jobs):
+                raise CommandError("Some housekeeping jobs failed.")
+            return
+
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+
+        self.stdout.write(f"Housekeeping: {', '.join(f'{name} every {interval}s' for name, _, interval in jobs)}")
+        next_run = {name: 0.0 for name, _, _ in jobs}
+        while not stop.is_set():
+            # The process lives for days; don't keep a connection the database may have dropped
+            close_old_connections()
+            now = time.monotonic()
+            due = [job for job in jobs if next_run[job[0]] <= now]
+            self.run(due)
+            for name, _, interval in due:
+                next_run[name] = now + interval
+            stop.wait(max(0.0, min(next_run.values()) - time.monotonic()))
+        self.stdout.write("Housekeeping stopped.")
+
+    def run(self, jobs):
+        """
+        Runs the jobs one after the other. Returns False if any of them failed.
+        """
+        ok = True
+        try:
+            with housekeeping_lock() as locked:
+                if not locked:
+                    self.stdout.write("Another housekeeping process is running; skipped.")
+                    return True
+                for name, job, _ in jobs:
+                    started = time.monotonic()
+                    try:
+                        count = job(self.batch_size, self.pause)
+                    except Exception:
+                        # Keep the daemon alive; the job is tried again at its next run
+                        logger.exception("Housekeeping job %s failed", name)
+                        ok = False
+                        continue
+                    if count or self.verbosity > 1:
+                        self.stdout.write(f"{timezone.now():%Y-%m-%d %H:%M:%S} {name}: {count} row(s) in {time.monotonic() - started:.1f}s")
+        except Exception:
+            # E.g. the database is unreachable; try again at the next run
+            logger.exception("Housekeeping run failed")
+            ok = False
+        return ok
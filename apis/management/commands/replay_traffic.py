@@ -0,0 +1,256 @@
+import base64
+import http.cookiejar
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from apis.device_codec import MSGPACK_CONTENT_TYPE, compact_fields, msgpack_encode
+
+BROWSER_ROLES = ('Student', 'Lecturer', 'admin')
+
+
+def _load(paths, limit):
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda entry: entry['t'])
+    return entries[:limit] if limit else entries
+
+
+def _replayable(entry):
+    """
+    None if the request can be replayed, otherwise why not.
+    """
+    if entry.get('stream'):
+        return 'event stream'
+    if entry['method'] not in ('GET', 'HEAD') and entry.get('body') is None:
+        return 'form post (body not captured)'
+    return None
+
+
+def _payload(item, encoding):
+    item = dict(item)
+    length = item.pop('template_length', None)
+    if length is not None:
+        # Same size as the real template, none of its content
+        item['template'] = bytes(length) if encoding == 'msgpack' else base64.b64encode(bytes(length)).decode()
+    return item
+
+
+def _body(entry):
+    body = entry['body']
+    if isinstance(body, list):
+        body = [_payload(item, entry['encoding']) for item in body]
+    else:
+        body = _payload(body, entry['encoding'])
+    if entry['encoding'] == 'msgpack':
+        return msgpack_encode(compact_fields(body)), MSGPACK_CONTENT_TYPE
+    return json.dumps(body).encode(), 'application/json'
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def summarize(results):
+    """
+    {endpoint: {count, errors (5xx and failed connections), client_errors (4xx), p50_ms, p95_ms, max_ms}}
+    from (endpoint, status, milliseconds) tuples, plus an 'ALL' row.
+    """
+    groups = defaultdict(list)
+    for endpoint, status, ms in results:
+        groups[endpoint].append((status, ms))
+        groups['ALL'].append((status, ms))
+    summary = {}
+    for endpoint, rows in groups.items():
+        timings = sorted(ms for _, ms in rows)
+        summary[endpoint] = {
+            'count': len(rows),
+            'errors': sum(1 for status, _ in rows if status == 0 or status >= 500),
+            'client_errors': sum(1 for status, _ in rows if 400 <= status < 500),
+            'p50_ms': round(_percentile(timings, 50), 2),
+            'p95_ms': round(_percentile(timings, 95), 2),
+            'max_ms': round(timings[-1], 2),
+        }
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays traffic captured by TrafficCaptureMiddleware against a test server, "
+        "keeping the original timing (optionally sped up), and reports latency and "
+        "errors per endpoint compared with the capture or an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="Capture files (traffic-*.jsonl).")
+        parser.add_argument('--target', required=True, help="Base URL of the server to replay against, e.g. http://localhost:8000")
+        parser.add_argument('--speed', type=float, default=1.0, help="Replay speed: 1 keeps the captured pacing, 5 or 10 compress it.")
+        parser.add_argument('--workers', type=int, default=32, help="Requests that may be in flight at once.")
+        parser.add_argument(
+            '--login', action='append', default=[], metavar='ROLE=EMAIL:PASSWORD',
+            help=f"Account to replay a role's browser requests as ({', '.join(BROWSER_ROLES)}). "
+                 "Requests of roles without one are skipped.",
+        )
+        parser.add_argument('--timeout', type=float, default=30.0)
+        parser.add_argument('--limit', type=int, help="Only replay the first N requests.")
+        parser.add_argument('--output', help="Write this run's summary to a JSON file.")
+        parser.add_argument('--compare', help="An earlier run's --output file to compare with, instead of the captured timings.")
+
+    def handle(self, *args, **options):
+        if options['speed'] <= 0:
+            raise CommandError("--speed must be positive.")
+        self.target = options['target'].rstrip('/')
+        self.timeout = options['timeout']
+
+        entries = _load(options['files'], options['limit'])
+        if not entries:
+            raise CommandError("No captured requests found.")
+        self.openers = {None: urllib.request.build_opener()}
+        for login in options['login']:
+            role, _, credentials = login.partition('=')
+            email, _, password = credentials.partition(':')
+            if role not in BROWSER_ROLES or not email:
+                raise CommandError(f"--login must be ROLE=EMAIL:PASSWORD with ROLE one of {', '.join(BROWSER_ROLES)}.")
+            self.openers[role] = self.log_in(email, password)
+
+        skipped = defaultdict(int)
+        to_replay = []
+        for entry in entries:
+            reason = _replayable(entry)
+            if reason is None and entry.get('role') in BROWSER_ROLES and entry['role'] not in self.openers:
+                reason = f"no --login for {entry['role']}"
+            if reason:
+                skipped[reason] += 1
+            else:
+                to_replay.append(entry)
+
+        span = entries[-1]['t'] - entries[0]['t']
+        self.stdout.write(
+            f"Replaying {len(to_replay)} of {len(entries)} requests ({span:.0f}s captured) "
+            f"at {options['speed']:g}x against {self.target}..."
+        )
+        results, max_lag = self.replay(to_replay, options['speed'], options['workers'])
+
+        summary = summarize(results)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline, label = json.load(f), 'previous run'
+        else:
+            baseline, label = summarize(
+                (entry['view'] or entry['path'], entry['status'], entry['ms']) for entry in to_replay
+            ), 'capture'
+        self.report(summary, baseline, label)
+
+        for reason, count in sorted(skipped.items()):
+            self.stdout.write(f"Skipped {count}: {reason}")
+        self.stdout.write(f"Largest delay sending a request behind schedule: {max_lag * 1000:.0f} ms")
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Summary written to {options['output']}")
+
+    def log_in(self, email, password):
+        """
+        An opener holding a logged-in session, through the normal login form.
+        """
+        cookies = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+        login_url = f"{self.target}/login/"
+        opener.open(login_url, timeout=self.timeout).read()
+        csrf_token = next((cookie.value for cookie in cookies if cookie.name == 'csrftoken'), '')
+        data = urllib.parse.urlencode({'username': email, 'password': password, 'csrfmiddlewaretoken': csrf_token}).encode()
+        request = urllib.request.Request(login_url, data=data, headers={'Referer': login_url, 'X-CSRFToken': csrf_token})
+        opener.open(request, timeout=self.timeout).read()
+        if not any(cookie.name == 'sessionid' for cookie in cookies):
+            raise CommandError(f"Could not log in to {self.target} as {email}.")
+        return opener
+
+    def send(self, entry):
+        url = f"{self.target}{entry['path']}"
+        if entry.get('query'):
+            url = f"{url}?{entry['query']}"
+        headers = {}
+        data = None
+        if entry.get('body') is not None:
+            data, headers['Content-Type'] = _body(entry)
+        if entry.get('device'):
+            headers['X-Device-ID'] = entry['device']
+        if entry.get('accept_msgpack'):
+            headers['Accept'] = MSGPACK_CONTENT_TYPE
+        if entry.get('idempotency_key'):
+            headers['Idempotency-Key'] = entry['idempotency_key']
+
+        opener = self.openers[entry['role'] if entry.get('role') in BROWSER_ROLES else None]
+        request = urllib.request.Request(url, data=data, headers=headers, method=entry['method'])
+        started = time.perf_counter()
+        try:
+            with opener.open(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = 0
+        return entry['view'] or entry['path'], status, (time.perf_counter() - started) * 1000
+
+    def replay(self, entries, speed, workers):
+        """
+        Sends each request at its captured offset divided by speed.
+        Returns the results and the largest delay behind schedule.
+        """
+        results = []
+        results_lock = threading.Lock()
+        max_lag = 0.0
+
+        def run(entry):
+            result = self.send(entry)
+            with results_lock:
+                results.append(result)
+
+        first = entries[0]['t'] if entries else 0
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for entry in entries:
+                due = started + (entry['t'] - first) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+                pool.submit(run, entry)
+        return results, max_lag
+
+    def report(self, summary, baseline, label):
+        self.stdout.write(
+            f"{'endpoint':<34} {'count':>6} {'errors':>7} {'4xx':>5} {'p50 ms':>8} {'p95 ms':>8}   "
+            f"change vs {label} (p50, p95, errors)"
+        )
+        for endpoint in sorted(summary, key=lambda name: (name == 'ALL', name)):
+            row = summary[endpoint]
+            line = (
+                f"{endpoint[:34]:<34} {row['count']:>6} {row['errors']:>7} {row['client_errors']:>5} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}   "
+            )
+            before = baseline.get(endpoint)
+            if before:
+                line += (
+                    f"{row['p50_ms'] - before['p50_ms']:+.2f} ms, {row['p95_ms'] - before['p95_ms']:+.2f} ms, "
+                    f"{row['errors'] - before['errors']:+d}"
+                )
+            else:
+                line += "-"
+            style = self.style.ERROR if before and row['errors'] > before['errors'] else (lambda text: text)
+            self.stdout.write(style(line))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from apis.rollups import BATCH_SIZE, rebuild_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds ended attendance sessions not rolled up yet to the weekly department/course rollups "
+        "behind the department and faculty reports. Run it on a schedule, e.g. every 15 minutes from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Drop the rollups and recompute them from every ended session.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Sessions added per transaction.")
+
+    def handle(self, *args, rebuild, batch_size, **options):
+        processed = (rebuild_rollups if rebuild else update_rollups)(batch_size)
+        self.stdout.write(self.style.SUCCESS(f"{processed} session(s) added to the attendance rollups."))
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+DEFAULT_GROUP_NAME = 'Default'
+
+
+def assign_default_group(apps, schema_editor):
+    # Every existing fingerprint and task was enrolled on the one sensor we had
+    SensorGroup = apps.get_model('apis', 'SensorGroup')
+    group, _ = SensorGroup.objects.get_or_create(name=DEFAULT_GROUP_NAME)
+    apps.get_model('apis', 'FingerprintMapping').objects.update(sensor_group=group)
+    apps.get_model('apis', 'EnrollmentTask').objects.update(sensor_group=group)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0003_enrollmentcampaign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('capacity', models.PositiveIntegerField(default=1000, help_text='Number of template slots on each sensor in this group.')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('sensor_group', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='devices', to='apis.sensorgroup')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fingerprintmapping',
+            name='sensor_group',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='fingerprints', to='apis.sensorgroup'),
+        ),
+        migrations.AddField(
+            model_name='enrollmenttask',
+            name='sensor_group',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='enrollment_tasks', to='apis.sensorgroup'),
+        ),
+        migrations.RunPython(assign_default_group, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Kept apart from 0004 so the data update is committed before Postgres alters the tables
+
+    dependencies = [
+        ('apis', '0004_sensorgroup_device'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fingerprintmapping',
+            name='sensor_group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='fingerprints', to='apis.sensorgroup'),
+        ),
+        migrations.AlterField(
+            model_name='enrollmenttask',
+            name='sensor_group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='enrollment_tasks', to='apis.sensorgroup'),
+        ),
+        migrations.AlterField(
+            model_name='fingerprintmapping',
+            name='fingerprint_id',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='enrollmenttask',
+            name='slot_id',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fingerprintmapping',
+            unique_together={('sensor_group', 'fingerprint_id')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='enrollmenttask',
+            unique_together={('sensor_group', 'slot_id')},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0005_slot_per_sensor_group'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FingerprintTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint_id', models.IntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('checksum', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('sensor_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='templates', to='apis.sensorgroup')),
+            ],
+            options={
+                'unique_together': {('sensor_group', 'fingerprint_id')},
+            },
+        ),
+    ]
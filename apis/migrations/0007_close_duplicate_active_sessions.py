@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def close_duplicate_active_sessions(apps, schema_editor):
+    # The unique constraints in 0008 allow one active session per lecturer and
+    # per course. Where an old race left more than one, keep the newest open.
+    AttendanceSession = apps.get_model('apis', 'AttendanceSession')
+    now = timezone.now()
+
+    for field in ('lecturer_id', 'course_id'):
+        seen = set()
+        stale = []
+        for session_id, key in AttendanceSession.objects.filter(is_active=True).order_by('-start_time', '-session_id').values_list('session_id', field):
+            if key in seen:
+                stale.append(session_id)
+            seen.add(key)
+        AttendanceSession.objects.filter(session_id__in=stale).update(is_active=False, end_time=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0006_fingerprinttemplate'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_active_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:22
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0007_close_duplicate_active_sessions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['student', 'timestamp'], name='record_student_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['course', 'is_active'], name='session_course_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(django.db.models.functions.text.Upper('course_code'), name='course_code_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='courseenrollment',
+            index=models.Index(fields=['student', 'semester'], name='enrollment_student_sem_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancesession',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('lecturer',), name='one_active_session_per_lecturer'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancesession',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('course',), name='one_active_session_per_course'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_session_semester(apps, schema_editor):
+    AttendanceRecord = apps.get_model('apis', 'AttendanceRecord')
+    AttendanceSession = apps.get_model('apis', 'AttendanceSession')
+    AttendanceRecord.objects.update(
+        semester_id=Subquery(AttendanceSession.objects.filter(pk=OuterRef('session_id')).values('semester_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0008_session_constraints_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='semester',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='apis.semester'),
+        ),
+        migrations.RunPython(copy_session_semester, migrations.RunPython.noop),
+    ]
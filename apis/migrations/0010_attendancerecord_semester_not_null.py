@@ -0,0 +1,18 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Kept apart from 0009 so the data update is committed before Postgres alters the table
+
+    dependencies = [
+        ('apis', '0009_attendancerecord_semester'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancerecord',
+            name='semester',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='apis.semester'),
+        ),
+    ]
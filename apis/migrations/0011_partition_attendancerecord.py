@@ -0,0 +1,115 @@
+from django.db import migrations
+
+# Rebuilds apis_attendancerecord as a table partitioned by semester (see apis/partitions.py).
+# Postgres requires the partition key in every unique constraint, so the primary key
+# becomes (record_id, semester_id) and the one-record-per-session rule becomes
+# (session_id, student_id, semester_id). A session has one semester, so the rule is unchanged.
+# Django still treats record_id as the primary key; the sequence keeps it unique.
+# This copies every record once, so run it in a maintenance window on a large table.
+# So does reversing it, which rebuilds the plain table 0010 left.
+
+CREATE_SQL = [
+    "SET CONSTRAINTS ALL IMMEDIATE",
+    """CREATE TABLE apis_attendancerecord_partitioned
+       (LIKE apis_attendancerecord INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+       PARTITION BY LIST (semester_id)""",
+]
+
+PARTITION_SQL = "CREATE TABLE apis_attendancerecord_sem{id} PARTITION OF apis_attendancerecord_partitioned FOR VALUES IN ({id})"
+
+# Run once every semester has a partition
+COPY_SQL = [
+    "INSERT INTO apis_attendancerecord_partitioned SELECT * FROM apis_attendancerecord",
+    "CREATE SEQUENCE apis_attendancerecord_partitioned_record_id_seq AS integer",
+    """SELECT setval('apis_attendancerecord_partitioned_record_id_seq',
+                     COALESCE((SELECT MAX(record_id) FROM apis_attendancerecord_partitioned), 0) + 1, false)""",
+    "DROP TABLE apis_attendancerecord",
+    "ALTER TABLE apis_attendancerecord_partitioned RENAME TO apis_attendancerecord",
+    "ALTER SEQUENCE apis_attendancerecord_partitioned_record_id_seq RENAME TO apis_attendancerecord_record_id_seq",
+    "ALTER TABLE apis_attendancerecord ALTER COLUMN record_id SET DEFAULT nextval('apis_attendancerecord_record_id_seq')",
+    "ALTER SEQUENCE apis_attendancerecord_record_id_seq OWNED BY apis_attendancerecord.record_id",
+    "ALTER TABLE apis_attendancerecord ADD PRIMARY KEY (record_id, semester_id)",
+    """ALTER TABLE apis_attendancerecord ADD CONSTRAINT apis_attendancerecord_session_student_semester_uniq
+       UNIQUE (session_id, student_id, semester_id)""",
+    """ALTER TABLE apis_attendancerecord ADD CONSTRAINT apis_attendancerecord_session_id_fk
+       FOREIGN KEY (session_id) REFERENCES apis_attendancesession (session_id) DEFERRABLE INITIALLY DEFERRED""",
+    """ALTER TABLE apis_attendancerecord ADD CONSTRAINT apis_attendancerecord_student_id_fk
+       FOREIGN KEY (student_id) REFERENCES apis_user (user_id) DEFERRABLE INITIALLY DEFERRED""",
+    """ALTER TABLE apis_attendancerecord ADD CONSTRAINT apis_attendancerecord_semester_id_fk
+       FOREIGN KEY (semester_id) REFERENCES apis_semester (id) DEFERRABLE INITIALLY DEFERRED""",
+    'CREATE INDEX record_student_time_idx ON apis_attendancerecord (student_id, "timestamp")',
+]
+
+# Back to the plain table. The partitioned table is moved aside and stripped of the
+# names the new table needs (index names are shared across a schema), then Django
+# creates the plain table itself, so its constraints and indexes get Django's names.
+MOVE_ASIDE_SQL = [
+    "SET CONSTRAINTS ALL IMMEDIATE",
+    "ALTER TABLE apis_attendancerecord RENAME TO apis_attendancerecord_partitioned",
+    "ALTER TABLE apis_attendancerecord_partitioned DROP CONSTRAINT apis_attendancerecord_pkey",
+    "ALTER TABLE apis_attendancerecord_partitioned DROP CONSTRAINT apis_attendancerecord_marks_awarded_check",
+    "DROP INDEX record_student_time_idx",
+    "ALTER SEQUENCE apis_attendancerecord_record_id_seq RENAME TO apis_attendancerecord_partitioned_record_id_seq",
+]
+
+COPY_BACK_SQL = [
+    "INSERT INTO apis_attendancerecord ({columns}) SELECT {columns} FROM apis_attendancerecord_partitioned",
+    """SELECT setval(pg_get_serial_sequence('apis_attendancerecord', 'record_id'),
+                     COALESCE((SELECT MAX(record_id) FROM apis_attendancerecord), 0) + 1, false)""",
+    # Takes the partitions and the old record_id sequence with it
+    "DROP TABLE apis_attendancerecord_partitioned",
+]
+
+
+def partition_attendance_records(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return  # Partitioning is Postgres only; other databases keep the plain table
+
+    Semester = apps.get_model('apis', 'Semester')
+    with schema_editor.connection.cursor() as cursor:
+        for sql in CREATE_SQL:
+            cursor.execute(sql)
+        for semester_id in Semester.objects.values_list('id', flat=True):
+            cursor.execute(PARTITION_SQL.format(id=int(semester_id)))
+        for sql in COPY_SQL:
+            cursor.execute(sql)
+
+
+def unpartition_attendance_records(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        # A detached partition (see detach_partition) holds records the copy can't see
+        cursor.execute(
+            """SELECT c.relname FROM pg_class c
+               WHERE c.relname LIKE %s AND c.relkind = 'r'
+               AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)""",
+            [r'apis\_attendancerecord\_sem%'],
+        )
+        detached = [name for name, in cursor.fetchall()]
+        if detached:
+            raise RuntimeError(
+                f"Reattach or drop the detached partitions first, or their records are lost: {', '.join(detached)}"
+            )
+        for sql in MOVE_ASIDE_SQL:
+            cursor.execute(sql)
+
+    AttendanceRecord = apps.get_model('apis', 'AttendanceRecord')
+    # Foreign keys are added when the migration finishes, after the copy
+    schema_editor.create_model(AttendanceRecord)
+    columns = ', '.join(schema_editor.quote_name(field.column) for field in AttendanceRecord._meta.local_concrete_fields)
+    with schema_editor.connection.cursor() as cursor:
+        for sql in COPY_BACK_SQL:
+            cursor.execute(sql.format(columns=columns))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0010_attendancerecord_semester_not_null'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_attendance_records, unpartition_attendance_records, elidable=False),
+    ]
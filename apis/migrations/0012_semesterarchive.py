@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0011_partition_attendancerecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SemesterArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(help_text='File in ATTENDANCE_ARCHIVE_DIR.', max_length=255)),
+                ('session_count', models.PositiveIntegerField()),
+                ('record_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('semester', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='apis.semester')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0012_semesterarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('ended_before', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AttendanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField(help_text='Monday of the week the sessions started in.')),
+                ('sessions_held', models.PositiveIntegerField(default=0)),
+                ('expected', models.PositiveIntegerField(default=0)),
+                ('attended', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='apis.course')),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='apis.department')),
+                ('faculty', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='apis.faculty')),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='apis.semester')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['semester', 'faculty', 'week'], name='rollup_faculty_week_idx')],
+                'unique_together': {('semester', 'department', 'course', 'week')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# Trigram GIN indexes for user search (apis/search.py) and the admin's user search.
+# Django's icontains/istartswith compare UPPER(column), so the indexes are on UPPER(column);
+# the same indexes also serve pg_trgm's similarity operators.
+# Built CONCURRENTLY so enrollment keeps working while they build, which is why
+# the migration isn't atomic. Creating the extension needs a role allowed to do so.
+
+INDEXES = {
+    'user_matric_trgm_idx': 'matric_number',
+    'user_email_trgm_idx': 'email',
+    'user_first_name_trgm_idx': 'first_name',
+    'user_last_name_trgm_idx': 'last_name',
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return  # pg_trgm is Postgres only; other databases search without these indexes
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, column in INDEXES.items():
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON apis_user USING gin (UPPER({column}) gin_trgm_ops)")
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name in INDEXES:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('apis', '0013_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes, elidable=False),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0015_deferred_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='vault_key',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
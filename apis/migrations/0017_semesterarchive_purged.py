@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-19 15:30
+
+from django.db import migrations, models
+
+
+def mark_purged_archives(apps, schema_editor):
+    # Archives made before this were purged unless --keep-rows left the sessions behind
+    SemesterArchive = apps.get_model('apis', 'SemesterArchive')
+    AttendanceSession = apps.get_model('apis', 'AttendanceSession')
+    kept = AttendanceSession.objects.values('semester_id')
+    SemesterArchive.objects.exclude(semester_id__in=kept).update(purged=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0016_device_vault_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='semesterarchive',
+            name='purged',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_purged_archives, migrations.RunPython.noop),
+    ]
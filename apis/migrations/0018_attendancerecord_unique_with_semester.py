@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# The model now declares the one-record-per-session rule the way the partitioned
+# Postgres table (0011) enforces it: (session, student, semester). Postgres already
+# has that constraint, so only the other databases change.
+
+
+def add_semester_to_unique(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    AttendanceRecord = apps.get_model('apis', 'AttendanceRecord')
+    schema_editor.alter_unique_together(AttendanceRecord, {('session', 'student')}, {('session', 'student', 'semester')})
+
+
+def remove_semester_from_unique(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    AttendanceRecord = apps.get_model('apis', 'AttendanceRecord')
+    schema_editor.alter_unique_together(AttendanceRecord, {('session', 'student', 'semester')}, {('session', 'student')})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0017_semesterarchive_purged'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_semester_to_unique, remove_semester_from_unique),
+            ],
+            state_operations=[
+                migrations.AlterUniqueTogether(
+                    name='attendancerecord',
+                    unique_together={('session', 'student', 'semester')},
+                ),
+            ],
+        ),
+    ]
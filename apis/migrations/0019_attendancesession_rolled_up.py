@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-19 15:51
+
+from django.db import migrations, models
+
+WATERMARK_NAME = 'attendance_rollups'
+
+
+def flag_rolled_up_sessions(apps, schema_editor):
+    # Everything up to the old watermark is already in the rollups
+    RollupWatermark = apps.get_model('apis', 'RollupWatermark')
+    AttendanceSession = apps.get_model('apis', 'AttendanceSession')
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+    if watermark:
+        AttendanceSession.objects.filter(is_active=False, end_time__lte=watermark.ended_before).update(rolled_up=True)
+
+
+def restore_watermark(apps, schema_editor):
+    RollupWatermark = apps.get_model('apis', 'RollupWatermark')
+    AttendanceSession = apps.get_model('apis', 'AttendanceSession')
+    last = AttendanceSession.objects.filter(rolled_up=True).order_by('-end_time').values_list('end_time', flat=True).first()
+    if last:
+        RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'ended_before': last})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0018_attendancerecord_unique_with_semester'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancesession',
+            name='rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(flag_rolled_up_sessions, restore_watermark),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(condition=models.Q(('is_active', False), ('rolled_up', False)), fields=['end_time'], name='session_to_roll_up_idx'),
+        ),
+        migrations.DeleteModel(
+            name='RollupWatermark',
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.core.exceptions import ValidationError
 from smart_selects.db_fields import ChainedForeignKey # For linking two fields
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
@@ -24,6 +25,15 @@ class Department(models.Model):
         return f"{self.name} ({self.faculty})"
 
 
+class LiveManager(models.Manager):
+    """
+    Leaves out rows waiting to be deleted in the background (see apis/deletion.py).
+    Related-object access, e.g. session.course, still reaches them.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(pending_delete=False)
+
+
 class Semester(models.Model):
     SEMESTER_CHOICES = [
         ("First", "First Semester"),
@@ -41,6 +51,10 @@ class Semester(models.Model):
             )
         ]
     )
+    pending_delete = models.BooleanField(default=False, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f"{self.name} Semester {self.session}"
@@ -66,6 +80,16 @@ class Course(models.Model):
         related_name='assigned_courses',
         blank=True
     )
+    pending_delete = models.BooleanField(default=False, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # The device sends course codes in any case and they are matched with iexact, i.e. UPPER(course_code)
+            models.Index(Upper('course_code'), name='course_code_upper_idx'),
+        ]
 
     def __str__(self):
         return f"{self.course_code} - {self.course_name}"
@@ -75,8 +99,12 @@ class UserManager(BaseUserManager):
     """
     Creates a password automatically from the lowercase last–name
     if none is supplied.
+    Users waiting to be deleted in the background are left out, so they can't sign in.
     """
 
+    def get_queryset(self):
+        return super().get_queryset().filter(pending_delete=False)
+
     def create_user(self, email, last_name=None, matric_number=None, password=None, **extra_fields):
         if not email and not matric_number:
             raise ValueError("A user must have either an email or matric number.")
@@ -141,7 +169,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_staff     = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
     is_active    = models.BooleanField(default=True)
+    pending_delete = models.BooleanField(default=False, editable=False)
     objects = UserManager()
+    all_objects = models.Manager()
 
     USERNAME_FIELD  = "email"
     REQUIRED_FIELDS = ['first_name', 'last_name']
@@ -188,16 +218,66 @@ class User(AbstractBaseUser, PermissionsMixin):
                 raise ValidationError({'level': "Lecturers should not have a Level."})
 
 
+class SensorGroup(models.Model):
+    """
+    Scanners that share the same set of fingerprint templates.
+    Slot numbers are only unique within a group.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    capacity = models.PositiveIntegerField(default=1000, help_text="Number of template slots on each sensor in this group.")
+
+    def __str__(self):
+        return self.name
+
+
+class Device(models.Model):
+    """
+    A scanner, known by the X-Device-ID header it sends (its MAC address).
+    Unknown devices are registered in the default group on first contact.
+    """
+    device_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=100, blank=True)
+    sensor_group = models.ForeignKey(SensorGroup, on_delete=models.PROTECT, related_name='devices')
+    # Shared secret the scanner signs template vault requests with; issued from the admin
+    vault_key = models.CharField(max_length=64, blank=True, editable=False)
+
+    def __str__(self):
+        return self.name or self.device_id
+
+
 class FingerprintMapping(models.Model):
     """
     Maps fingerprints to users.
     """
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    fingerprint_id = models.IntegerField(unique=True)
+    sensor_group = models.ForeignKey(SensorGroup, on_delete=models.PROTECT, related_name='fingerprints')
+    fingerprint_id = models.IntegerField()
+
+    class Meta:
+        # Slots are numbered per group. This is also the index the scan endpoints look users up by.
+        unique_together = ("sensor_group", "fingerprint_id")
+
+    def __str__(self):
+        return f"{self.user} → {self.sensor_group} Slot {self.fingerprint_id}"
+
+
+class FingerprintTemplate(models.Model):
+    """
+    Where the server's copy of a slot's template sits in its group's blob file (see apis/template_vault.py).
+    """
+    sensor_group = models.ForeignKey(SensorGroup, on_delete=models.CASCADE, related_name='templates')
+    fingerprint_id = models.IntegerField()
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    checksum = models.BigIntegerField()  # CRC-32 of the template bytes
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("sensor_group", "fingerprint_id")
 
     def __str__(self):
-        return f"{self.user} → Slot {self.fingerprint_id}"
+        return f"{self.sensor_group} Slot {self.fingerprint_id} template"
 
 
 class CourseEnrollment(models.Model):
@@ -208,6 +288,9 @@ class CourseEnrollment(models.Model):
 
     class Meta:
         unique_together = ("student", "course", "semester")
+        indexes = [
+            models.Index(fields=['student', 'semester'], name='enrollment_student_sem_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.course} ({self.semester if self.semester_id else 'No semester'})"
@@ -229,12 +312,44 @@ class AttendanceSession(models.Model):
 
     # A flag to know if students can currently mark their attendance
     is_active = models.BooleanField(default=True)
+    # Set once the ended session is counted in AttendanceRollup (see apis/rollups.py)
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Only one class at a time, enforced by the database rather than a check before insert
+            models.UniqueConstraint(fields=['lecturer'], condition=models.Q(is_active=True), name='one_active_session_per_lecturer'),
+            models.UniqueConstraint(fields=['course'], condition=models.Q(is_active=True), name='one_active_session_per_course'),
+        ]
+        indexes = [
+            models.Index(fields=['course', 'is_active'], name='session_course_active_idx'),
+            # The ended sessions the next rollup run has to add
+            models.Index(fields=['end_time'], condition=models.Q(is_active=False, rolled_up=False), name='session_to_roll_up_idx'),
+        ]
 
     def __str__(self):
         status = "Active" if self.is_active else "Ended"
         return f"Session for {self.course.course_code} on {self.start_time.strftime('%Y-%m-%d')} ({status})"
 
 
+class SemesterArchive(models.Model):
+    """
+    A closed semester whose sessions and records were moved out of the
+    database into a compressed file (see apis/archive.py).
+    """
+    semester = models.OneToOneField(Semester, on_delete=models.CASCADE, related_name='archive')
+    file_name = models.CharField(max_length=255, help_text="File in ATTENDANCE_ARCHIVE_DIR.")
+    session_count = models.PositiveIntegerField()
+    record_count = models.PositiveIntegerField()
+    # False after archive_semester --keep-rows: the rows are still in the database
+    # and reports read them there, until a later run without it deletes them
+    purged = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of {self.semester}"
+
+
 class AttendanceRecord(models.Model):
     """
     A record of a single student's attendance in a specific session.
@@ -242,6 +357,10 @@ class AttendanceRecord(models.Model):
     record_id = models.AutoField(primary_key=True)
     session = models.ForeignKey(AttendanceSession, on_delete=models.CASCADE, related_name="attendees")
     student = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'user_role': 'Student'})
+    # Copied from the session. On Postgres the table is partitioned by semester
+    # (see apis/partitions.py), so filtering on this lets queries skip old semesters.
+    # No index of its own: each partition holds a single semester.
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE, db_index=False)
     
     # Timestamp of when the student's fingerprint was scanned
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -250,13 +369,69 @@ class AttendanceRecord(models.Model):
     marks_awarded = models.PositiveSmallIntegerField(default=1, help_text="Marks awarded for this attendance.")
 
     class Meta:
-        # A student can only have one attendance record per session
-        unique_together = ("session", "student")
+        # A student can only have one attendance record per session. Semester is in the
+        # constraint because a partitioned table's unique keys must include the partition
+        # key; a session has one semester, so it doesn't change what the constraint allows.
+        # On Postgres the table's real primary key is also (record_id, semester_id)
+        # (see migration 0011). Django keeps treating record_id alone as the primary
+        # key, which holds because every partition draws record_id from one sequence.
+        unique_together = ("session", "student", "semester")
+        indexes = [
+            models.Index(fields=['student', 'timestamp'], name='record_student_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.semester_id:
+            self.semester_id = self.session.semester_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.student} attended session {self.session.session_id}"
 
 
+class AttendanceRollup(models.Model):
+    """
+    Attendance totals for one week of one course, among the students of one
+    department. Kept up to date by the update_attendance_rollups command
+    (see apis/rollups.py) so department and faculty reports never read raw records.
+    """
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
+    # The department's faculty when the row was written
+    faculty = models.ForeignKey(Faculty, on_delete=models.SET_NULL, null=True, blank=True)
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    week = models.DateField(help_text="Monday of the week the sessions started in.")
+
+    sessions_held = models.PositiveIntegerField(default=0)
+    # Students of the department enrolled in the course, times sessions held
+    expected = models.PositiveIntegerField(default=0)
+    attended = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("semester", "department", "course", "week")
+        indexes = [
+            models.Index(fields=['semester', 'faculty', 'week'], name='rollup_faculty_week_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.course.course_code} / {self.department} week of {self.week}: {self.attended}/{self.expected}"
+
+
+class EnrollmentCampaign(models.Model):
+    """
+    A batch of enrollment tasks queued at once for every student in a
+    department and/or level who has no fingerprint yet.
+    """
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True)
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        target = " ".join(str(part) for part in (self.department, self.get_level_display() if self.level else None) if part)
+        return f"Campaign #{self.pk}: {target or 'All students'}"
+
+
 class EnrollmentTask(models.Model):
     """
     A task queue for the ESP32 device to enroll fingerprints.
@@ -268,11 +443,56 @@ class EnrollmentTask(models.Model):
         FAILED = 'FAILED', 'Failed'
         TIMED_OUT = 'TIMED_OUT', 'Timed Out'
 
-    slot_id = models.IntegerField(unique=True)
+    sensor_group = models.ForeignKey(SensorGroup, on_delete=models.PROTECT, related_name='enrollment_tasks')
+    slot_id = models.IntegerField()
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     result_message = models.CharField(max_length=255, blank=True, null=True)
+    # Set for campaign tasks, so the fingerprint can be mapped as soon as the device reports success
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='enrollment_tasks')
+    campaign = models.ForeignKey(EnrollmentCampaign, on_delete=models.CASCADE, null=True, blank=True, related_name='tasks')
+
+    class Meta:
+        unique_together = ("sensor_group", "slot_id")
+
+    def __str__(self):
+        return f"Enrollment for {self.sensor_group} Slot {self.slot_id} - {self.get_status_display()}"
+
+
+class PendingDeletion(models.Model):
+    """
+    A course, user or semester being deleted in the background, a batch of
+    rows at a time (see apis/deletion.py).
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        DONE = 'DONE', 'Done'
+        FAILED = 'FAILED', 'Failed'
+
+    MODEL_CHOICES = [
+        ('course', 'Course'),
+        ('user', 'User'),
+        ('semester', 'Semester'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.PositiveIntegerField()
+    # What it was called, since the row itself is renamed and then gone
+    label = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    step = models.CharField(max_length=50, blank=True, help_text="What is being deleted right now.")
+    rows_deleted = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id'], name='deletion_object_idx'),
+        ]
 
     def __str__(self):
-        return f"Enrollment for Slot {self.slot_id} - {self.get_status_display()}"
\ No newline at end of file
+        return f"Deletion of {self.get_model_display().lower()} {self.label} - {self.get_status_display()}"
@@ -0,0 +1,102 @@
+"""
+Postgres LIST partitioning of attendance records by semester.
+
+Migration 0011 turns apis_attendancerecord into a partitioned table with
+one partition per semester, apis_attendancerecord_sem<semester id>.
+Queries that filter on AttendanceRecord.semester only touch that partition.
+A closed semester's partition can be detached, which leaves it as an
+ordinary table to archive or drop without touching the live one.
+
+On other databases the table is left as it is and these helpers do nothing.
+"""
+from django.db import connection
+
+PARENT_TABLE = 'apis_attendancerecord'
+
+
+class PartitionError(Exception):
+    """Raised when a partition operation can't be done."""
+
+
+def partition_name(semester_id):
+    return f"{PARENT_TABLE}_sem{int(semester_id)}"
+
+
+def is_partitioned(using=connection):
+    if using.vendor != 'postgresql':
+        return False
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [PARENT_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def ensure_partition(semester_id, using=connection):
+    """
+    Creates the partition for a semester if it doesn't exist yet.
+    Called when a Semester is saved, since inserts for a semester with no partition fail.
+    """
+    if not is_partitioned(using):
+        return False
+    name = partition_name(semester_id)
+    with using.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" FOR VALUES IN ({int(semester_id)})')
+    return True
+
+
+def list_partitions(using=connection):
+    """
+    Returns [(semester id, table name, attached, size in bytes)] for every
+    semester partition, attached or detached.
+    """
+    if not is_partitioned(using):
+        return []
+    with using.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, i.inhrelid IS NOT NULL, pg_total_relation_size(c.oid)
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+            WHERE c.relkind = 'r' AND c.relname LIKE %s
+            ORDER BY c.relname
+            """,
+            [f"{PARENT_TABLE}\\_sem%"],
+        )
+        rows = cursor.fetchall()
+
+    prefix = f"{PARENT_TABLE}_sem"
+    return [(int(name[len(prefix):]), name, attached, size) for name, attached, size in rows if name[len(prefix):].isdigit()]
+
+
+def detach_partition(semester_id, using=connection):
+    """
+    Takes a semester's records out of the live table. They stay in their own table until dropped.
+    """
+    if not is_partitioned(using):
+        raise PartitionError("Attendance records are not partitioned on this database.")
+    with using.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{partition_name(semester_id)}"')
+
+
+def attach_partition(semester_id, using=connection):
+    """
+    Puts a detached semester back into the live table.
+    """
+    if not is_partitioned(using):
+        raise PartitionError("Attendance records are not partitioned on this database.")
+    with using.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{partition_name(semester_id)}" FOR VALUES IN ({int(semester_id)})'
+        )
+
+
+def drop_partition(semester_id, using=connection):
+    """
+    Deletes a semester's partition, and every record in it, in one statement.
+    """
+    if not is_partitioned(using):
+        raise PartitionError("Attendance records are not partitioned on this database.")
+    with using.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS "{partition_name(semester_id)}"')
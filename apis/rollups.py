@@ -0,0 +1,160 @@
+"""
+Weekly attendance rollups by semester, department and course.
+
+update_rollups adds every ended session not yet rolled up to
+AttendanceRollup and flags it in the same transaction, so each run only
+reads the records of those new sessions. Going by the flag rather than by
+end time means a session whose end commits late, after later-ending ones
+were rolled up, is still added, and never twice. Department and faculty
+reports are summed from the rollups alone.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import AttendanceRecord, AttendanceRollup, AttendanceSession, CourseEnrollment
+
+ROLLUP_LOCK_ID = 0x2011  # Arbitrary key for the Postgres advisory lock below
+BATCH_SIZE = 500
+
+
+def _lock_rollups():
+    """
+    One rollup run at a time, or two runs would add the same sessions twice.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [ROLLUP_LOCK_ID])
+
+
+def week_of(moment):
+    day = timezone.localtime(moment).date()
+    return day - timedelta(days=day.weekday())
+
+
+def _add_sessions(sessions):
+    """
+    Adds a batch of ended sessions, given as (session ID, semester ID, course ID, start time), to the rollups.
+    """
+    session_keys = {pk: (semester_id, course_id, week_of(start_time)) for pk, semester_id, course_id, start_time in sessions}
+    held = Counter(session_keys.values())
+    semester_ids = {key[0] for key in held}
+    course_ids = {key[1] for key in held}
+
+    # {(semester, department, course, week): [faculty, sessions held, expected, attended]}
+    totals = defaultdict(lambda: [None, 0, 0, 0])
+
+    # Everyone enrolled was expected at each session, counted per department
+    enrolled = defaultdict(list)
+    for semester_id, course_id, department_id, faculty_id, count in (
+        CourseEnrollment.objects.filter(semester__in=semester_ids, course__in=course_ids)
+        .values('semester', 'course', 'student__department', 'student__department__faculty')
+        .annotate(count=Count('pk'))
+        .values_list('semester', 'course', 'student__department', 'student__department__faculty', 'count')
+    ):
+        enrolled[semester_id, course_id].append((department_id, faculty_id, count))
+
+    for (semester_id, course_id, week), session_count in held.items():
+        for department_id, faculty_id, count in enrolled[semester_id, course_id]:
+            row = totals[semester_id, department_id, course_id, week]
+            row[0] = faculty_id
+            row[1] += session_count
+            row[2] += session_count * count
+
+    # semester__in keeps the scan to those semesters' partitions
+    for session_id, department_id, faculty_id, count in (
+        AttendanceRecord.objects.filter(semester__in=semester_ids, session__in=list(session_keys))
+        .values('session', 'student__department', 'student__department__faculty')
+        .annotate(count=Count('pk'))
+        .values_list('session', 'student__department', 'student__department__faculty', 'count')
+    ):
+        semester_id, course_id, week = session_keys[session_id]
+        row = totals[semester_id, department_id, course_id, week]
+        row[0] = faculty_id
+        row[3] += count
+
+    existing = {
+        (rollup.semester_id, rollup.department_id, rollup.course_id, rollup.week): rollup
+        for rollup in AttendanceRollup.objects.filter(
+            semester__in=semester_ids, course__in=course_ids, week__in={key[2] for key in held},
+        )
+    }
+    changed, created = [], []
+    for (semester_id, department_id, course_id, week), (faculty_id, session_count, expected, attended) in totals.items():
+        rollup = existing.get((semester_id, department_id, course_id, week))
+        if rollup is None:
+            created.append(AttendanceRollup(
+                semester_id=semester_id, faculty_id=faculty_id, department_id=department_id, course_id=course_id, week=week,
+                sessions_held=session_count, expected=expected, attended=attended,
+            ))
+        else:
+            rollup.faculty_id = faculty_id
+            rollup.sessions_held += session_count
+            rollup.expected += expected
+            rollup.attended += attended
+            changed.append(rollup)
+
+    AttendanceRollup.objects.bulk_update(changed, ['faculty', 'sessions_held', 'expected', 'attended'])
+    AttendanceRollup.objects.bulk_create(created)
+
+
+def update_rollups(batch_size=BATCH_SIZE):
+    """
+    Rolls up every ended session not rolled up yet, batch by batch, flagging
+    each batch as it is added. Returns the number of sessions added.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            _lock_rollups()
+            sessions = list(
+                AttendanceSession.objects.filter(is_active=False, rolled_up=False, end_time__isnull=False)
+                .order_by('end_time', 'pk').values_list('pk', 'semester_id', 'course_id', 'start_time')[:batch_size]
+            )
+            if not sessions:
+                return processed
+
+            _add_sessions(sessions)
+            AttendanceSession.objects.filter(pk__in=[session[0] for session in sessions]).update(rolled_up=True)
+            processed += len(sessions)
+
+
+def rebuild_rollups(batch_size=BATCH_SIZE):
+    """
+    Throws the rollups away and adds every ended session again.
+    Archived semesters have no sessions left to add, so their rollups are kept.
+    """
+    with transaction.atomic():
+        _lock_rollups()
+        AttendanceRollup.objects.exclude(semester__archive__purged=True).delete()
+        AttendanceSession.objects.filter(rolled_up=True).update(rolled_up=False)
+    return update_rollups(batch_size)
+
+
+def _with_rate(rows):
+    for row in rows:
+        row['rate'] = row['attended'] * 100.0 / row['expected'] if row['expected'] else None
+    return rows
+
+
+def weekly_trend(rollups):
+    """
+    [{week, sessions_held, expected, attended, rate}] for a queryset of rollups, oldest week first.
+    """
+    return _with_rate(list(
+        rollups.values('week')
+        .annotate(sessions_held=Sum('sessions_held'), expected=Sum('expected'), attended=Sum('attended'))
+        .order_by('week')
+    ))
+
+
+def breakdown(rollups, field):
+    """
+    Totals for a queryset of rollups grouped by `field` (e.g. 'department__name').
+    """
+    return _with_rate(list(
+        rollups.values(field)
+        .annotate(sessions_held=Sum('sessions_held'), expected=Sum('expected'), attended=Sum('attended'))
+        .order_by(field)
+    ))
@@ -0,0 +1,106 @@
+"""
+Sends reporting reads to a read replica, when one is configured.
+
+Everything uses the primary ('default') unless the view is wrapped in
+reporting_read. Device endpoints never are, so a scan never waits on the
+replica and a heavy report never competes with scans on the primary.
+
+Replicas lag a little, so after a request writes to the primary,
+ReplicaStickinessMiddleware pins that user's session to the primary for
+REPLICA_STICKY_SECONDS and they always see their own changes.
+"""
+import time
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+REPLICA_DB_ALIAS = 'replica'
+STICKY_SESSION_KEY = '_primary_until'
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+# A list the middleware hands each request; the router appends to it on every write
+_writes = ContextVar('primary_writes', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and REPLICA_DB_ALIAS in settings.DATABASES:
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        writes = _writes.get()
+        if writes is not None:
+            writes.append(model)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both, so objects read from either can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A streaming replica gets the schema from the primary. For a local
+        # copy, `migrate --database=replica` builds it.
+        return True
+
+
+def _pinned_to_primary(request):
+    session = getattr(request, 'session', None)
+    return session is not None and session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+def reporting_read(view):
+    """
+    Runs a read-only view against the replica, unless the user wrote recently.
+    Put it below login_required / user_passes_test, so the session and user
+    are loaded from the primary before switching.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if _pinned_to_primary(request):
+            return view(request, *args, **kwargs)
+        token = _read_from_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+    return wrapper
+
+
+def _pin(request):
+    request.session[STICKY_SESSION_KEY] = time.time() + settings.REPLICA_STICKY_SECONDS
+
+
+@sync_and_async_middleware
+def ReplicaStickinessMiddleware(get_response):
+    """
+    Pins a logged-in user to the primary for a few seconds after any
+    request of theirs writes. Scanners have no login, so their writes
+    never create sessions.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            writes = []
+            token = _writes.set(writes)
+            try:
+                response = await get_response(request)
+            finally:
+                _writes.reset(token)
+            if writes and (await request.auser()).is_authenticated:
+                _pin(request)
+            return response
+    else:
+        def middleware(request):
+            writes = []
+            token = _writes.set(writes)
+            try:
+                response = get_response(request)
+            finally:
+                _writes.reset(token)
+            if writes and request.user.is_authenticated:
+                _pin(request)
+            return response
+    return middleware
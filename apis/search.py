@@ -0,0 +1,84 @@
+"""
+Student and lecturer search for the enrollment screens' autocomplete.
+
+Every word typed has to match the start or any part of the matric number,
+email, first name or last name (case-insensitive). On Postgres a word of
+three letters or more also matches a name it is close to, so typos still
+find the person. Django's case-insensitive lookups compare UPPER(column),
+and the pg_trgm GIN indexes from migration 0014 are on exactly those
+expressions, so no search reads the whole user table.
+
+Each result carries the user's fingerprint slot, from the same query.
+"""
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+from .models import User
+
+SEARCH_FIELDS = ('matric_number', 'email', 'first_name', 'last_name')
+MIN_QUERY_LENGTH = 2
+MAX_TERMS = 4
+# Trigram matching needs at least one whole trigram to use the index
+FUZZY_MIN_LENGTH = 3
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+
+
+def _term_filter(term, fuzzy):
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': term})
+    if fuzzy and len(term) >= FUZZY_MIN_LENGTH:
+        # word_similarity against the indexed UPPER(name); pg_trgm ignores case anyway
+        condition |= Q(first_name_upper__trigram_word_similar=term) | Q(last_name_upper__trigram_word_similar=term)
+    return condition
+
+
+def search_users(query, role=None, limit=DEFAULT_LIMIT):
+    """
+    Up to `limit` users matching every word of `query`: exact matric number or
+    email matches first, then prefix matches, then the rest by name.
+    """
+    query = " ".join(query.split())
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    fuzzy = connection.vendor == 'postgresql'
+
+    users = User.objects.filter(is_active=True)
+    if role:
+        users = users.filter(user_role=role)
+    if fuzzy:
+        users = users.alias(first_name_upper=Upper('first_name'), last_name_upper=Upper('last_name'))
+    for term in query.split()[:MAX_TERMS]:
+        users = users.filter(_term_filter(term, fuzzy))
+
+    first = query.split()[0]
+    rank = Case(
+        When(Q(matric_number__iexact=query) | Q(email__iexact=query), then=Value(0)),
+        When(
+            Q(matric_number__istartswith=first) | Q(email__istartswith=first)
+            | Q(last_name__istartswith=first) | Q(first_name__istartswith=first),
+            then=Value(1),
+        ),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+    rows = users.annotate(rank=rank).order_by('rank', 'last_name', 'first_name', 'user_id').values(
+        'user_id', 'first_name', 'last_name', 'matric_number', 'email', 'user_role', 'level', 'department__name',
+        'fingerprintmapping__sensor_group_id', 'fingerprintmapping__fingerprint_id',
+    )[:limit]
+
+    return [{
+        'id': row['user_id'],
+        'name': f"{row['first_name']} {row['last_name']}",
+        'matric_number': row['matric_number'],
+        'email': row['email'],
+        'role': row['user_role'],
+        'level': row['level'],
+        'department': row['department__name'],
+        'fingerprint': {
+            'sensor_group': row['fingerprintmapping__sensor_group_id'],
+            'slot': row['fingerprintmapping__fingerprint_id'],
+        } if row['fingerprintmapping__fingerprint_id'] is not None else None,
+    } for row in rows]
@@ -0,0 +1,97 @@
+"""
+Maps scanners to the sensor group (slot namespace) their templates live in.
+
+Template vault requests carry more than a slot number, so they also have to
+prove which scanner sent them: see authenticate_vault_device.
+"""
+import hashlib
+import hmac
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import SensorGroup, Device
+
+DEFAULT_GROUP_NAME = 'Default'  # Created by migration 0004 for the original single sensor
+DEVICE_GROUP_KEY = 'sensor:device:{device_id}'
+DEFAULT_GROUP_KEY = 'sensor:default'
+
+
+def get_default_group_id():
+    group_id = cache.get(DEFAULT_GROUP_KEY)
+    if group_id is None:
+        group_id = SensorGroup.objects.get_or_create(name=DEFAULT_GROUP_NAME)[0].pk
+        cache.set(DEFAULT_GROUP_KEY, group_id, timeout=settings.DEVICE_GROUP_CACHE_TIMEOUT)
+    return group_id
+
+
+def get_sensor_group_id(device_id):
+    """
+    Returns the sensor group ID for a scanner's X-Device-ID. Unknown scanners
+    are registered in the default group, so an admin can move them later.
+    Cached, since every scan needs it.
+    """
+    if not device_id:
+        # Old firmware that doesn't identify itself
+        return get_default_group_id()
+
+    key = DEVICE_GROUP_KEY.format(device_id=device_id)
+    group_id = cache.get(key)
+    if group_id is None:
+        device, _ = Device.objects.get_or_create(device_id=device_id, defaults={'sensor_group_id': get_default_group_id()})
+        group_id = device.sensor_group_id
+        cache.set(key, group_id, timeout=settings.DEVICE_GROUP_CACHE_TIMEOUT)
+    return group_id
+
+
+def forget_device(device_id):
+    cache.delete(DEVICE_GROUP_KEY.format(device_id=device_id))
+
+
+def get_request_sensor_group_id(request):
+    return get_sensor_group_id(request.headers.get('X-Device-ID'))
+
+
+class DeviceAuthError(Exception):
+    """Raised when a template vault request isn't from an approved scanner."""
+
+
+def vault_signature(key, method, path, timestamp, body):
+    """
+    Hex HMAC-SHA256 of the request under the scanner's vault key:
+    "METHOD\nPATH\nTIMESTAMP\nSHA256(body)".
+    """
+    message = '\n'.join([method.upper(), path, str(timestamp), hashlib.sha256(body).hexdigest()])
+    return hmac.new(key.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+def authenticate_vault_device(request):
+    """
+    Returns the sensor group ID of the scanner that signed the request.
+
+    Only scanners an admin has issued a vault key to are accepted, and
+    never ones still in the default group, where every unknown scanner
+    lands. The request must be signed with the key (X-Device-Signature)
+    within DEVICE_SIGNATURE_MAX_AGE seconds of X-Device-Timestamp.
+    """
+    device_id = request.headers.get('X-Device-ID')
+    timestamp = request.headers.get('X-Device-Timestamp', '')
+    signature = request.headers.get('X-Device-Signature', '')
+    if not device_id or not timestamp or not signature:
+        raise DeviceAuthError("This request must be signed by the scanner.")
+
+    try:
+        age = abs(time.time() - int(timestamp))
+    except ValueError:
+        raise DeviceAuthError("X-Device-Timestamp must be a Unix time.")
+    if age > settings.DEVICE_SIGNATURE_MAX_AGE:
+        raise DeviceAuthError("The request signature has expired.")
+
+    # Not cached: a revoked key or a move back to the default group takes effect at once
+    device = Device.objects.filter(device_id=device_id).select_related('sensor_group').first()
+    if device is None or not device.vault_key or device.sensor_group.name == DEFAULT_GROUP_NAME:
+        raise DeviceAuthError("This scanner isn't approved for the template vault.")
+
+    expected = vault_signature(device.vault_key, request.method, request.get_full_path(), timestamp, request.body)
+    if not hmac.compare_digest(expected, signature):
+        raise DeviceAuthError("The request signature is invalid.")
+    return device.sensor_group_id
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .catalog import invalidate_catalog
+from .db_pool import track_checkout
+from .models import Course, Semester
+from .partitions import ensure_partition
+
+
+@receiver(post_save, sender=Semester)
+def create_semester_partition(sender, instance, created, **kwargs):
+    # Attendance for a new semester needs its own partition before the first record is inserted
+    if created:
+        ensure_partition(instance.pk)
+
+
+@receiver(connection_created)
+def watch_pooled_connection(sender, connection, **kwargs):
+    # With pooling on, each new Django connection is a checkout from the pool
+    track_checkout(connection)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, **kwargs):
+    # After the commit, so the catalog isn't rebuilt from the old rows in between
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(m2m_changed, sender=Course.departments.through)
+@receiver(m2m_changed, sender=Course.available_semesters.through)
+def course_offering_changed(sender, action, **kwargs):
+    # Sent for changes from either side, e.g. course.departments.add() or department.courses.add()
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(invalidate_catalog)
@@ -0,0 +1,136 @@
+"""
+Server-side copies of enrolled fingerprint templates, so a new or
+replaced scanner can be provisioned in one download instead of
+re-enrolling everyone.
+
+Templates are appended to one blob file per sensor group and never
+rewritten. FingerprintTemplate rows record where each one starts and how
+long it is. Re-uploading a slot appends a new copy and moves its index row.
+Reads go through mmap, so a download pages the file in as it streams.
+
+Download format: one record per template, in slot order,
+
+    slot (uint16, big-endian) | length (uint16, big-endian) | template bytes
+
+Copies that fail their checksum or are missing from the blob file are
+found while the index is built, so X-Template-Count is exactly the
+number of records that follow.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import zlib
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from .models import FingerprintMapping, FingerprintTemplate
+
+RECORD_HEADER = struct.Struct('>HH')
+# Largest slot and template length a record header can hold
+RECORD_FIELD_MAX = 0xFFFF
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateError(ValueError):
+    """Raised when an uploaded template can't be stored."""
+
+
+def _blob_path(sensor_group_id):
+    return os.path.join(settings.TEMPLATE_VAULT_DIR, f"group-{sensor_group_id}.bin")
+
+
+def store_template(sensor_group_id, slot, data):
+    """
+    Appends a template to the group's blob file and points the slot's index row at it.
+    """
+    if not data:
+        raise TemplateError("Template is empty.")
+    max_bytes = min(settings.TEMPLATE_MAX_BYTES, RECORD_FIELD_MAX)
+    if len(data) > max_bytes:
+        raise TemplateError(f"Template is larger than {max_bytes} bytes.")
+    if not 0 < slot <= RECORD_FIELD_MAX:
+        raise TemplateError(f"Slot must be between 1 and {RECORD_FIELD_MAX}.")
+
+    os.makedirs(settings.TEMPLATE_VAULT_DIR, exist_ok=True)
+    with open(_blob_path(sensor_group_id), 'ab') as blob:
+        # Only one writer per file at a time, across all workers
+        fcntl.flock(blob, fcntl.LOCK_EX)
+        try:
+            offset = blob.seek(0, os.SEEK_END)
+            blob.write(data)
+            blob.flush()
+            os.fsync(blob.fileno())
+        finally:
+            fcntl.flock(blob, fcntl.LOCK_UN)
+
+    template, _ = FingerprintTemplate.objects.update_or_create(
+        sensor_group_id=sensor_group_id,
+        fingerprint_id=slot,
+        defaults={'offset': offset, 'length': len(data), 'checksum': zlib.crc32(data)},
+    )
+    return template
+
+
+def template_index(sensor_group_id):
+    """
+    (slot, offset, length, checksum) for every template in the group that
+    still belongs to an enrolled user, in slot order. Copies that are
+    damaged or missing from the blob file are logged and left out, so the
+    slot can be re-enrolled.
+    """
+    rows = list(
+        FingerprintTemplate.objects.filter(
+            Exists(FingerprintMapping.objects.filter(sensor_group_id=OuterRef('sensor_group_id'), fingerprint_id=OuterRef('fingerprint_id'))),
+            sensor_group_id=sensor_group_id,
+        ).order_by('fingerprint_id').values_list('fingerprint_id', 'offset', 'length', 'checksum')
+    )
+    if not rows:
+        return rows
+
+    try:
+        blob = open(_blob_path(sensor_group_id), 'rb')
+    except FileNotFoundError:
+        logger.error("Template blob for sensor group %s is missing; leaving out %d templates", sensor_group_id, len(rows))
+        return []
+
+    index = []
+    with blob:
+        size = os.fstat(blob.fileno()).st_size
+        # mmap can't map an empty file
+        blob_map = mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        try:
+            for slot, offset, length, checksum in rows:
+                if offset + length > size:
+                    logger.error("Template for slot %s in sensor group %s is past the end of its blob file", slot, sensor_group_id)
+                elif zlib.crc32(blob_map[offset:offset + length]) != checksum:
+                    logger.error("Template for slot %s in sensor group %s fails its checksum", slot, sensor_group_id)
+                else:
+                    index.append((slot, offset, length, checksum))
+        finally:
+            if size:
+                blob_map.close()
+    return index
+
+
+def stream_templates(index, sensor_group_id, chunk_size=None):
+    """
+    Yields the download for `index` (see template_index) in chunks of about chunk_size bytes.
+    """
+    chunk_size = chunk_size or settings.TEMPLATE_STREAM_CHUNK_SIZE
+    if not index:
+        return
+
+    # Blob files are only ever appended to, so what template_index checked is still there
+    with open(_blob_path(sensor_group_id), 'rb') as blob:
+        with mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ) as blob_map:
+            chunk = bytearray()
+            for slot, offset, length, _ in index:
+                chunk += RECORD_HEADER.pack(slot, length)
+                chunk += blob_map[offset:offset + length]
+                if len(chunk) >= chunk_size:
+                    yield bytes(chunk)
+                    chunk.clear()
+            if chunk:
+                yield bytes(chunk)
@@ -1,3 +1,1582 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import statistics
+import struct
+import tempfile
+import threading
+import time
+from io import StringIO
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.management import CommandError, call_command
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.db.models.functions import Upper
+from django.http import JsonResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from . import archive, device_actions, device_codec, device_socket, housekeeping, idempotency, live, routers, template_vault, throttling, traffic, urls
+from .models import (
+    User, Faculty, Department, Semester, CurrentSemester, Course, CourseEnrollment, AttendanceSession, AttendanceRecord,
+    FingerprintMapping, EnrollmentCampaign, EnrollmentTask, AttendanceRollup, PendingDeletion, SensorGroup, Device,
+    SemesterArchive, FingerprintTemplate,
+)
+from .admin import table_row_count
+from .analytics import semester_report
+from .catalog import eligible_courses
+from .deletion import DeletionError, schedule_deletion
+from .forms import CourseEnrollmentForm
+from .live import get_task_state
+from .partitions import partition_name
+from .rollups import breakdown, rebuild_rollups, update_rollups, weekly_trend
+from .search import search_users
+from .sensors import get_default_group_id, vault_signature
 
-# Create your tests here.
+
+class HotPathTestData:
+    """
+    One lecturer, one student and one course, enough for the device hot paths.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name="Computer Science")
+        cls.semester = Semester.objects.create(name=Semester.SEMESTER_CHOICES[0][0], session="2025/2026")
+        CurrentSemester.objects.create(semester=cls.semester)
+
+        cls.lecturer = User.objects.create(email="lecturer@example.com", first_name="Ada", last_name="Obi", user_role='Lecturer', department=cls.department)
+        cls.student = User.objects.create(email="student@example.com", first_name="Tolu", last_name="Ade", matric_number="CSC/001", level='100', user_role='Student', department=cls.department)
+
+        cls.course = Course.objects.create(course_name="Intro to Computing", course_code="CSC101", minimum_level='100')
+        cls.course.lecturers.add(cls.lecturer)
+        cls.other_course = Course.objects.create(course_name="Programming I", course_code="CSC102", minimum_level='100')
+        cls.other_course.lecturers.add(cls.lecturer)
+        CourseEnrollment.objects.create(student=cls.student, course=cls.course, semester=cls.semester)
+
+        cls.group_id = get_default_group_id()
+        FingerprintMapping.objects.create(user=cls.lecturer, sensor_group_id=cls.group_id, fingerprint_id=1)
+        FingerprintMapping.objects.create(user=cls.student, sensor_group_id=cls.group_id, fingerprint_id=2)
+
+
+class ActiveSessionConstraintTests(HotPathTestData, TestCase):
+    def test_one_active_session_per_lecturer(self):
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            AttendanceSession.objects.create(course=self.other_course, lecturer=self.lecturer, semester=self.semester)
+
+    def test_one_active_session_per_course(self):
+        other_lecturer = User.objects.create(email="other@example.com", first_name="Ngozi", last_name="Eze", user_role='Lecturer')
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            AttendanceSession.objects.create(course=self.course, lecturer=other_lecturer, semester=self.semester)
+
+    def test_ended_sessions_do_not_count(self):
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester, is_active=False, end_time=timezone.now())
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+
+    def test_start_session_twice_returns_conflict(self):
+        data = {'fingerprint_id': 1, 'course_code': 'csc101'}
+        _, status, _ = device_actions.start_session(data, self.group_id)
+        self.assertEqual(status, 201)
+
+        _, status, _ = device_actions.start_session(data, self.group_id)
+        self.assertEqual(status, 409)
+        self.assertEqual(AttendanceSession.objects.filter(is_active=True).count(), 1)
+
+    def test_mark_attendance_matches_course_code_in_any_case(self):
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        _, status, _ = device_actions.mark_attendance({'fingerprint_id': 2, 'course_code': 'cSc101'}, self.group_id)
+        self.assertEqual(status, 201)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Index use is checked against Postgres query plans")
+class HotPathIndexTests(HotPathTestData, TestCase):
+    """
+    The test tables are tiny, so sequential scans are switched off
+    to see which index the planner would pick on real data.
+    """
+    def assertUsesIndex(self, queryset, *index_names):
+        """
+        Passes when the plan uses any of index_names.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), f"None of {index_names} in:\n{plan}")
+
+    def test_course_code_lookup_uses_upper_index(self):
+        self.assertUsesIndex(Course.objects.filter(course_code__iexact='csc101'), 'course_code_upper_idx')
+
+    def test_active_session_by_lecturer_uses_partial_index(self):
+        self.assertUsesIndex(AttendanceSession.objects.filter(lecturer=self.lecturer, is_active=True), 'one_active_session_per_lecturer')
+
+    def test_active_session_by_course_uses_partial_index(self):
+        self.assertUsesIndex(AttendanceSession.objects.filter(course=self.course, is_active=True), 'one_active_session_per_course')
+
+    def test_course_sessions_use_course_active_index(self):
+        self.assertUsesIndex(AttendanceSession.objects.filter(course=self.course, is_active=False), 'session_course_active_idx')
+
+    def test_student_history_uses_student_time_index(self):
+        since = timezone.now() - timezone.timedelta(days=7)
+        # Partitioned, each semester's table has its own copy of the index, named after its columns
+        self.assertUsesIndex(
+            AttendanceRecord.objects.filter(student=self.student, timestamp__gte=since),
+            'record_student_time_idx', f"{partition_name(self.semester.pk)}_student_id_timestamp_idx",
+        )
+
+    def test_student_semester_enrollments_use_composite_index(self):
+        self.assertUsesIndex(CourseEnrollment.objects.filter(student=self.student, semester=self.semester), 'enrollment_student_sem_idx')
+
+    def test_user_search_uses_trigram_indexes(self):
+        self.assertUsesIndex(User.objects.filter(matric_number__icontains='csc'), 'user_matric_trgm_idx')
+        self.assertUsesIndex(User.objects.filter(email__istartswith='stud'), 'user_email_trgm_idx')
+        self.assertUsesIndex(User.objects.alias(upper=Upper('last_name')).filter(upper__trigram_word_similar='adee'), 'user_last_name_trgm_idx')
+
+
+class UserSearchTests(HotPathTestData, TestCase):
+    def names(self, query, **kwargs):
+        return [user['name'] for user in search_users(query, **kwargs)]
+
+    def test_matches_the_start_or_any_part_of_each_field(self):
+        self.assertEqual(self.names('csc/0'), ["Tolu Ade"])
+        self.assertEqual(self.names('STUDENT@'), ["Tolu Ade"])
+        self.assertEqual(self.names('obi'), ["Ada Obi"])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.names('tolu ade'), ["Tolu Ade"])
+        self.assertEqual(self.names('tolu obi'), [])
+
+    def test_exact_match_comes_first(self):
+        User.objects.create(email="other@example.com", first_name="Adaeze", last_name="Nwosu", matric_number="CSC/0010", level='100', user_role='Student')
+        self.assertEqual(self.names('CSC/0010'), ["Adaeze Nwosu"])
+        self.assertEqual(self.names('csc/001'), ["Tolu Ade", "Adaeze Nwosu"])
+
+    def test_results_carry_fingerprint_status_in_one_query(self):
+        User.objects.create(email="new@example.com", first_name="Tobi", last_name="Ade", matric_number="CSC/002", level='100', user_role='Student')
+        with self.assertNumQueries(1):
+            results = {user['matric_number']: user['fingerprint'] for user in search_users('ade')}
+        self.assertEqual(results, {'CSC/001': {'sensor_group': self.group_id, 'slot': 2}, 'CSC/002': None})
+
+    def test_role_limit_and_short_queries(self):
+        for n in range(5):
+            User.objects.create(email=f"ade{n}@example.com", first_name="Ade", last_name=f"No{n}", user_role='Lecturer')
+        self.assertEqual(len(search_users('ade', role='Lecturer', limit=3)), 3)
+        self.assertNotIn("Tolu Ade", self.names('ade', role='Lecturer', limit=25))
+        self.assertEqual(search_users('a'), [])
+
+
+@override_settings(COURSE_CATALOG_CACHE_TIMEOUT=86400, COURSE_CATALOG_LOCAL_CACHE_TIMEOUT=60)
+class CourseCatalogTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for course in (cls.course, cls.other_course):
+            course.departments.add(cls.department)
+            course.available_semesters.add(cls.semester)
+        Course.objects.filter(pk=cls.other_course.pk).update(minimum_level='200')
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def codes(self, level='100'):
+        return [code for _, code, _, _ in eligible_courses(self.semester.pk, self.department.pk, level)]
+
+    def test_one_query_builds_the_semester_then_it_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.codes('100'), ['CSC101'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.codes('200'), ['CSC101', 'CSC102'])
+            self.assertEqual(self.codes('100'), ['CSC101'])
+
+    def test_changing_a_course_retires_the_catalog(self):
+        self.codes()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_course.minimum_level = '100'
+            self.other_course.save()
+        self.assertEqual(self.codes(), ['CSC101', 'CSC102'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department.courses.remove(self.course)
+        self.assertEqual(self.codes(), ['CSC102'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_course.available_semesters.clear()
+        self.assertEqual(self.codes(), [])
+
+    def test_per_process_cache_keeps_lists_briefly(self):
+        # Other workers never hear about a change, so their copies must expire soon
+        for local, timeout in ((True, 60), (False, 86400)):
+            with self.subTest(local=local), mock.patch('apis.catalog.is_local_cache', return_value=local), \
+                    mock.patch.object(type(caches['default']), 'set_many', autospec=True) as set_many:
+                caches['default'].clear()
+                self.codes()
+                self.assertEqual(set_many.call_args.kwargs['timeout'], timeout)
+
+    def test_form_choices_and_validation_come_from_the_catalog(self):
+        self.codes('200')
+        with self.assertNumQueries(0):
+            form = CourseEnrollmentForm(user=self.student, semester=self.semester, enrolled_course_ids={self.course.pk})
+            self.assertEqual([value for value, _ in form.fields['courses'].choices], [])
+
+        form = CourseEnrollmentForm({'courses': [self.course.pk]}, user=self.student, semester=self.semester, enrolled_course_ids=set())
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save(), ['CSC101'])
+
+
+class BulkCourseRegistrationTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.courses = [cls.course, cls.other_course] + [
+            Course.objects.create(course_name=f"Elective {n}", course_code=f"CSC2{n:02d}", minimum_level='100') for n in range(3)
+        ]
+        for course in cls.courses:
+            course.departments.add(cls.department)
+            course.available_semesters.add(cls.semester)
+        cls.closed_course = Course.objects.create(course_name="Final Year Project", course_code="CSC499", minimum_level='400')
+        cls.closed_course.departments.add(cls.department)
+        cls.closed_course.available_semesters.add(cls.semester)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.student)
+
+    def enrolled_codes(self):
+        return sorted(CourseEnrollment.objects.filter(student=self.student, semester=self.semester).values_list('course__course_code', flat=True))
+
+    def test_enrolls_in_every_selected_course_with_one_insert(self):
+        course_ids = [course.pk for course in self.courses[1:]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('enroll-course'), {'courses': course_ids})
+        self.assertRedirects(response, reverse('enroll-course'), fetch_redirect_response=False)
+        self.assertEqual(self.enrolled_codes(), ['CSC101', 'CSC102', 'CSC200', 'CSC201', 'CSC202'])
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT') and '"apis_courseenrollment"' in query['sql']]
+        self.assertEqual(len(inserts), 1)
+
+    def test_reports_every_problem_and_enrolls_nothing(self):
+        response = self.client.post(reverse('enroll-course'), {'courses': [self.course.pk, self.closed_course.pk, self.courses[2].pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].errors['courses'], [
+            "You are already enrolled in CSC101.",
+            "CSC499 is not open to your department and level this semester.",
+        ])
+        self.assertEqual(self.enrolled_codes(), ['CSC101'])
+
+    def test_already_enrolled_courses_are_not_offered(self):
+        response = self.client.get(reverse('enroll-course'))
+        offered = [value for value, _ in response.context['form'].fields['courses'].choices]
+        self.assertEqual(offered, [course.pk for course in self.courses[1:]])
+
+
+@override_settings(ATTENDANCE_SESSION_MAX_MINUTES=240, ENROLLMENT_TASK_TIMEOUT=300, ENROLLMENT_TASK_RETENTION_DAYS=30)
+class HousekeepingTests(HotPathTestData, TestCase):
+    def ago(self, **kwargs):
+        return timezone.now() - timedelta(**kwargs)
+
+    def test_closes_sessions_left_open_too_long(self):
+        stale = AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        AttendanceSession.objects.filter(pk=stale.pk).update(start_time=self.ago(hours=5))
+        other_lecturer = User.objects.create(email="other@example.com", first_name="Ngozi", last_name="Eze", user_role='Lecturer')
+        current = AttendanceSession.objects.create(course=self.other_course, lecturer=other_lecturer, semester=self.semester)
+
+        self.assertEqual(housekeeping.close_stale_sessions(batch_size=10), 1)
+        stale.refresh_from_db()
+        self.assertFalse(stale.is_active)
+        self.assertGreater(stale.end_time, self.ago(minutes=1))
+        self.assertTrue(AttendanceSession.objects.get(pk=current.pk).is_active)
+
+    def test_times_out_tasks_nobody_reported_on(self):
+        campaign = EnrollmentCampaign.objects.create()
+        taken = EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=10, status=EnrollmentTask.Status.PROCESSING)
+        lone = EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=11)
+        queued = EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=12, campaign=campaign)
+        recent = EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=13, status=EnrollmentTask.Status.PROCESSING)
+        EnrollmentTask.objects.exclude(pk=recent.pk).update(updated_at=self.ago(minutes=10))
+
+        self.assertEqual(housekeeping.time_out_stale_tasks(batch_size=10), 2)
+        statuses = dict(EnrollmentTask.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[taken.pk], EnrollmentTask.Status.TIMED_OUT)
+        self.assertEqual(statuses[lone.pk], EnrollmentTask.Status.TIMED_OUT)
+        self.assertEqual(statuses[queued.pk], EnrollmentTask.Status.PENDING)
+        self.assertEqual(statuses[recent.pk], EnrollmentTask.Status.PROCESSING)
+        self.assertEqual(get_task_state(taken.pk)['status'], EnrollmentTask.Status.TIMED_OUT)
+
+    def test_purges_old_finished_tasks_in_batches(self):
+        for slot in range(20, 25):
+            EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=slot, status=EnrollmentTask.Status.SUCCESS)
+        EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=30, status=EnrollmentTask.Status.PENDING)
+        EnrollmentTask.objects.update(updated_at=self.ago(days=31))
+        EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=31, status=EnrollmentTask.Status.FAILED)
+
+        self.assertEqual(housekeeping.purge_finished_tasks(batch_size=2), 5)
+        self.assertEqual(sorted(EnrollmentTask.objects.values_list('slot_id', flat=True)), [30, 31])
+
+    def test_purges_expired_login_sessions(self):
+        Session.objects.create(session_key='expired', session_data='', expire_date=self.ago(days=1))
+        Session.objects.create(session_key='current', session_data='', expire_date=timezone.now() + timedelta(days=1))
+        self.assertEqual(housekeeping.purge_expired_sessions(batch_size=1), 1)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+
+    def test_command_runs_every_job_once(self):
+        out = StringIO()
+        call_command('housekeeping', '--once', '--pause=0', verbosity=2, stdout=out)
+        self.assertEqual(out.getvalue().count(" row(s) in "), len(housekeeping.JOBS))
+        # Still usable: a single pass leaves the connection to the daemon loop
+        self.assertTrue(connection.is_usable())
+
+    @skipUnless(connection.vendor == 'postgresql', "The housekeeping lock is a Postgres advisory lock")
+    def test_a_second_housekeeper_skips_the_pass(self):
+        other = connection.copy()
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(%s)", [housekeeping.HOUSEKEEPING_LOCK_ID])
+            stale = AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+            AttendanceSession.objects.filter(pk=stale.pk).update(start_time=self.ago(days=2))
+            out = StringIO()
+            call_command('housekeeping', '--once', '--pause=0', stdout=out)
+            self.assertIn("skipped", out.getvalue())
+            self.assertTrue(AttendanceSession.objects.get(pk=stale.pk).is_active)
+        finally:
+            other.close()
+
+
+class BackgroundDeletionTests(HotPathTestData, TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.session = AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        AttendanceRecord.objects.create(session=self.session, student=self.student)
+        other = User.objects.create(email="second@example.com", first_name="Bola", last_name="Ige", matric_number="CSC/002", level='100', user_role='Student')
+        AttendanceRecord.objects.create(session=self.session, student=other)
+
+    def test_course_is_hidden_at_once_then_deleted_in_batches(self):
+        self.course.departments.add(self.department)
+        self.course.available_semesters.add(self.semester)
+        with self.captureOnCommitCallbacks(execute=True):
+            job = schedule_deletion(self.course, requested_by=self.lecturer)
+
+        self.assertFalse(Course.objects.filter(pk=self.course.pk).exists())
+        self.assertEqual(eligible_courses(self.semester.pk, self.department.pk, '100'), [])
+        self.assertFalse(AttendanceSession.objects.get(pk=self.session.pk).is_active)
+        # Its code can be reused straight away
+        Course.objects.create(course_name="Intro to Computing", course_code="CSC101", minimum_level='100')
+
+        deleted = housekeeping.process_pending_deletions(batch_size=1)
+        self.assertFalse(Course.all_objects.filter(pk=self.course.pk).exists())
+        self.assertFalse(AttendanceRecord.objects.filter(session=self.session).exists())
+        self.assertFalse(CourseEnrollment.objects.filter(course=self.course).exists())
+        job.refresh_from_db()
+        self.assertEqual(job.status, PendingDeletion.Status.DONE)
+        self.assertEqual(job.rows_deleted, deleted)
+        self.assertEqual(job.label, "CSC101 - Intro to Computing")
+
+    def test_deleted_user_can_no_longer_sign_in(self):
+        self.student.set_password("secret")
+        self.student.save()
+        schedule_deletion(self.student)
+        self.assertIsNone(authenticate(username="CSC/001", password="secret"))
+        self.assertFalse(User.objects.filter(pk=self.student.pk).exists())
+
+        housekeeping.process_pending_deletions(batch_size=10)
+        self.assertFalse(User.all_objects.filter(pk=self.student.pk).exists())
+        self.assertFalse(FingerprintMapping.objects.filter(user_id=self.student.pk).exists())
+        self.assertEqual(AttendanceRecord.objects.filter(session=self.session).count(), 1)
+
+    def test_semester_in_use_is_not_deleted(self):
+        with self.assertRaises(DeletionError):
+            schedule_deletion(self.semester)
+        old = Semester.objects.create(name=Semester.SEMESTER_CHOICES[1][0], session="2024/2025")
+        AttendanceSession.objects.create(course=self.other_course, lecturer=self.lecturer, semester=old, is_active=False)
+        schedule_deletion(old)
+        housekeeping.process_pending_deletions(batch_size=10)
+        self.assertFalse(AttendanceSession.objects.filter(semester_id=old.pk).exists())
+        self.assertFalse(Semester.all_objects.filter(pk=old.pk).exists())
+
+    def test_admin_delete_only_schedules(self):
+        superuser = User.objects.create(email="root@example.com", first_name="Root", last_name="Admin", user_role='Lecturer', is_staff=True, is_superuser=True)
+        self.client.force_login(superuser)
+        url = reverse('admin:apis_course_delete', args=[self.course.pk])
+        self.assertContains(self.client.get(url), "CSC101 - Intro to Computing")
+        self.client.post(url, {'post': 'yes'})
+        self.assertTrue(Course.all_objects.filter(pk=self.course.pk, pending_delete=True).exists())
+        self.assertEqual(AttendanceRecord.objects.filter(session=self.session).count(), 2)
+        self.assertTrue(PendingDeletion.objects.filter(model='course', object_id=self.course.pk, requested_by=superuser).exists())
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        caches['idempotency'].clear()
+        self.calls = 0
+
+        @idempotency.idempotent
+        def view(request):
+            self.calls += 1
+            return JsonResponse({'call': self.calls}, status=201)
+        self.view = view
+
+    def request(self, body, key='scan-1'):
+        return RequestFactory().post('/api/attendance/mark/', body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.view(self.request('{"fingerprint_id": 2}'))
+        retry = self.view(self.request('{"fingerprint_id": 2}'))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((retry.status_code, retry.content), (201, first.content))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        self.view(self.request('{"fingerprint_id": 2}', key='scan-2'))
+        self.assertEqual(self.calls, 2)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.view(self.request('{"fingerprint_id": 2}'))
+        self.assertEqual(self.view(self.request('{"fingerprint_id": 3}')).status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_retry_while_the_first_is_running_is_not_run(self):
+        request = self.request('{"fingerprint_id": 2}')
+        caches['idempotency'].add(idempotency._cache_key('', request.path, 'scan-1') + ':lock', True)
+        response = self.view(request)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.calls, 0)
+
+    def test_socket_frame_and_http_retry_share_a_key(self):
+        def mark(data, sensor_group_id):
+            self.calls += 1
+            return {'status': 'marked'}, 201, None
+
+        sent = []
+
+        async def send(message):
+            sent.append(json.loads(message['text']))
+
+        connection = device_socket.DeviceConnection({'type': 'websocket', 'headers': [(b'x-device-id', b'scanner-1')]}, send)
+        connection.sensor_group_id = 1
+        frame = {'op': 'mark', 'fingerprint_id': 2, 'course_code': 'CSC101', 'idempotency_key': 'scan-1'}
+        with mock.patch.dict(device_socket.OPERATIONS, {'mark': (mark, 'mark')}):
+            asyncio.run(connection.handle({'id': 1, **frame}, binary=False))
+            asyncio.run(connection.handle({'id': 2, **frame}, binary=False))
+            asyncio.run(connection.handle({'id': 3, **frame, 'fingerprint_id': 3}, binary=False))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([(reply['id'], reply['code']) for reply in sent], [(1, 201), (2, 201), (3, 422)])
+
+        # The device gave up waiting and retries over HTTP with the same key
+        def retry(device):
+            return self.view(RequestFactory().post(
+                reverse('api-mark-attendance'), '{"course_code": "CSC101", "fingerprint_id": 2}', content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY='scan-1', HTTP_X_DEVICE_ID=device,
+            ))
+
+        response = retry('scanner-1')
+        self.assertEqual((response.status_code, json.loads(response.content), response['Idempotent-Replayed']), (201, {'status': 'marked'}, 'true'))
+        self.assertEqual(self.calls, 1)
+        # Keys are per scanner
+        self.assertEqual(json.loads(retry('scanner-2').content), {'call': 2})
+
+
+@override_settings(DEVICE_THROTTLE_SCOPES={'mark': {'rate': 1.0, 'burst': 2}}, DEVICE_MAX_CONCURRENCY=1)
+class DeviceThrottleTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.view = throttling.device_throttle('mark')(lambda request: JsonResponse({'status': 'ok'}))
+
+    def scan(self, device='scanner-1'):
+        return self.view(RequestFactory().get('/api/attendance/mark/', HTTP_X_DEVICE_ID=device))
+
+    def test_over_the_limit_gets_429_with_retry_after(self):
+        with mock.patch('apis.throttling.time.time', return_value=1000.0):
+            self.assertEqual([self.scan().status_code for _ in range(2)], [200, 200])
+            response = self.scan()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '3')
+            # Other scanners have their own allowance
+            self.assertEqual(self.scan('scanner-2').status_code, 200)
+        with mock.patch('apis.throttling.time.time', return_value=1003.0):
+            self.assertEqual(self.scan().status_code, 200)
+
+    def test_concurrent_requests_cannot_spend_the_same_token(self):
+        start = threading.Barrier(8)
+        results = []
+        # Each thread has its own cache object, so slow down the class
+        backend = type(caches['default'])
+        cache_get = backend.get
+
+        def slow_get(cache, *args, **kwargs):
+            # Lets the other requests run between any read and write of the counters
+            value = cache_get(cache, *args, **kwargs)
+            time.sleep(0.01)
+            return value
+
+        def scan():
+            start.wait()
+            results.append(throttling.take_token('mark', 'device:racer', 1.0, 2)[0])
+
+        with mock.patch('apis.throttling.time.time', return_value=1000.0), mock.patch.object(backend, 'get', slow_get):
+            threads = [threading.Thread(target=scan) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results.count(True), 2)
+
+    def test_too_many_requests_at_once_get_503(self):
+        caches['default'].set(throttling.IN_FLIGHT_KEY, 1)
+        response = self.scan()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(caches['default'].get(throttling.IN_FLIGHT_KEY), 1)
+
+
+class MessagePackCodecTests(TestCase):
+    # Every type, at both sides of each size boundary of its encodings
+    VALUES = [
+        None, True, False,
+        0, 127, 128, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**64 - 1,
+        -1, -32, -33, -128, -129, -32768, -32769, -2**31, -2**31 - 1, -2**63,
+        1.5, -2.25, 1e300,
+        '', 'a' * 31, 'a' * 32, 'a' * 255, 'a' * 256, 'a' * 65535, 'a' * 65536, 'Adéwálé',
+        b'', b'\x00' * 255, b'\x01' * 256, b'\x02' * 65535, b'\x03' * 65536,
+        [], list(range(15)), list(range(16)), list(range(65536)),
+        {}, {str(n): n for n in range(15)}, {str(n): n for n in range(16)},
+        {'f': 2, 'c': 'CSC101', 'tp': b'\xff\x00', 'nested': [None, {'x': [1.5, -1]}]},
+    ]
+
+    def test_round_trip_of_every_type(self):
+        for value in self.VALUES:
+            with self.subTest(value=repr(value)[:40]):
+                self.assertEqual(device_codec.msgpack_decode(device_codec.msgpack_encode(value)), value)
+        self.assertEqual(device_codec.msgpack_decode(device_codec.msgpack_encode((1, 2))), [1, 2])
+
+    def test_encodings_follow_the_spec(self):
+        # Compared with the MessagePack specification, so other implementations read them
+        self.assertEqual(device_codec.msgpack_encode(127), b'\x7f')
+        self.assertEqual(device_codec.msgpack_encode(128), b'\xcc\x80')
+        self.assertEqual(device_codec.msgpack_encode(-33), b'\xd0\xdf')
+        self.assertEqual(device_codec.msgpack_encode('a' * 32)[:2], b'\xd9\x20')
+        self.assertEqual(device_codec.msgpack_encode(b'\x00' * 256)[:3], b'\xc5\x01\x00')
+        self.assertEqual(device_codec.msgpack_encode(list(range(16)))[:3], b'\xdc\x00\x10')
+        self.assertEqual(device_codec.msgpack_encode({'f': 2}), b'\x81\xa1f\x02')
+        self.assertEqual(device_codec.msgpack_decode(b'\xca' + struct.pack('>f', 1.5)), 1.5)
+
+    def test_bad_payloads_are_rejected(self):
+        for data in (b'', b'\xa5abc', b'\x92\x01', b'\x01\x02', b'\xc1', b'\xa2\xff\xfe'):
+            with self.subTest(data=data), self.assertRaises(device_codec.PayloadError):
+                device_codec.msgpack_decode(data)
+        with self.assertRaises(TypeError):
+            device_codec.msgpack_encode(object())
+
+    def test_deep_nesting_is_rejected_not_a_recursion_error(self):
+        depth = device_codec.MAX_NESTING_DEPTH
+        nested = None
+        for _ in range(depth):
+            nested = [nested]
+        self.assertEqual(device_codec.msgpack_decode(b'\x91' * depth + b'\xc0'), nested)
+        for data in (b'\x91' * (depth + 1) + b'\xc0', b'\x91' * 100000 + b'\xc0', b'\x81\xa1f' * 100000 + b'\xc0'):
+            with self.subTest(data=data[:8]), self.assertRaises(device_codec.PayloadError):
+                device_codec.msgpack_decode(data)
+
+        request = RequestFactory().post('/api/attendance/mark/', '[' * 100000, content_type='application/json')
+        with self.assertRaises(device_codec.PayloadError):
+            device_codec.decode_payload(request)
+
+    def test_request_and_response_use_short_field_codes(self):
+        body = device_codec.msgpack_encode({'f': 2, 'c': 'CSC101'})
+        request = RequestFactory().post('/api/attendance/mark/', body, content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(device_codec.decode_payload(request), {'fingerprint_id': 2, 'course_code': 'CSC101'})
+
+        response = device_codec.device_response(request, {'status': 'marked', 'student': 'Tolu Ade (Student - CS)', 'time': '10:00'}, compact={'student': 'Tolu Ade', 'time': None})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(device_codec.msgpack_decode(response.content), {'s': 'marked', 'u': 'Tolu Ade'})
+
+        json_request = RequestFactory().post('/api/attendance/mark/', '{"fingerprint_id": 2}', content_type='application/json')
+        self.assertEqual(device_codec.decode_payload(json_request), {'fingerprint_id': 2})
+        self.assertEqual(json.loads(device_codec.device_response(json_request, {'status': 'ok'}).content), {'status': 'ok'})
+
+
+class DeviceSocketErrorTests(TestCase):
+    def connection(self):
+        self.sent = []
+
+        async def send(message):
+            self.sent.append(json.loads(message['text']))
+
+        connection = device_socket.DeviceConnection({'type': 'websocket', 'headers': [(b'x-device-id', b'scanner-1')]}, send)
+        connection.sensor_group_id = 1
+        return connection
+
+    def test_failing_frame_still_gets_a_reply(self):
+        def broken(data, sensor_group_id):
+            raise KeyError('fingerprint_id')
+
+        connection = self.connection()
+        with mock.patch.dict(device_socket.OPERATIONS, {'mark': (broken, 'mark')}), self.assertLogs('apis.device_socket', 'ERROR'):
+            asyncio.run(connection.handle({'id': 7, 'op': 'mark'}, binary=False))
+        self.assertEqual(self.sent, [{'id': 7, 'code': 500, 'error': 'Server error. Please try again.'}])
+
+    def test_deeply_nested_frames_are_payload_errors(self):
+        connection = self.connection()
+        for message in ({'bytes': b'\x91' * 100000 + b'\xc0'}, {'text': '[' * 100000}):
+            with self.subTest(message=list(message)), self.assertRaises(device_codec.PayloadError):
+                connection.receive_frame(message)
+
+    @override_settings(DEVICE_SOCKET_COMMAND_POLL=0.01)
+    def test_command_push_survives_a_failure(self):
+        command = ({'command': 'enroll', 'slot': 3}, 200, None)
+        connection = self.connection()
+        connection._binary = False
+        connection._idle = True
+
+        async def push_until_sent():
+            pusher = asyncio.create_task(connection.push_commands())
+            while not self.sent:
+                await asyncio.sleep(0.01)
+            pusher.cancel()
+
+        with mock.patch('apis.device_actions.next_device_command', side_effect=[RuntimeError("database went away"), command]), \
+                self.assertLogs('apis.device_socket', 'ERROR'):
+            asyncio.run(asyncio.wait_for(push_until_sent(), timeout=5))
+        self.assertEqual(self.sent, [{'op': 'command', 'command': 'enroll', 'slot': 3}])
+
+
+class SessionStatusTests(HotPathTestData, TestCase):
+    def test_only_sessions_of_lecturers_on_this_sensor_group(self):
+        unmapped = User.objects.create(email="unmapped@example.com", first_name="Ngozi", last_name="Eze", user_role='Lecturer')
+        AttendanceSession.objects.create(course=self.other_course, lecturer=unmapped, semester=self.semester)
+        self.assertEqual(device_actions.session_status(self.group_id)[0], {'status': 'inactive'})
+
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        other_group = SensorGroup.objects.create(name="Annex")
+        self.assertEqual(device_actions.session_status(other_group.pk)[0], {'status': 'inactive'})
+        self.assertEqual(device_actions.session_status(self.group_id)[0], {'status': 'active', 'course_code': 'CSC101', 'lecturer_fingerprint_id': 1})
+
+
+@override_settings(LIVE_POLL_INTERVAL=0.01)
+class LiveAttendanceBoardTests(TestCase):
+    def setUp(self):
+        at = timezone.now()
+        self.rows = [(1, 'Tolu', 'Ade', 'CSC/001', at), (2, 'Bola', 'Ige', 'CSC/002', at)]
+        self.loads = []
+
+    async def load(self, session_id, after_id):
+        # Both students are marked by the first poll, and the session has ended by the second
+        self.loads.append(after_id)
+        return [row for row in self.rows if row[0] > after_id], len(self.loads) % 2 == 1
+
+    def watch(self, watchers=1, last_event_id=None):
+        async def collect():
+            return [chunk async for chunk in live.event_stream(live.SessionFeed, 42, last_event_id) if chunk.startswith('id:')]
+
+        async def main():
+            return await asyncio.wait_for(asyncio.gather(*(collect() for _ in range(watchers))), timeout=5)
+
+        with mock.patch('apis.live._load_session_records', self.load):
+            return asyncio.run(main())
+
+    def test_watchers_share_one_feed(self):
+        first, second = self.watch(watchers=2)
+        self.assertEqual(first, second)
+        self.assertEqual([chunk.split('\n')[:2] for chunk in first], [
+            ['id: 1', 'event: attendance'], ['id: 2', 'event: attendance'], ['id: 2', 'event: ended'],
+        ])
+        self.assertIn('"count": 2', first[1])
+        # One poll per interval for the feed, not one per watcher
+        self.assertEqual(self.loads, [0, 2])
+
+    def test_reconnect_skips_what_the_browser_already_has(self):
+        (events,) = self.watch(last_event_id=1)
+        self.assertEqual([chunk.split('\n')[:2] for chunk in events], [['id: 2', 'event: attendance'], ['id: 2', 'event: ended']])
+
+
+class TaskStatusPollingTests(HotPathTestData, TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.task = EnrollmentTask.objects.create(sensor_group_id=self.group_id, slot_id=10)
+        self.admin = User.objects.create(email="root@example.com", first_name="Root", last_name="Admin", user_role='Lecturer', is_staff=True)
+        self.client.force_login(self.admin)
+        self.url = reverse('get-task-status', args=[self.task.pk])
+
+    def test_unchanged_state_gets_a_bodyless_304(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.json(), {'status': 'PENDING', 'message': ''})
+        # Only the login session and user; the state comes from the cache
+        with self.assertNumQueries(2):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((again.status_code, again.content, again['ETag']), (304, b'', first['ETag']))
+
+        self.task.status, self.task.result_message = EnrollmentTask.Status.SUCCESS, 'Enrolled'
+        self.task.save()
+        live.set_task_state(self.task)
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.json(), {'status': 'SUCCESS', 'message': 'Enrolled'})
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_unknown_task_is_404(self):
+        self.assertEqual(self.client.get(reverse('get-task-status', args=[self.task.pk + 1])).status_code, 404)
+
+
+@override_settings(TEMPLATE_VAULT_DIR=tempfile.mkdtemp(prefix='template-vault-test-'))
+class TemplateVaultAuthTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        hall = SensorGroup.objects.create(name="Hall B")
+        cls.device = Device.objects.create(device_id='AA:BB:CC:DD:EE:01', sensor_group=hall, vault_key='k' * 64)
+        FingerprintMapping.objects.filter(user=cls.student).update(sensor_group=hall)
+        cls.upload_url = reverse('upload-fingerprint-template')
+        cls.download_url = reverse('download-fingerprint-templates')
+
+    def setUp(self):
+        # Start each test with a full rate limit
+        caches['default'].clear()
+
+    def upload(self, device=None, **signing):
+        body = json.dumps({'slot': 2, 'template': base64.b64encode(b'template').decode()})
+        headers = _signed(device or self.device, 'POST', self.upload_url, body.encode(), **signing)
+        return self.client.post(self.upload_url, data=body, content_type='application/json', **headers)
+
+    def download(self, device=None, **signing):
+        return self.client.get(self.download_url, **_signed(device or self.device, 'GET', self.download_url, **signing))
+
+    def test_signed_requests_reach_the_vault(self):
+        self.assertEqual(self.upload().status_code, 201)
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Template-Count'], '1')
+        self.assertEqual(b''.join(response.streaming_content), struct.pack('>HH', 2, 8) + b'template')
+
+    def test_unsigned_requests_are_refused(self):
+        self.assertEqual(self.client.get(self.download_url).status_code, 403)
+        self.assertEqual(self.client.get(self.download_url, HTTP_X_DEVICE_ID=self.device.device_id).status_code, 403)
+        response = self.client.post(self.upload_url, **_post_json({'slot': 2, 'template': base64.b64encode(b'template').decode()}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_bad_or_stale_signatures_are_refused(self):
+        self.assertEqual(self.download(timestamp=int(time.time()) - 3600).status_code, 403)
+        headers = _signed(self.device, 'GET', self.download_url)
+        headers['HTTP_X_DEVICE_SIGNATURE'] = '0' * 64
+        self.assertEqual(self.client.get(self.download_url, **headers).status_code, 403)
+        # Signed for another body
+        body = json.dumps({'slot': 2, 'template': base64.b64encode(b'other').decode()})
+        headers = _signed(self.device, 'POST', self.upload_url, b'{}')
+        self.assertEqual(self.client.post(self.upload_url, data=body, content_type='application/json', **headers).status_code, 403)
+
+    def test_unapproved_scanners_are_refused(self):
+        unknown = Device(device_id='AA:BB:CC:DD:EE:02', vault_key='k' * 64)
+        self.assertEqual(self.download(unknown).status_code, 403)
+        self.assertFalse(Device.objects.filter(device_id=unknown.device_id).exists())
+
+        default = Device.objects.create(device_id='AA:BB:CC:DD:EE:03', sensor_group_id=self.group_id, vault_key='k' * 64)
+        self.assertEqual(self.download(default).status_code, 403)
+
+        Device.objects.filter(pk=self.device.pk).update(vault_key='')
+        self.assertEqual(self.download().status_code, 403)
+        self.assertEqual(self.upload().status_code, 403)
+
+
+@override_settings(TEMPLATE_VAULT_DIR=tempfile.mkdtemp(prefix='template-vault-test-'))
+class TemplateVaultIndexTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.hall = SensorGroup.objects.create(name="Hall B")
+        cls.device = Device.objects.create(device_id='AA:BB:CC:DD:EE:01', sensor_group=cls.hall, vault_key='k' * 64)
+        FingerprintMapping.objects.filter(user__in=[cls.lecturer, cls.student]).update(sensor_group=cls.hall)
+
+    def setUp(self):
+        caches['default'].clear()
+        template_vault.store_template(self.hall.pk, 1, b'one')
+        template_vault.store_template(self.hall.pk, 2, b'two')
+
+    def slots(self):
+        return [slot for slot, *_ in template_vault.template_index(self.hall.pk)]
+
+    def test_damaged_and_truncated_copies_are_left_out_of_the_count(self):
+        FingerprintTemplate.objects.filter(sensor_group=self.hall, fingerprint_id=1).update(checksum=0)
+        with self.assertLogs('apis.template_vault', 'ERROR'):
+            self.assertEqual(self.slots(), [2])
+
+        url = reverse('download-fingerprint-templates')
+        with self.assertLogs('apis.template_vault', 'ERROR'):
+            response = self.client.get(url, **_signed(self.device, 'GET', url))
+        self.assertEqual(response['X-Template-Count'], '1')
+        self.assertEqual(b''.join(response.streaming_content), struct.pack('>HH', 2, 3) + b'two')
+
+        FingerprintTemplate.objects.filter(sensor_group=self.hall, fingerprint_id=2).update(offset=10 ** 6)
+        with self.assertLogs('apis.template_vault', 'ERROR'):
+            self.assertEqual(self.slots(), [])
+
+    def test_missing_blob_file_is_logged_not_raised(self):
+        os.remove(os.path.join(settings.TEMPLATE_VAULT_DIR, f"group-{self.hall.pk}.bin"))
+        with self.assertLogs('apis.template_vault', 'ERROR'):
+            self.assertEqual(self.slots(), [])
+
+    @override_settings(TEMPLATE_MAX_BYTES=100000)
+    def test_slot_and_length_must_fit_the_record_header(self):
+        with self.assertRaises(template_vault.TemplateError):
+            template_vault.store_template(self.hall.pk, 65536, b'one')
+        with self.assertRaises(template_vault.TemplateError):
+            template_vault.store_template(self.hall.pk, 3, b'x' * 65536)
+
+
+class DevicePayloadValidationTests(HotPathTestData, TestCase):
+    def test_slots_that_are_not_whole_numbers_get_400(self):
+        template = base64.b64encode(b'template').decode()
+        for slot in ('abc', '2.5', 2.5, -2, True, [2]):
+            with self.subTest(slot=slot):
+                _, status, _ = device_actions.upload_template({'slot': slot, 'template': template}, self.group_id)
+                self.assertEqual(status, 400)
+                _, status, _ = device_actions.mark_attendance({'fingerprint_id': slot, 'course_code': 'CSC101'}, self.group_id)
+                self.assertEqual(status, 400)
+                _, status, _ = device_actions.end_session({'fingerprint_id': slot}, self.group_id)
+                self.assertEqual(status, 400)
+
+    def test_slots_sent_as_text_are_accepted(self):
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        _, status, _ = device_actions.mark_attendance({'fingerprint_id': '2', 'course_code': 'CSC101'}, self.group_id)
+        self.assertEqual(status, 201)
+
+
+@override_settings(ATTENDANCE_ARCHIVE_DIR=tempfile.mkdtemp(prefix='attendance-archive-test-'))
+class SemesterArchiveTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.closed = Semester.objects.create(name=Semester.SEMESTER_CHOICES[1][0], session="2024/2025")
+        cls.classmate = User.objects.create(email="classmate@example.com", first_name="Uche", last_name="Eze", user_role='Student', department=cls.department)
+        start = timezone.now() - timedelta(days=200)
+        for n, course in enumerate([cls.course, cls.course, cls.other_course]):
+            session = AttendanceSession.objects.create(
+                course=course, lecturer=cls.lecturer, semester=cls.closed, is_active=False, end_time=start + timedelta(days=n, hours=1),
+            )
+            # start_time is auto_now_add
+            AttendanceSession.objects.filter(pk=session.pk).update(start_time=start + timedelta(days=n))
+            AttendanceRecord.objects.create(session=session, student=cls.student, marks_awarded=n + 1)
+            if n != 1:
+                AttendanceRecord.objects.create(session=session, student=cls.classmate)
+
+    def setUp(self):
+        # The records were inserted in this transaction; Postgres won't drop
+        # their partition while their deferred foreign key checks are pending
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def live_sessions(self, course):
+        return [
+            (s.pk, s.lecturer_id, s.start_time, s.end_time, sorted((r.pk, r.student_id, r.timestamp, r.marks_awarded) for r in s.attendees.all()))
+            for s in AttendanceSession.objects.filter(semester=self.closed, course=course).order_by('-start_time', '-pk')
+        ]
+
+    def live_counts(self, course):
+        counts = AttendanceRecord.objects.filter(semester=self.closed, session__course=course).values('student_id').annotate(n=Count('pk'))
+        return {row['student_id']: row['n'] for row in counts}
+
+    def test_archived_reports_match_the_live_tables(self):
+        expected = {course.pk: (self.live_sessions(course), self.live_counts(course)) for course in (self.course, self.other_course)}
+
+        saved = archive.archive_semester(self.closed)
+        self.assertEqual((saved.session_count, saved.record_count, saved.purged), (3, 5, True))
+        self.assertFalse(AttendanceSession.objects.filter(semester=self.closed).exists())
+        self.assertFalse(AttendanceRecord.objects.filter(semester=self.closed).exists())
+        self.assertTrue(archive.is_archived(self.closed))
+
+        for course in (self.course, self.other_course):
+            sessions, counts = expected[course.pk]
+            read_back = [
+                (s.pk, s.lecturer_id, s.start_time, s.end_time, sorted((r.pk, r.student_id, r.timestamp, r.marks_awarded) for r in s.attendee_list))
+                for s in archive.course_sessions(self.closed, course)
+            ]
+            self.assertEqual(read_back, sessions)
+            self.assertEqual(archive.attendance_counts(self.closed, course), counts)
+            self.assertEqual(archive.session_count(self.closed, course), len(sessions))
+        self.assertEqual(archive.read_table(self.closed.pk, self.course.pk, 'records', ['marks_awarded']), {'marks_awarded': [1, 1, 2]})
+
+    def test_damaged_archive_is_not_purged(self):
+        session_count, record_count = archive.write_archive(self.closed)
+        with open(archive.archive_path(self.closed.pk), 'r+b') as f:
+            f.seek(len(archive.MAGIC) + 2)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        with self.assertRaises(archive.ArchiveError):
+            archive.verify_archive(self.closed.pk, session_count, record_count)
+
+    def test_keep_rows_then_a_later_run_purges(self):
+        call_command('archive_semester', self.closed.pk, '--keep-rows', stdout=StringIO())
+        self.assertFalse(archive.is_archived(self.closed))
+        self.assertEqual(AttendanceRecord.objects.filter(semester=self.closed).count(), 5)
+
+        AttendanceRecord.objects.create(session=AttendanceSession.objects.filter(semester=self.closed).first(), student=self.lecturer)
+        call_command('archive_semester', self.closed.pk, stdout=StringIO())
+        saved = SemesterArchive.objects.get(semester=self.closed)
+        # Written again, so the record added in between is in the file
+        self.assertEqual((saved.record_count, saved.purged), (6, True))
+        self.assertFalse(AttendanceRecord.objects.filter(semester=self.closed).exists())
+
+        with self.assertRaisesMessage(CommandError, "already archived"):
+            call_command('archive_semester', self.closed.pk, stdout=StringIO())
+
+    def test_current_semester_is_not_archived(self):
+        with self.assertRaisesMessage(archive.ArchiveError, "current semester"):
+            archive.archive_semester(self.semester)
+
+
+@override_settings(ATTENDANCE_ARCHIVE_DIR=tempfile.mkdtemp(prefix='attendance-archive-test-'), ATTENDANCE_THRESHOLD=75.0)
+class SemesterReportTests(HotPathTestData, TestCase):
+    """
+    A small semester worked out by hand:
+    CSC101 held 4 sessions. The student came to 3 (0, 6 and 12 minutes late), the classmate to 1 (40 late).
+    CSC102 held 2 sessions, only the classmate is enrolled and came to both (2 and 70 late).
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.faculty = Faculty.objects.create(name="Science")
+        Department.objects.filter(pk=cls.department.pk).update(faculty=cls.faculty)
+        other_department = Department.objects.create(name="Law", faculty=Faculty.objects.create(name="Law"))
+        cls.closed = Semester.objects.create(name=Semester.SEMESTER_CHOICES[1][0], session="2024/2025")
+        cls.classmate = User.objects.create(email="classmate@example.com", first_name="Uche", last_name="Eze", user_role='Student', department=other_department)
+        for student, course in [(cls.student, cls.course), (cls.classmate, cls.course), (cls.classmate, cls.other_course)]:
+            CourseEnrollment.objects.create(student=student, course=course, semester=cls.closed)
+
+        start = timezone.now() - timedelta(days=100)
+        attendance = {
+            cls.course: [{cls.student: 0, cls.classmate: 40}, {cls.student: 6}, {cls.student: 12}, {}],
+            cls.other_course: [{cls.classmate: 2}, {cls.classmate: 70}],
+        }
+        for course, sessions in attendance.items():
+            for n, minutes_late in enumerate(sessions):
+                started = start + timedelta(days=n)
+                session = AttendanceSession.objects.create(course=course, lecturer=cls.lecturer, semester=cls.closed, is_active=False, end_time=started)
+                AttendanceSession.objects.filter(pk=session.pk).update(start_time=started)
+                for student, minutes in minutes_late.items():
+                    record = AttendanceRecord.objects.create(session=session, student=student)
+                    AttendanceRecord.objects.filter(pk=record.pk).update(timestamp=started + timedelta(minutes=minutes))
+        # Not enrolled on CSC101, so not counted
+        outsider = User.objects.create(email="outsider@example.com", first_name="Femi", last_name="Lawal", user_role='Student')
+        AttendanceRecord.objects.create(session=AttendanceSession.objects.filter(course=cls.course, semester=cls.closed).first(), student=outsider)
+
+    def setUp(self):
+        # See SemesterArchiveTests.setUp
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def summary(self, report):
+        return {
+            'totals': (report['student_count'], report['at_risk_count'], report['record_count'], report['rate']),
+            'at_risk': [
+                (row['student'].pk, row['attended'], row['held'], row['rate'], [(c['course'].pk, c['attended'], c['held'], c['rate']) for c in row['courses']])
+                for row in report['at_risk']
+            ],
+            'courses': [
+                (row['course'].pk, row['enrolled'], row['held'], row['rate'], row['median_late'], row['p90_late'])
+                for row in report['courses']
+            ],
+            'lateness': report['lateness'],
+        }
+
+    def test_rates_lateness_and_at_risk_students(self):
+        report = self.summary(semester_report(self.closed))
+        self.assertEqual(report['totals'], (2, 1, 6, 60.0))
+        self.assertEqual(report['at_risk'], [(self.classmate.pk, 3, 6, 50.0, [(self.course.pk, 1, 4, 25.0)])])
+        self.assertEqual(report['courses'], [
+            (self.course.pk, 2, 4, 50.0, 6.0, 12.0),
+            (self.other_course.pk, 1, 2, 100.0, 2.0, 2.0),
+        ])
+        self.assertEqual(report['lateness'], [
+            ('0-5 min', 2), ('5-10 min', 1), ('10-15 min', 1), ('15-30 min', 0), ('30-60 min', 1), ('60+ min', 1),
+        ])
+
+    def test_threshold_is_a_strict_lower_bound(self):
+        # The student's 75% in CSC101 is not below 75, but is below 80
+        at_risk = semester_report(self.closed, threshold=80.0)['at_risk']
+        self.assertEqual([row['student'] for row in at_risk], [self.classmate, self.student])
+
+    def test_faculty_filter(self):
+        report = self.summary(semester_report(self.closed, self.faculty))
+        self.assertEqual(report['totals'], (1, 0, 3, 75.0))
+        self.assertEqual(report['courses'], [(self.course.pk, 1, 4, 75.0, 6.0, 6.0)])
+
+    def test_archived_semester_gives_the_same_report(self):
+        live = self.summary(semester_report(self.closed))
+        archive.archive_semester(self.closed)
+        self.assertEqual(self.summary(semester_report(self.closed)), live)
+
+    def test_courses_and_students_waiting_to_be_deleted_are_left_out(self):
+        schedule_deletion(self.other_course)
+        report = self.summary(semester_report(self.closed))
+        self.assertEqual(report['totals'], (2, 1, 4, 50.0))
+        self.assertEqual(report['at_risk'], [(self.classmate.pk, 1, 4, 25.0, [(self.course.pk, 1, 4, 25.0)])])
+        self.assertEqual(report['courses'], [(self.course.pk, 2, 4, 50.0, 6.0, 12.0)])
+
+        schedule_deletion(self.classmate)
+        report = self.summary(semester_report(self.closed))
+        self.assertEqual(report['totals'], (1, 0, 3, 75.0))
+
+        client = Client()
+        client.force_login(User.objects.create(email="admin@example.com", first_name="Bola", last_name="Ojo", user_role='Lecturer', is_staff=True))
+        for data in ({'semester': self.closed.pk}, {'semester': self.closed.pk, 'format': 'csv'}):
+            self.assertEqual(client.get(reverse('faculty_attendance_report'), data).status_code, 200)
+
+    def test_empty_semester(self):
+        report = semester_report(Semester.objects.create(name=Semester.SEMESTER_CHOICES[0][0], session="2023/2024"))
+        self.assertEqual((report['student_count'], report['record_count'], report['rate'], report['at_risk'], report['courses']), (0, 0, None, [], []))
+
+
+class AttendanceRollupTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.faculty = Faculty.objects.create(name="Science")
+        Department.objects.filter(pk=cls.department.pk).update(faculty=cls.faculty)
+        cls.maths = Department.objects.create(name="Mathematics", faculty=cls.faculty)
+        cls.classmate = User.objects.create(email="classmate@example.com", first_name="Uche", last_name="Eze", user_role='Student', department=cls.maths)
+        CourseEnrollment.objects.create(student=cls.classmate, course=cls.course, semester=cls.semester)
+        cls.monday = timezone.make_aware(datetime(2025, 9, 1, 9))
+
+    def ended_session(self, days, attendees, ended=None):
+        started = self.monday + timedelta(days=days)
+        session = AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester, is_active=False, end_time=ended or started + timedelta(hours=1))
+        AttendanceSession.objects.filter(pk=session.pk).update(start_time=started)
+        for student in attendees:
+            AttendanceRecord.objects.create(session=session, student=student)
+        return session
+
+    def totals(self):
+        return set(AttendanceRollup.objects.values_list('department_id', 'faculty_id', 'week', 'sessions_held', 'expected', 'attended'))
+
+    def test_weekly_totals_per_department(self):
+        self.ended_session(0, [self.student, self.classmate])
+        self.ended_session(2, [self.student])
+        self.ended_session(7, [])
+        self.assertEqual(update_rollups(), 3)
+        week1, week2 = self.monday.date(), self.monday.date() + timedelta(weeks=1)
+        self.assertEqual(self.totals(), {
+            (self.department.pk, self.faculty.pk, week1, 2, 2, 2),
+            (self.maths.pk, self.faculty.pk, week1, 2, 2, 1),
+            (self.department.pk, self.faculty.pk, week2, 1, 1, 0),
+            (self.maths.pk, self.faculty.pk, week2, 1, 1, 0),
+        })
+        trend = weekly_trend(AttendanceRollup.objects.filter(semester=self.semester))
+        self.assertEqual([(row['week'], row['expected'], row['attended'], row['rate']) for row in trend], [(week1, 4, 3, 75.0), (week2, 2, 0, 0.0)])
+        by_department = breakdown(AttendanceRollup.objects.all(), 'department__name')
+        self.assertEqual([(row['department__name'], row['rate']) for row in by_department], [("Computer Science", 200 / 3), ("Mathematics", 100 / 3)])
+
+    def test_each_run_only_adds_sessions_not_rolled_up_yet(self):
+        self.ended_session(0, [self.student])
+        self.assertEqual(update_rollups(), 1)
+        self.assertEqual(update_rollups(), 0)
+
+        # Still running, so not rolled up yet
+        active = AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+        AttendanceRecord.objects.create(session=active, student=self.classmate)
+        self.assertEqual(update_rollups(), 0)
+
+        AttendanceSession.objects.filter(pk=active.pk).update(is_active=False, end_time=timezone.now(), start_time=self.monday + timedelta(days=1))
+        self.assertEqual(update_rollups(), 1)
+        self.assertTrue(AttendanceSession.objects.get(pk=active.pk).rolled_up)
+        self.assertEqual(
+            AttendanceRollup.objects.filter(department=self.maths).values_list('sessions_held', 'expected', 'attended').get(),
+            (2, 2, 1),
+        )
+
+    def test_sessions_ending_together_are_each_added_once(self):
+        ended = self.monday + timedelta(hours=2)
+        for _ in range(3):
+            self.ended_session(0, [self.student], ended=ended)
+        self.ended_session(1, [self.classmate])
+        self.assertEqual(update_rollups(batch_size=1), 4)
+        self.assertEqual(
+            AttendanceRollup.objects.filter(department=self.department).values_list('sessions_held', 'attended').get(),
+            (4, 3),
+        )
+
+    def test_session_that_commits_late_is_still_added(self):
+        self.ended_session(1, [self.student])
+        self.assertEqual(update_rollups(), 1)
+        # Ended before the one already rolled up, but its transaction committed after the run
+        self.ended_session(0, [self.classmate], ended=self.monday + timedelta(minutes=30))
+        self.assertEqual(update_rollups(), 1)
+        self.assertEqual(update_rollups(), 0)
+        self.assertEqual(
+            AttendanceRollup.objects.filter(department=self.maths).values_list('sessions_held', 'expected', 'attended').get(),
+            (2, 2, 1),
+        )
+
+    def test_rebuild_matches_incremental_runs(self):
+        self.ended_session(0, [self.student, self.classmate])
+        update_rollups(batch_size=1)
+        self.ended_session(3, [self.classmate])
+        self.ended_session(8, [self.student])
+        update_rollups(batch_size=1)
+        incremental = self.totals()
+
+        # A mistake made by hand is thrown away
+        AttendanceRollup.objects.filter(department=self.department).update(attended=99)
+        self.assertEqual(rebuild_rollups(), 3)
+        self.assertEqual(self.totals(), incremental)
+
+    def test_rebuild_keeps_the_rollups_of_purged_semesters(self):
+        closed = Semester.objects.create(name=Semester.SEMESTER_CHOICES[1][0], session="2024/2025")
+        SemesterArchive.objects.create(semester=closed, file_name='x', session_count=1, record_count=1, purged=True)
+        AttendanceRollup.objects.create(semester=closed, department=self.department, course=self.course, week=self.monday.date(), sessions_held=1, expected=1, attended=1)
+        AttendanceRollup.objects.create(semester=self.semester, department=self.department, course=self.course, week=self.monday.date(), sessions_held=5, expected=5, attended=5)
+
+        self.assertEqual(rebuild_rollups(), 0)
+        self.assertEqual(list(AttendanceRollup.objects.values_list('semester', flat=True)), [closed.pk])
+
+
+@override_settings(REPLICA_STICKY_SECONDS=10)
+class ReplicaRouterTests(HotPathTestData, TestCase):
+    """
+    No replica runs here, so these check which alias the router picks,
+    with a 'replica' entry added to DATABASES just for the check.
+    """
+    @staticmethod
+    @routers.reporting_read
+    def report_view(request):
+        return routers.ReplicaRouter().db_for_read(User)
+
+    def request(self, user=None, session=None):
+        request = RequestFactory().get('/')
+        request.user = user or self.student
+        request.session = {} if session is None else session
+        return request
+
+    def test_reporting_views_read_from_the_replica(self):
+        router = routers.ReplicaRouter()
+        with mock.patch.dict(settings.DATABASES, {routers.REPLICA_DB_ALIAS: {}}):
+            self.assertEqual(self.report_view(self.request()), 'replica')
+            # Everything else, and every write, stays on the primary
+            self.assertEqual(router.db_for_read(User), 'default')
+            self.assertEqual(router.db_for_write(User), 'default')
+        self.assertEqual(self.report_view(self.request()), 'default')
+
+    def test_a_write_pins_the_user_to_the_primary(self):
+        def writes(request):
+            User.objects.filter(pk=self.student.pk).update(first_name="Tolu")
+            return JsonResponse({})
+
+        request = self.request()
+        routers.ReplicaStickinessMiddleware(writes)(request)
+        pinned_until = request.session[routers.STICKY_SESSION_KEY]
+        self.assertAlmostEqual(pinned_until, time.time() + 10, delta=1)
+
+        with mock.patch.dict(settings.DATABASES, {routers.REPLICA_DB_ALIAS: {}}):
+            self.assertEqual(self.report_view(request), 'default')
+            with mock.patch('apis.routers.time.time', return_value=pinned_until + 1):
+                self.assertEqual(self.report_view(request), 'replica')
+
+    def test_reads_and_anonymous_writes_do_not_pin(self):
+        reads = routers.ReplicaStickinessMiddleware(lambda request: JsonResponse({'n': User.objects.count()}))
+        request = self.request()
+        reads(request)
+        self.assertEqual(request.session, {})
+
+        # Scanners have no login
+        def scan(request):
+            AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+            return JsonResponse({})
+
+        request = self.request(AnonymousUser())
+        routers.ReplicaStickinessMiddleware(scan)(request)
+        self.assertEqual(request.session, {})
+
+    def test_async_requests_are_pinned_too(self):
+        async def writes(request):
+            # What a save asks the router, without a second thread holding the test database
+            routers.ReplicaRouter().db_for_write(User)
+            return JsonResponse({})
+
+        async def auser():
+            return self.student
+
+        request = self.request()
+        request.auser = auser
+        asyncio.run(routers.ReplicaStickinessMiddleware(writes)(request))
+        self.assertIn(routers.STICKY_SESSION_KEY, request.session)
+
+
+@override_settings(TRAFFIC_CAPTURE=True, TRAFFIC_CAPTURE_SAMPLE=1.0, TRAFFIC_CAPTURE_KEY='capture-key')
+class TrafficCaptureTests(HotPathTestData, TestCase):
+    def capture(self, request):
+        """
+        The line the capture middleware would write for the request.
+        """
+        entries = []
+        with mock.patch('apis.traffic._write', entries.append):
+            traffic.TrafficCaptureMiddleware(lambda request: JsonResponse({}))(request)
+        self.assertEqual(len(entries), 1)
+        return entries[0], json.dumps(entries[0])
+
+    def test_query_values_are_pseudonymized_except_known_safe_ones(self):
+        url = reverse('user-search')
+        entry, line = self.capture(RequestFactory().get(url, {'q': 'CSC/001', 'role': 'Student', 'next': '/students/tolu.ade@example.com/'}))
+        for raw in ('CSC/001', 'CSC%2F001', 'tolu.ade', 'example.com'):
+            self.assertNotIn(raw, line)
+        self.assertEqual(entry['query'], f"q={traffic.pseudonym('CSC/001')}&role=Student&next={traffic.pseudonym('/students/tolu.ade@example.com/')}")
+
+        entry, _ = self.capture(RequestFactory().get(url, {'format': 'csv', 'semester': '3', 'page': '2'}))
+        self.assertEqual(entry['query'], 'format=csv&semester=3&page=2')
+
+    def test_personal_url_arguments_are_pseudonymized(self):
+        entry, line = self.capture(RequestFactory().get(reverse('check-email', args=[self.student.email])))
+        self.assertNotIn(self.student.email, line)
+        self.assertEqual(entry['path'], reverse('check-email', args=[traffic.pseudonym(self.student.email)]))
+
+    def test_device_requests_keep_no_identifiers(self):
+        request = RequestFactory().post(
+            reverse('api-mark-attendance'), data=json.dumps({'fingerprint_id': 2, 'course_code': 'CSC101', 'name': 'Tolu Ade'}),
+            content_type='application/json', HTTP_X_DEVICE_ID='AA:BB:CC:DD:EE:01', HTTP_IDEMPOTENCY_KEY='scan-12345',
+        )
+        entry, line = self.capture(request)
+        for raw in ('AA:BB:CC:DD:EE:01', 'scan-12345', 'Tolu'):
+            self.assertNotIn(raw, line)
+        self.assertEqual(entry['body'], {'fingerprint_id': traffic.remap_slot(2), 'course_code': 'CSC101'})
+        self.assertEqual((entry['role'], entry['device']), ('device', traffic.pseudonym('AA:BB:CC:DD:EE:01')))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Row estimates come from the Postgres catalog")
+class TableRowCountTests(HotPathTestData, TestCase):
+    def test_small_tables_are_counted_and_big_ones_estimated_in_one_query(self):
+        AttendanceRecord.objects.create(session=AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester), student=self.student)
+        with self.assertNumQueries(1):
+            self.assertEqual(table_row_count(AttendanceRecord), 1)
+        # Never analyzed, so the estimate is 0 however many rows there are
+        with self.assertNumQueries(1):
+            self.assertEqual(table_row_count(AttendanceRecord, estimate_above=-1), 0)
+
+
+# View query budgets: the exact number of queries each URL may run. The data
+# is grown between checks, so a count that creeps up with the number of
+# students, sessions or courses (an N+1) fails the test.
+BUDGET_SIZES = (1, 4, 12)
+
+
+def _post_json(data):
+    return {'data': json.dumps(data), 'content_type': 'application/json'}
+
+
+def _signed(device, method, path, body=b'', timestamp=None):
+    """
+    Headers for a template vault request signed with the device's key.
+    """
+    timestamp = str(int(time.time())) if timestamp is None else str(timestamp)
+    return {
+        'HTTP_X_DEVICE_ID': device.device_id,
+        'HTTP_X_DEVICE_TIMESTAMP': timestamp,
+        'HTTP_X_DEVICE_SIGNATURE': vault_signature(device.vault_key, method, path, timestamp, body),
+    }
+
+
+@override_settings(TEMPLATE_VAULT_DIR=tempfile.mkdtemp(prefix='template-vault-test-'))
+class ViewQueryBudgetTests(HotPathTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.faculty = Faculty.objects.create(name="Science")
+        Department.objects.filter(pk=cls.department.pk).update(faculty=cls.faculty)
+        User.objects.filter(pk__in=[cls.lecturer.pk, cls.student.pk]).update(faculty=cls.faculty)
+        cls.course.departments.add(cls.department)
+        cls.course.available_semesters.add(cls.semester)
+        cls.admin = User.objects.create(email="admin@example.com", first_name="Bola", last_name="Ojo", user_role='Lecturer', is_staff=True)
+        cls.ended_session = AttendanceSession.objects.create(
+            course=cls.course, lecturer=cls.lecturer, semester=cls.semester, is_active=False, end_time=timezone.now(),
+        )
+        cls.task = EnrollmentTask.objects.create(sensor_group_id=cls.group_id, slot_id=900)
+        # The template vault only serves approved scanners outside the default group
+        cls.device = Device.objects.create(device_id='AA:BB:CC:DD:EE:01', sensor_group=SensorGroup.objects.create(name="Hall B"), vault_key='k' * 64)
+        hall_b_student = User.objects.create(email="hallb@example.com", first_name="Kemi", last_name="Ola", user_role='Student', faculty=cls.faculty)
+        FingerprintMapping.objects.create(user=hall_b_student, sensor_group=cls.device.sensor_group, fingerprint_id=2)
+        cls.size = 0
+
+    def grow_to(self, size):
+        """
+        Adds students, sessions, records, courses, campaigns and rollups until there are `size` of each.
+        """
+        for n in range(self.size, size):
+            student = User.objects.create(
+                email=f"student{n}@example.com", first_name="Student", last_name=f"No{n}", matric_number=f"CSC1{n:02d}",
+                level='100', user_role='Student', faculty=self.faculty, department=self.department,
+            )
+            FingerprintMapping.objects.create(user=student, sensor_group_id=self.group_id, fingerprint_id=100 + n)
+            CourseEnrollment.objects.create(student=student, course=self.course, semester=self.semester)
+
+            course = Course.objects.create(course_name=f"Elective {n}", course_code=f"CSC2{n:02d}", minimum_level='100')
+            course.lecturers.add(self.lecturer)
+            course.departments.add(self.department)
+            course.available_semesters.add(self.semester)
+            CourseEnrollment.objects.create(student=self.student, course=course, semester=self.semester)
+
+            session = AttendanceSession.objects.create(
+                course=course, lecturer=self.lecturer, semester=self.semester, is_active=False, end_time=timezone.now(),
+            )
+            AttendanceRecord.objects.create(session=session, student=self.student)
+            AttendanceRecord.objects.create(session=self.ended_session, student=student)
+
+            department = Department.objects.create(name=f"Department {n}", faculty=self.faculty)
+            campaign = EnrollmentCampaign.objects.create(department=department, created_by=self.admin)
+            EnrollmentTask.objects.create(
+                sensor_group_id=self.group_id, slot_id=500 + n, user=student, campaign=campaign,
+                status=EnrollmentTask.Status.FAILED, result_message="Timed out",
+            )
+            AttendanceRollup.objects.create(
+                semester=self.semester, faculty=self.faculty, department=department, course=course,
+                week=date(2025, 9, 1) + timedelta(weeks=n), sessions_held=1, expected=1, attended=1,
+            )
+        self.size = size
+        self.campaign = EnrollmentCampaign.objects.latest('pk')
+
+    def active_session(self):
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+
+    def cases(self):
+        """
+        (label, user, method, url, request arguments, setup run first, query budget)
+        """
+        lecturer, student, admin = self.lecturer, self.student, self.admin
+        upload = _post_json({'slot': 2, 'template': base64.b64encode(b'template').decode()})
+        upload.update(_signed(self.device, 'POST', reverse('upload-fingerprint-template'), upload['data'].encode()))
+        return [
+            ('home', None, 'get', reverse('home'), {}, None, 0),
+            ('login', None, 'get', reverse('login'), {}, None, 0),
+            ('dashboard (student)', student, 'get', reverse('dashboard'), {}, None, 7),
+            ('dashboard (lecturer)', lecturer, 'get', reverse('dashboard'), {}, None, 5),
+            ('dashboard (admin)', admin, 'get', reverse('dashboard'), {}, None, 3),
+            ('password change', student, 'get', reverse('password_change'), {}, None, 2),
+            ('password change done', student, 'get', reverse('password_change_done'), {}, None, 2),
+            ('enroll student fingerprint', admin, 'get', reverse('enroll-student-fingerprint'), {}, None, 2),
+            ('enroll lecturer fingerprint', admin, 'get', reverse('enroll-lecturer-fingerprint'), {}, None, 2),
+            ('enrollment campaign', admin, 'get', reverse('enrollment_campaign'), {}, None, 4),
+            ('campaign progress', admin, 'get', reverse('enrollment_campaign_progress', args=[self.campaign.pk]), {}, None, 5),
+            ('campaign progress json', admin, 'get', reverse('enrollment_campaign_progress', args=[self.campaign.pk]), {'data': {'format': 'json'}}, None, 4),
+            ('at-risk report', admin, 'get', reverse('faculty_attendance_report'), {}, None, 11),
+            ('at-risk report csv', admin, 'get', reverse('faculty_attendance_report'), {'data': {'format': 'csv'}}, None, 9),
+            ('trends', admin, 'get', reverse('attendance_trends'), {}, None, 4),
+            ('faculty trends', admin, 'get', reverse('faculty_attendance_trends', args=[self.faculty.pk]), {}, None, 7),
+            ('department trends', admin, 'get', reverse('department_attendance_trends', args=[self.department.pk]), {}, None, 7),
+            ('enroll in course', student, 'get', reverse('enroll-course'), {}, None, 5),
+            ('lecturer courses', lecturer, 'get', reverse('lecturer_course_list'), {}, None, 3),
+            ('course detail', lecturer, 'get', reverse('course_attendance_detail', args=[self.course.pk]), {}, None, 11),
+            ('course csv', lecturer, 'get', reverse('download_attendance_summary', args=[self.course.pk]), {}, None, 9),
+            ('live session', lecturer, 'get', reverse('live_session', args=[self.ended_session.pk]), {}, None, 3),
+            ('next free slot', admin, 'get', reverse('get-next-slot'), {}, None, 4),
+            ('check matric', admin, 'get', reverse('check-matric', args=['CSC100']), {}, None, 1),
+            ('check email', admin, 'get', reverse('check-email', args=[lecturer.email]), {}, None, 1),
+            ('user search', admin, 'get', reverse('user-search'), {'data': {'q': 'student', 'role': 'Student'}}, None, 3),
+            ('task status', admin, 'get', reverse('get-task-status', args=[self.task.pk]), {}, None, 3),
+            ('queue enrollment task', admin, 'post', reverse('queue-enrollment-task'), _post_json({'slot': 901, 'sensor_group': self.group_id}), None, 11),
+            ('throttle stats', admin, 'get', reverse('device-throttle-stats'), {}, None, 2),
+            ('pool stats', admin, 'get', reverse('db-pool-stats'), {}, None, 2),
+            # Scanner endpoints: no login, default sensor group
+            ('session status', None, 'get', reverse('api-session-status'), {}, self.active_session, 2),
+            ('start session', None, 'post', reverse('api-start-session'), _post_json({'fingerprint_id': 1, 'course_code': 'CSC101'}), None, 7),
+            ('mark attendance', None, 'post', reverse('api-mark-attendance'), _post_json({'fingerprint_id': 2, 'course_code': 'CSC101'}), self.active_session, 9),
+            ('end session', None, 'post', reverse('api-end-session'), _post_json({'fingerprint_id': 1}), self.active_session, 5),
+            ('device command', None, 'get', reverse('get-device-command'), {}, None, 5),
+            ('report enrollment result', None, 'post', reverse('report-enrollment-result'), _post_json({'task_id': self.task.pk, 'status': 'error', 'message': 'Timed out'}), None, 5),
+            ('upload template', None, 'post', reverse('upload-fingerprint-template'), upload, None, 8),
+            ('download templates', None, 'get', reverse('download-fingerprint-templates'), _signed(self.device, 'GET', reverse('download-fingerprint-templates')), None, 2),
+            # Streams: only the checks before the stream starts are counted
+            ('live session events', lecturer, 'get', reverse('live_session_events', args=[self.ended_session.pk]), {}, None, 3),
+            ('task events', admin, 'get', reverse('task-status-stream', args=[self.task.pk]), {}, None, 2),
+        ]
+
+    def assertRequestQueries(self, budget, user, method, url, kwargs, setup):
+        """
+        Makes the request inside a rolled-back transaction, so every size starts from the same state.
+        """
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        with transaction.atomic():
+            if setup:
+                setup()
+            caches['default'].clear()
+            caches['idempotency'].clear()
+            with self.assertNumQueries(budget):
+                response = getattr(client, method)(url, **kwargs)
+                if response.streaming and not response.is_async:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 500, url)
+
+    def test_every_url_has_a_budget(self):
+        self.grow_to(1)
+        covered = {resolve(url).url_name for _, _, _, url, _, _, _ in self.cases()}
+        named = {pattern.name for pattern in urls.urlpatterns if getattr(pattern, 'name', None)}
+        self.assertEqual(named - covered, set(), "Add a query budget for these URLs")
+
+    def test_query_counts_stay_within_budget_as_data_grows(self):
+        for size in BUDGET_SIZES:
+            self.grow_to(size)
+            for label, user, method, url, kwargs, setup, budget in self.cases():
+                with self.subTest(label, size=size):
+                    self.assertRequestQueries(budget, user, method, url, kwargs, setup)
+
+    def admin_cases(self):
+        """
+        (label, url, request arguments, query budget) for the admin pages of the big tables
+        """
+        def changelist(model):
+            return reverse(f'admin:apis_{model}_changelist')
+        autocomplete = {'app_label': 'apis', 'model_name': 'attendancerecord', 'field_name': 'student', 'term': 'Student'}
+        return [
+            ('attendance records', changelist('attendancerecord'), {}, 5),
+            ('attendance records by semester', changelist('attendancerecord'), {'data': {'semester__id__exact': self.semester.pk}}, 5),
+            ('attendance record', reverse('admin:apis_attendancerecord_change', args=[AttendanceRecord.objects.latest('pk').pk]), {}, 14),
+            ('attendance sessions', changelist('attendancesession'), {}, 5),
+            ('attendance session with attendees', reverse('admin:apis_attendancesession_change', args=[self.ended_session.pk]), {}, 12),
+            ('course enrollments', changelist('courseenrollment'), {}, 5),
+            ('fingerprint mappings', changelist('fingerprintmapping'), {}, 5),
+            ('enrollment tasks', changelist('enrollmenttask'), {}, 5),
+            ('attendance rollups', changelist('attendancerollup'), {}, 6),
+            ('users', changelist('user'), {}, 7),
+            ('student autocomplete', reverse('admin:autocomplete'), {'data': autocomplete}, 4),
+        ]
+
+    def test_admin_query_counts_stay_within_budget_as_data_grows(self):
+        superuser = User.objects.create(email="root@example.com", first_name="Root", last_name="Admin", user_role='Lecturer', is_staff=True, is_superuser=True)
+        for size in BUDGET_SIZES:
+            self.grow_to(size)
+            for label, url, kwargs, budget in self.admin_cases():
+                with self.subTest(label, size=size):
+                    # The admin caches content types; start each page without them
+                    self.assertRequestQueries(budget, superuser, 'get', url, kwargs, ContentType.objects.clear_cache)
+
+
+# Timing benchmarks, checked against the medians stored in perf_baselines.json
+# for the database in use. They are slow and depend on the machine, so they
+# only run with PERF_BENCHMARKS=1 (on the CI runner the baselines came from).
+# PERF_RECORD=1 stores new baselines instead of checking.
+PERF_BASELINES = os.path.join(os.path.dirname(__file__), 'perf_baselines.json')
+PERF_TOLERANCE = float(os.environ.get('PERF_TOLERANCE', 1.0))  # Fail when the median is twice the baseline
+PERF_SLACK_MS = 2.0  # Plus this much, since the fastest endpoints are mostly timer noise
+PERF_RUNS = 25
+PERF_RECORD = bool(os.environ.get('PERF_RECORD'))
+PERF_STUDENTS = 200
+PERF_SESSIONS = 26
+
+
+@skipUnless(os.environ.get('PERF_BENCHMARKS') or PERF_RECORD, "Set PERF_BENCHMARKS=1 to run the timing benchmarks")
+@override_settings(
+    TEMPLATE_VAULT_DIR=tempfile.mkdtemp(prefix='template-vault-test-'),
+    DEVICE_THROTTLE_SCOPES={scope: {'rate': 1e6, 'burst': 1e6} for scope in ('session', 'mark', 'command')},
+)
+class ViewBenchmarks(HotPathTestData, TestCase):
+    """
+    A course with PERF_STUDENTS students and PERF_SESSIONS sessions, about 80% attended.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.faculty = Faculty.objects.create(name="Science")
+        Department.objects.filter(pk=cls.department.pk).update(faculty=cls.faculty)
+        cls.admin = User.objects.create(email="admin@example.com", first_name="Bola", last_name="Ojo", user_role='Lecturer', is_staff=True)
+
+        students = User.objects.bulk_create([
+            User(email=f"student{n}@example.com", first_name="Student", last_name=f"No{n}", matric_number=f"CSC{n:04d}",
+                 level='100', user_role='Student', department=cls.department)
+            for n in range(PERF_STUDENTS)
+        ])
+        CourseEnrollment.objects.bulk_create([CourseEnrollment(student=student, course=cls.course, semester=cls.semester) for student in students])
+        sessions = AttendanceSession.objects.bulk_create([
+            AttendanceSession(course=cls.course, lecturer=cls.lecturer, semester=cls.semester, is_active=False, end_time=timezone.now())
+            for _ in range(PERF_SESSIONS)
+        ])
+        AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(session=session, student=student, semester=cls.semester)
+            for i, session in enumerate(sessions) for n, student in enumerate(students) if (n + i) % 5
+        ])
+        AttendanceRollup.objects.bulk_create([
+            AttendanceRollup(
+                semester=cls.semester, faculty=cls.faculty, department=cls.department, course=cls.course,
+                week=date(2025, 9, 1) + timedelta(weeks=week), sessions_held=2, expected=2 * PERF_STUDENTS, attended=PERF_STUDENTS,
+            )
+            for week in range(PERF_SESSIONS // 2)
+        ])
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(PERF_BASELINES) as f:
+            cls.baselines = json.load(f)
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if PERF_RECORD and cls.results:
+            cls.baselines.setdefault(connection.vendor, {}).update(cls.results)
+            with open(PERF_BASELINES, 'w') as f:
+                json.dump(cls.baselines, f, indent=2, sort_keys=True)
+                f.write('\n')
+        super().tearDownClass()
+
+    def benchmark(self, name, user, method, url, kwargs=None, setup=None):
+        """
+        Median milliseconds of PERF_RUNS requests, each in a rolled-back
+        transaction, compared with (or recorded as) the baseline.
+        """
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        timings = []
+        for run in range(PERF_RUNS + 5):  # The first few warm caches up and aren't counted
+            with transaction.atomic():
+                if setup:
+                    setup()
+                started = time.perf_counter()
+                response = getattr(client, method)(url, **(kwargs or {}))
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = (time.perf_counter() - started) * 1000
+                transaction.set_rollback(True)
+            self.assertLess(response.status_code, 400, url)
+            if run >= 5:
+                timings.append(elapsed)
+
+        median = round(statistics.median(timings), 3)
+        if PERF_RECORD:
+            self.results[name] = median
+            return
+
+        baseline = self.baselines.get(connection.vendor, {}).get(name)
+        if baseline is None:
+            self.skipTest(f"No {connection.vendor} baseline for {name}; record one with PERF_RECORD=1")
+        limit = baseline * (1 + PERF_TOLERANCE) + PERF_SLACK_MS
+        self.assertLessEqual(median, limit, f"{name}: median {median:.2f} ms, baseline {baseline:.2f} ms (limit {limit:.2f} ms)")
+
+    def active_session(self):
+        AttendanceSession.objects.create(course=self.course, lecturer=self.lecturer, semester=self.semester)
+
+    def test_mark_attendance(self):
+        self.benchmark('mark_attendance', None, 'post', reverse('api-mark-attendance'),
+                       _post_json({'fingerprint_id': 2, 'course_code': 'CSC101'}), self.active_session)
+
+    def test_start_session(self):
+        self.benchmark('start_session', None, 'post', reverse('api-start-session'), _post_json({'fingerprint_id': 1, 'course_code': 'CSC101'}))
+
+    def test_session_status(self):
+        self.benchmark('session_status', None, 'get', reverse('api-session-status'), setup=self.active_session)
+
+    def test_device_command(self):
+        self.benchmark('device_command', None, 'get', reverse('get-device-command'))
+
+    def test_course_attendance_detail(self):
+        self.benchmark('course_attendance_detail', self.lecturer, 'get', reverse('course_attendance_detail', args=[self.course.pk]))
+
+    def test_course_attendance_csv(self):
+        self.benchmark('course_attendance_csv', self.lecturer, 'get', reverse('download_attendance_summary', args=[self.course.pk]))
+
+    def test_at_risk_report(self):
+        self.benchmark('at_risk_report', self.admin, 'get', reverse('faculty_attendance_report'))
+
+    def test_faculty_trends(self):
+        self.benchmark('faculty_trends', self.admin, 'get', reverse('faculty_attendance_trends', args=[self.faculty.pk]))
@@ -0,0 +1,133 @@
+import math
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from .device_codec import PayloadError, decode_payload, device_response
+
+DEVICE_HEADER = 'HTTP_X_DEVICE_ID'
+IN_FLIGHT_KEY = 'throttle:inflight'
+IN_FLIGHT_TIMEOUT = 60  # Self-heals the counter if a worker dies mid-request
+STATS_KEY = 'throttle:stats:{scope}:{outcome}'
+STATS_OUTCOMES = ('allowed', 'limited')
+
+
+def get_device_identity(request):
+    """
+    Works out who is calling: the X-Device-ID header sent by the scanner,
+    then the fingerprint ID in the body, then the client IP address.
+    """
+    device_id = request.META.get(DEVICE_HEADER)
+    if device_id:
+        return f"device:{device_id}"
+
+    if request.method == 'POST':
+        try:
+            fingerprint_id = decode_payload(request).get('fingerprint_id')
+            if fingerprint_id:
+                return f"fingerprint:{fingerprint_id}"
+        except PayloadError:
+            pass
+
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def _incr(key, timeout=None):
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:  # The key expired between add() and incr()
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def _decr(key):
+    try:
+        if cache.decr(key) < 0:
+            cache.set(key, 0, timeout=IN_FLIGHT_TIMEOUT)
+    except ValueError:
+        pass
+
+
+def take_token(scope, identity, rate, burst):
+    """
+    Allows a device `burst` requests per burst/rate seconds, i.e. `rate` a
+    second on average, like a token bucket of size `burst`. Counted in a
+    sliding window: this window's count plus the part of the previous
+    window's count that still overlaps. Requests only claim a place with
+    cache.incr(), which is atomic on shared backends, so concurrent requests
+    from one device can't all spend the same token.
+    Returns (allowed, seconds_until_next_token).
+    """
+    window = burst / rate
+    index, elapsed = divmod(time.time(), window)
+    key = f"throttle:window:{scope}:{identity}:{int(index)}"
+    previous = cache.get(f"throttle:window:{scope}:{identity}:{int(index) - 1}", 0)
+    overlap = 1 - elapsed / window
+
+    count = _incr(key, timeout=math.ceil(window * 2) + 1)
+    if previous * overlap + count <= burst:
+        return True, 0
+
+    # Refused requests don't use up anything
+    _decr(key)
+    count -= 1
+    if count < burst and previous:
+        # The previous window's share drops below the limit within this window
+        return False, (previous * overlap + count + 1 - burst) * window / previous
+    # Not before this window ends and this one's own count has started to drop
+    return False, (window - elapsed) + (count + 1 - burst) * window / max(count, 1)
+
+
+def device_throttle(scope):
+    """
+    Rate limits a device endpoint per device, and caps how many device
+    requests may run at once across all workers.
+    Limits come from settings.DEVICE_THROTTLE_SCOPES and DEVICE_MAX_CONCURRENCY.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            limits = settings.DEVICE_THROTTLE_SCOPES[scope]
+            identity = get_device_identity(request)
+
+            allowed, wait = take_token(scope, identity, limits['rate'], limits['burst'])
+            if not allowed:
+                _incr(STATS_KEY.format(scope=scope, outcome='limited'))
+                response = device_response(request, {'error': 'Too many requests from this device. Slow down.'}, status=429)
+                response['Retry-After'] = str(max(1, math.ceil(wait)))
+                return response
+
+            # Global concurrency cap so one room can't take every worker and DB connection
+            in_flight = _incr(IN_FLIGHT_KEY, timeout=IN_FLIGHT_TIMEOUT)
+            try:
+                if in_flight > settings.DEVICE_MAX_CONCURRENCY:
+                    _incr(STATS_KEY.format(scope='concurrency', outcome='limited'))
+                    response = device_response(request, {'error': 'Server is busy. Please retry shortly.'}, status=503)
+                    response['Retry-After'] = '1'
+                    return response
+
+                _incr(STATS_KEY.format(scope=scope, outcome='allowed'))
+                return view_func(request, *args, **kwargs)
+            finally:
+                _decr(IN_FLIGHT_KEY)
+
+        return wrapper
+    return decorator
+
+
+def get_throttle_stats():
+    """
+    Collects the configured limits and the allowed/limited counters for each scope.
+    """
+    scopes = list(settings.DEVICE_THROTTLE_SCOPES) + ['concurrency']
+    keys = [STATS_KEY.format(scope=s, outcome=o) for s in scopes for o in STATS_OUTCOMES]
+    counters = cache.get_many(keys)
+
+    stats = {}
+    for scope in scopes:
+        stats[scope] = {o: counters.get(STATS_KEY.format(scope=scope, outcome=o), 0) for o in STATS_OUTCOMES}
+        stats[scope]['limits'] = settings.DEVICE_THROTTLE_SCOPES.get(scope, {'max': settings.DEVICE_MAX_CONCURRENCY})
+
+    stats['concurrency']['in_flight'] = cache.get(IN_FLIGHT_KEY, 0)
+    return stats
@@ -0,0 +1,225 @@
+"""
+Captures a sample of real requests, anonymized, for the replay_traffic command.
+
+Turned on with TRAFFIC_CAPTURE. Each worker process appends one JSON line per
+request to its own rotating file in TRAFFIC_CAPTURE_DIR. Clients are sampled
+as a whole (a scanner, a logged-in user), so a captured lecturer's
+start_session, the scans that follow and their report afterwards stay together.
+
+Nothing that identifies a person is written: device IDs, users, matric numbers,
+emails, idempotency keys and query string values (search terms, say) other than
+a few known-safe ones become keyed hashes, fingerprint slots are remapped,
+template bytes are replaced by their length, and only device payloads are kept
+(never form posts, so no passwords).
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from urllib.parse import parse_qsl, urlencode
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve, reverse
+from django.utils.decorators import sync_and_async_middleware
+from .device_codec import MSGPACK_CONTENT_TYPES, PayloadError, decode_payload
+
+# Payload fields kept in the log. Anything else a device sends is dropped.
+SLOT_FIELDS = ('fingerprint_id', 'slot')
+KEPT_FIELDS = ('course_code', 'task_id', 'status', 'sensor_group')
+# URL arguments that identify a person
+PERSONAL_KWARGS = ('matric_number', 'email')
+# Query parameters whose values are kept. Every other value becomes a pseudonym.
+KEPT_QUERY_KEYS = ('format', 'semester', 'faculty', 'role', 'limit', 'page', 'p', 'attendees_page')
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def pseudonym(value):
+    """
+    A stable stand-in for an identifier: the same value always gives the same pseudonym.
+    """
+    key = (settings.TRAFFIC_CAPTURE_KEY or settings.SECRET_KEY).encode()
+    return hmac.new(key, str(value).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def remap_slot(slot):
+    """
+    Swaps a fingerprint slot for another one in the same range, consistently.
+    """
+    try:
+        slot = int(slot)
+    except (TypeError, ValueError):
+        return None
+    return int(pseudonym(f"slot:{slot}"), 16) % settings.TRAFFIC_CAPTURE_SLOTS + 1
+
+
+def _sampled(client):
+    return int(pseudonym(f"sample:{client}")[:8], 16) < settings.TRAFFIC_CAPTURE_SAMPLE * 0x100000000
+
+
+def _client(request):
+    # Whoever sends the request: the scanner, the browser session or, failing those, the address
+    return (
+        request.headers.get('X-Device-ID')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('REMOTE_ADDR', '')
+    )
+
+
+def _anonymize_payload(data):
+    if isinstance(data, list):
+        return [_anonymize_payload(item) for item in data if isinstance(item, dict)]
+    payload = {field: remap_slot(data[field]) for field in SLOT_FIELDS if field in data}
+    payload.update({field: data[field] for field in KEPT_FIELDS if field in data})
+
+    template = data.get('template')
+    if isinstance(template, str):
+        try:
+            template = base64.b64decode(template, validate=True)
+        except binascii.Error:
+            template = b''
+    if isinstance(template, bytes):
+        payload['template_length'] = len(template)
+    return payload
+
+
+def _read_payload(request):
+    """
+    (encoding, anonymized payload) for a device POST, or (None, None). Reads
+    the body before the view does, since a form view may consume the stream.
+    """
+    if request.method != 'POST':
+        return None, None
+    encoding = 'msgpack' if request.content_type in MSGPACK_CONTENT_TYPES else 'json' if request.content_type == 'application/json' else None
+    if encoding is None:
+        return None, None
+    try:
+        return encoding, _anonymize_payload(decode_payload(request, many=True))
+    except PayloadError:
+        return encoding, None
+
+
+def _path(request):
+    """
+    (URL name, path) with any personal URL arguments replaced by pseudonyms.
+    """
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None, request.path
+    if not any(name in match.kwargs for name in PERSONAL_KWARGS):
+        return match.view_name, request.path
+    kwargs = {name: pseudonym(value) if name in PERSONAL_KWARGS else value for name, value in match.kwargs.items()}
+    return match.view_name, reverse(match.view_name, kwargs=kwargs)
+
+
+def _query(request):
+    """
+    The query string, with the value of every parameter not in KEPT_QUERY_KEYS replaced by its pseudonym.
+    """
+    return urlencode([
+        (key, value if key in KEPT_QUERY_KEYS else pseudonym(value))
+        for key, value in parse_qsl(request.META.get('QUERY_STRING', ''), keep_blank_values=True)
+    ])
+
+
+def _role(request):
+    if request.headers.get('X-Device-ID'):
+        return 'device'
+    # Only a user the request already loaded, so capturing never adds queries.
+    # Views that need a login always load it.
+    user = getattr(request, '_cached_user', None) or getattr(request, '_acached_user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    return 'admin' if user.is_staff else user.user_role
+
+
+def _write(entry):
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                # One file per process, so workers never rotate each other's files
+                os.makedirs(settings.TRAFFIC_CAPTURE_DIR, exist_ok=True)
+                handler = RotatingFileHandler(
+                    os.path.join(settings.TRAFFIC_CAPTURE_DIR, f"traffic-{os.getpid()}.jsonl"),
+                    maxBytes=settings.TRAFFIC_CAPTURE_MAX_BYTES, backupCount=settings.TRAFFIC_CAPTURE_BACKUPS, encoding='utf-8',
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger = logging.getLogger('apis.traffic.capture')
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                logger.addHandler(handler)
+                _writer = logger
+    _writer.info(json.dumps(entry, separators=(',', ':')))
+
+
+def _start(request):
+    encoding, payload = _read_payload(request)
+    view, path = _path(request)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    return {
+        't': round(time.time(), 3),
+        'method': request.method,
+        'path': path,
+        'query': _query(request),
+        'view': view,
+        'client': pseudonym(_client(request)),
+        'device': pseudonym(request.headers['X-Device-ID']) if request.headers.get('X-Device-ID') else None,
+        'encoding': encoding,
+        'accept_msgpack': any(content_type in request.headers.get('Accept', '') for content_type in MSGPACK_CONTENT_TYPES),
+        'idempotency_key': pseudonym(idempotency_key) if idempotency_key else None,
+        'body': payload,
+    }
+
+
+def _finish(entry, started, response, role):
+    entry.update({
+        'role': role,
+        'status': response.status_code,
+        'ms': round((time.perf_counter() - started) * 1000, 2),
+        # Event streams are open for hours and can't be replayed
+        'stream': response.get('Content-Type', '').startswith('text/event-stream'),
+    })
+    try:
+        _write(entry)
+    except Exception:
+        logging.getLogger(__name__).exception("Could not write captured request")
+
+
+@sync_and_async_middleware
+def TrafficCaptureMiddleware(get_response):
+    """
+    Logs a sample of requests for replay (see the module docstring).
+    Put it near the top of MIDDLEWARE so the timing covers the whole stack.
+    """
+    if not settings.TRAFFIC_CAPTURE:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not _sampled(_client(request)):
+                return await get_response(request)
+            started = time.perf_counter()
+            entry = _start(request)
+            response = await get_response(request)
+            _finish(entry, started, response, _role(request))
+            return response
+    else:
+        def middleware(request):
+            if not _sampled(_client(request)):
+                return get_response(request)
+            started = time.perf_counter()
+            entry = _start(request)
+            response = get_response(request)
+            _finish(entry, started, response, _role(request))
+            return response
+    return middleware
@@ -22,6 +22,12 @@ urlpatterns = [
     path("accounts/", include("django.contrib.auth.urls")),
     path('enroll/student/', views.enroll_student_fingerprint, name='enroll-student-fingerprint'),
     path('enroll/lecturer/', views.enroll_lecturer_fingerprint, name='enroll-lecturer-fingerprint'),
+    path('enroll/campaign/', views.create_enrollment_campaign, name='enrollment_campaign'),
+    path('enroll/campaign/<int:campaign_id>/', views.enrollment_campaign_progress, name='enrollment_campaign_progress'),
+    path('reports/at-risk/', views.faculty_attendance_report, name='faculty_attendance_report'),
+    path('reports/trends/', views.attendance_trends, name='attendance_trends'),
+    path('reports/trends/faculty/<int:faculty_id>/', views.faculty_attendance_trends, name='faculty_attendance_trends'),
+    path('reports/trends/department/<int:department_id>/', views.department_attendance_trends, name='department_attendance_trends'),
 
     # ONLY STUDENTS
     path('course/enroll/', views.enroll_in_course, name='enroll-course'),
@@ -31,16 +37,24 @@ urlpatterns = [
     path('attendance/my-courses/', views.lecturer_course_list, name='lecturer_course_list'),
     path('attendance/course/<int:course_id>/', views.course_attendance_detail, name='course_attendance_detail'),
     path('attendance/course/<int:course_id>/download/', views.download_attendance_summary, name='download_attendance_summary'),
+    path('attendance/session/<int:session_id>/live/', views.live_session, name='live_session'),
+    path('attendance/session/<int:session_id>/events/', views.live_session_events, name='live_session_events'),
 
     # JSON GET
     path('enroll/next_slot/', views.get_next_free_slot, name='get-next-slot'),
     path('check_matric/<str:matric_number>/', views.check_matric_enrolled, name='check-matric'),
     path('check_email/<str:email>/', views.check_lecturer_email_enrolled, name='check-email'),
+    path('api/users/search/', views.search_users, name='user-search'),
     path('session/status/', views.get_session_status, name='api-session-status'),
     path('api/queue-enrollment-task/', views.queue_enrollment_task, name='queue-enrollment-task'),
     path('api/task-status/<int:task_id>/', views.get_enrollment_task_status, name='get-task-status'),
+    path('api/task-status/<int:task_id>/stream/', views.enrollment_task_events, name='task-status-stream'),
     path('api/get-device-command/', views.get_pending_device_command, name='get-device-command'),
     path('api/report-enrollment-result/', views.report_enrollment_result, name='report-enrollment-result'),
+    path('api/templates/upload/', views.upload_fingerprint_template, name='upload-fingerprint-template'),
+    path('api/templates/download/', views.download_fingerprint_templates, name='download-fingerprint-templates'),
+    path('api/device-throttle-stats/', views.device_throttle_stats, name='device-throttle-stats'),
+    path('api/db-pool-stats/', views.db_pool_stats, name='db-pool-stats'),
 
     # JSON POST
     path('session/start/', views.start_session, name='api-start-session'),
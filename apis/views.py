@@ -1,19 +1,33 @@
 import csv
 import json
-from .models import FingerprintMapping, User, CurrentSemester, CourseEnrollment, Course, AttendanceSession, AttendanceRecord, EnrollmentTask
+from .models import FingerprintMapping, SensorGroup, User, Faculty, Department, Semester, CurrentSemester, CourseEnrollment, Course, AttendanceSession, AttendanceRecord, EnrollmentTask, EnrollmentCampaign, AttendanceRollup
 from django.contrib.auth import authenticate, login
-from .forms import StudentEnrollmentForm, LecturerEnrollmentForm, CourseEnrollmentForm
+from .forms import StudentEnrollmentForm, LecturerEnrollmentForm, CourseEnrollmentForm, EnrollmentCampaignForm
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.utils import timezone
-from django.db.models import Count, Q # Import Count and Q for annotations
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.db.models import Count, Q, Prefetch # Import Count and Q for annotations
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.contrib.auth.decorators import user_passes_test
-from django.db import transaction
+from .idempotency import idempotent
+from .throttling import device_throttle, get_throttle_stats
+from .device_codec import PayloadError, decode_payload, device_response
+from . import device_actions
+from .device_socket import wake_device_sockets
+from .sensors import DeviceAuthError, authenticate_vault_device, get_default_group_id, get_request_sensor_group_id
+from .template_vault import stream_templates, template_index
+from .enrollment import allocate_slots, create_campaign, campaign_progress, requeue_failed
+from . import archive, search
+from .analytics import semester_report
+from .rollups import breakdown, weekly_trend
+from .routers import reporting_read
+from .db_pool import pool_stats, release_connections
+from .live import SessionFeed, TaskFeed, event_stream, get_task_state, set_task_state, task_etag
 
 
 def home(request):
@@ -24,27 +38,34 @@ def home(request):
 
 
 def get_next_free_slot_value():
-    used = FingerprintMapping.objects.values_list('fingerprint_id', flat=True)
-    for i in range(1, 1001):
-        if i not in used:
-            return i
-    return None
+    """
+    Returns (sensor group ID, slot) in the group with the most room, or None if every sensor is full.
+    Skips slots held by queued campaign tasks as well as mapped ones.
+    """
+    slots = allocate_slots(1)
+    return slots[0] if slots else None
 
 
 def get_next_free_slot(request):
-    slot = get_next_free_slot_value()
-    if slot:
-        return JsonResponse({"slot": slot})
+    free = get_next_free_slot_value()
+    if free:
+        group_id, slot = free
+        return JsonResponse({"slot": slot, "sensor_group": group_id, "sensor_group_name": SensorGroup.objects.get(pk=group_id).name})
     return JsonResponse({"error": "No available slots"}, status=400)
 
 
-def check_matric_enrolled(request, matric_number):
-    try:
-        user = User.objects.get(matric_number=matric_number)
-        fingerprint_exists = FingerprintMapping.objects.filter(user=user).exists()
-        return JsonResponse({"fingerprint_exists": fingerprint_exists, "user_exists": True})
-    except User.DoesNotExist:
+def fingerprint_check(**lookup):
+    """
+    Whether a user exists and has a fingerprint, in one query.
+    """
+    user = User.objects.filter(**lookup).values('fingerprintmapping__fingerprint_id').first()
+    if user is None:
         return JsonResponse({"fingerprint_exists": False, "user_exists": False})
+    return JsonResponse({"fingerprint_exists": user['fingerprintmapping__fingerprint_id'] is not None, "user_exists": True})
+
+
+def check_matric_enrolled(request, matric_number):
+    return fingerprint_check(matric_number=matric_number)
 
 
 # Returns True if the user is authenticated and a staff member.
@@ -62,86 +83,214 @@ def queue_enrollment_task(request):
     
     data = json.loads(request.body)
     slot_id = data.get('slot')
+    sensor_group_id = data.get('sensor_group') or get_default_group_id()
 
     if not slot_id:
         return JsonResponse({'error': 'Slot ID is required'}, status=400)
 
     # Create a new task, or update an old one to be tried again.
     task, created = EnrollmentTask.objects.update_or_create(
+        sensor_group_id=sensor_group_id,
         slot_id=slot_id,
-        defaults={'status': EnrollmentTask.Status.PENDING, 'result_message': ''}
+        defaults={'status': EnrollmentTask.Status.PENDING, 'result_message': '', 'user': None, 'campaign': None}
     )
-    
+
+    set_task_state(task)
+
+    # Push it straight to any device connected over the WebSocket
+    wake_device_sockets()
+
     return JsonResponse({'status': 'success', 'message': 'Enrollment task has been queued.', 'task_id': task.id})
 
 
+@csrf_exempt
+@device_throttle('command')
+@idempotent
+def upload_fingerprint_template(request):
+    """
+    Called by the ESP32 after a successful enrollment to upload the slot's template.
+    Signed with the scanner's vault key (see apis/sensors.py).
+    """
+    if request.method != 'POST':
+        return device_response(request, {'error': 'Only POST method is allowed'}, status=405)
+
+    try:
+        sensor_group_id = authenticate_vault_device(request)
+    except DeviceAuthError as e:
+        return device_response(request, {'error': str(e)}, status=403)
+
+    try:
+        data = decode_payload(request)
+    except PayloadError as e:
+        return device_response(request, {'error': str(e)}, status=400)
+
+    return device_response(request, *device_actions.upload_template(data, sensor_group_id))
+
+
+@device_throttle('command')
+def download_fingerprint_templates(request):
+    """
+    Called by a new or replaced ESP32 to load every template for its sensor
+    group in one streamed download, instead of re-enrolling everyone.
+    See apis/template_vault.py for the format. Signed with the scanner's
+    vault key (see apis/sensors.py).
+    """
+    if request.method != 'GET':
+        return device_response(request, {'error': 'Only GET method is allowed'}, status=405)
+
+    try:
+        sensor_group_id = authenticate_vault_device(request)
+    except DeviceAuthError as e:
+        return device_response(request, {'error': str(e)}, status=403)
+    index = template_index(sensor_group_id)
+
+    response = StreamingHttpResponse(stream_templates(index, sensor_group_id), content_type='application/octet-stream')
+    response['X-Template-Count'] = str(len(index))
+    return response
+
+
+@user_passes_test(is_admin)
+def create_enrollment_campaign(request):
+    """
+    Queues fingerprint enrollment for a whole department and/or level at once.
+    """
+    if request.method == 'POST':
+        form = EnrollmentCampaignForm(request.POST)
+        if form.is_valid():
+            campaign, left_out = create_campaign(
+                department=form.cleaned_data['department'],
+                level=form.cleaned_data['level'],
+                created_by=request.user,
+            )
+            if not campaign.tasks.exists():
+                messages.warning(request, "Every matching student already has a fingerprint enrolled or queued.")
+            if left_out:
+                messages.error(request, f"The sensor is full. {left_out} student(s) could not be queued.")
+
+            # Push the first task straight to any device connected over the WebSocket
+            wake_device_sockets()
+            return redirect('enrollment_campaign_progress', campaign_id=campaign.pk)
+    else:
+        form = EnrollmentCampaignForm()
+
+    # str(campaign) shows the department and its faculty
+    campaigns = EnrollmentCampaign.objects.select_related('department__faculty').order_by('-created_at')[:10]
+    return render(request, 'enrollment_campaign.html', {'form': form, 'campaigns': campaigns})
+
+
+@user_passes_test(is_admin)
+def enrollment_campaign_progress(request, campaign_id):
+    """
+    Progress page for a campaign. With ?format=json it returns just the
+    counts, which the page's JavaScript polls.
+    """
+    campaign = get_object_or_404(EnrollmentCampaign.objects.select_related('department__faculty'), pk=campaign_id)
+
+    if request.method == 'POST':
+        requeued = requeue_failed(campaign)
+        if requeued:
+            wake_device_sockets()
+        messages.success(request, f"{requeued} failed task(s) queued again.")
+        return redirect('enrollment_campaign_progress', campaign_id=campaign.pk)
+
+    progress = campaign_progress(campaign)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(progress)
+
+    failures = campaign.tasks.filter(
+        status__in=[EnrollmentTask.Status.FAILED, EnrollmentTask.Status.TIMED_OUT]
+    ).select_related('user', 'sensor_group').order_by('-updated_at')[:50]
+
+    return render(request, 'enrollment_campaign_progress.html', {'campaign': campaign, 'progress': progress, 'failures': failures})
+
+
 # VIEW FOR THE BROWSER TO CHECK STATUS
 @user_passes_test(is_admin)
 def get_enrollment_task_status(request, task_id):
     """
-    Called by the browser's JavaScript to poll for the result of a task.
+    Called by the browser's JavaScript to poll for the result of a task,
+    when the event stream below isn't available.
+    The state is served from the cache, and an unchanged one gets a bodyless 304.
     """
-    try:
-        task = EnrollmentTask.objects.get(id=task_id)
-        return JsonResponse({
-            'status': task.status,
-            'message': task.result_message or ''
-        })
-    except EnrollmentTask.DoesNotExist:
+    state = get_task_state(task_id)
+    if state is None:
         return JsonResponse({'error': 'Task not found'}, status=404)
 
+    etag = task_etag(state)
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(state)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def enrollment_task_events(request, task_id):
+    """
+    Server-Sent Events stream of an enrollment task's status changes.
+    The stream ends once the task succeeds, fails or times out.
+    """
+    user = await request.auser()
+    if not is_admin(user):
+        return HttpResponse(status=403)
+
+    # Give the connection back now rather than when the stream ends, which can be hours
+    await sync_to_async(release_connections)()
+
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID'))
+    except (TypeError, ValueError):
+        last_event_id = None
+
+    response = StreamingHttpResponse(event_stream(TaskFeed, task_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 
 @csrf_exempt
+@device_throttle('command')
 def get_pending_device_command(request):
     """
     Called by the ESP32 device to ask for a job.
     This finds the oldest pending enrollment task.
     """
-    with transaction.atomic():
-        # Find the oldest pending task and lock it for update
-        task = EnrollmentTask.objects.select_for_update().filter(status=EnrollmentTask.Status.PENDING).order_by('created_at').first()
-        
-        if task:
-            # If a task is found, mark it as processing so no other device picks it up
-            task.status = EnrollmentTask.Status.PROCESSING
-            task.save()
-            
-            # Send the command to the ESP32
-            return JsonResponse({'command': 'enroll', 'slot': task.slot_id, 'task_id': task.id})
-        else:
-            # No jobs pending
-            return JsonResponse({'command': 'none'})
+    return device_response(request, *device_actions.next_device_command(get_request_sensor_group_id(request)))
 
 @csrf_exempt
+@device_throttle('command')
+@idempotent
 def report_enrollment_result(request):
     """
     Called by the ESP32 device to report the outcome of an enrollment task.
     """
     if request.method != 'POST':
-        return JsonResponse({'error': 'POST required'}, status=405)
+        return device_response(request, {'error': 'POST required'}, status=405)
 
     try:
-        data = json.loads(request.body)
-        task_id = data.get('task_id')
-        result_status = data.get('status') # e.g., "success" or "error"
-        message = data.get('message')
-
-        task = EnrollmentTask.objects.get(id=task_id)
-        
-        if result_status == 'success':
-            task.status = EnrollmentTask.Status.SUCCESS
-        else:
-            task.status = EnrollmentTask.Status.FAILED
-        
-        task.result_message = message
-        task.save()
-        
-        return JsonResponse({'status': 'result_recorded'})
-
-    except EnrollmentTask.DoesNotExist:
-        return JsonResponse({'error': 'Task not found'}, status=404)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        data = decode_payload(request)
+    except PayloadError as e:
+        return device_response(request, {'error': str(e)}, status=400)
+
+    return device_response(request, *device_actions.report_enrollment_result(data, get_request_sensor_group_id(request)))
+
+
+@user_passes_test(is_admin)
+def device_throttle_stats(request):
+    """
+    Shows the device rate limit settings and how often each limit was hit,
+    so the limits can be tuned.
+    """
+    return JsonResponse(get_throttle_stats())
+
+
+@user_passes_test(is_admin)
+def db_pool_stats(request):
+    """
+    Connection pool metrics for the worker process that serves the request.
+    """
+    return JsonResponse(pool_stats())
 
 
 @user_passes_test(is_admin)
@@ -151,13 +300,14 @@ def enroll_student_fingerprint(request):
         if form.is_valid():
             matric_number = form.cleaned_data['matric_number']
             slot = request.POST.get("slot_id")
+            sensor_group_id = request.POST.get("sensor_group") or get_default_group_id()
 
             if not slot:
                 return JsonResponse({"error": "Missing slot ID"}, status=400)
 
             try:
                 # Check for existing fingerprint mapping to prevent errors
-                if FingerprintMapping.objects.filter(fingerprint_id=int(slot)).exists():
+                if FingerprintMapping.objects.filter(sensor_group_id=sensor_group_id, fingerprint_id=int(slot)).exists():
                     return JsonResponse({"error": f"Slot {slot} is already in use."}, status=409) # 409 Conflict
 
                 user = User.objects.get(matric_number=matric_number)
@@ -166,7 +316,7 @@ def enroll_student_fingerprint(request):
                 if FingerprintMapping.objects.filter(user=user).exists():
                     return JsonResponse({"error": f"User {user.get_full_name} already has a fingerprint enrolled."}, status=409)
 
-                FingerprintMapping.objects.create(user=user, fingerprint_id=int(slot))
+                FingerprintMapping.objects.create(user=user, sensor_group_id=sensor_group_id, fingerprint_id=int(slot))
                 return JsonResponse({"status": "success", "message": "Enrollment completed."})
 
             except User.DoesNotExist:
@@ -184,12 +334,23 @@ def enroll_student_fingerprint(request):
 
 
 def check_lecturer_email_enrolled(request, email):
+    return fingerprint_check(email=email)
+
+
+@user_passes_test(is_admin)
+def search_users(request):
+    """
+    Autocomplete for the enrollment screens: users matching ?q= (matric number,
+    email or name), optionally only one ?role=, with their fingerprint status.
+    """
+    role = request.GET.get('role')
+    if role and role not in dict(User.USER_ROLES):
+        return JsonResponse({"error": "Unknown role"}, status=400)
     try:
-        user = User.objects.get(email=email)
-        fingerprint_exists = FingerprintMapping.objects.filter(user=user).exists()
-        return JsonResponse({"fingerprint_exists": fingerprint_exists, "user_exists": True})
-    except User.DoesNotExist:
-        return JsonResponse({"fingerprint_exists": False, "user_exists": False})
+        limit = int(request.GET.get('limit', search.DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({"error": "limit must be a number"}, status=400)
+    return JsonResponse({"results": search.search_users(request.GET.get('q', ''), role=role, limit=limit)})
 
 
 @user_passes_test(is_admin)
@@ -200,13 +361,14 @@ def enroll_lecturer_fingerprint(request):
         if form.is_valid():
             email = form.cleaned_data['email']
             slot = request.POST.get("slot_id")
+            sensor_group_id = request.POST.get("sensor_group") or get_default_group_id()
 
             if not slot:
                 return JsonResponse({"error": "Missing slot ID"}, status=400)
 
             try:
                 # Check for existing fingerprint mapping to prevent errors
-                if FingerprintMapping.objects.filter(fingerprint_id=int(slot)).exists():
+                if FingerprintMapping.objects.filter(sensor_group_id=sensor_group_id, fingerprint_id=int(slot)).exists():
                     return JsonResponse({"error": f"Slot {slot} is already in use."}, status=409)
 
                 # Find the user by email, and also ensure they are a lecturer
@@ -216,7 +378,7 @@ def enroll_lecturer_fingerprint(request):
                 if FingerprintMapping.objects.filter(user=user).exists():
                     return JsonResponse({"error": f"User {user.get_full_name} already has a fingerprint enrolled."}, status=409)
 
-                FingerprintMapping.objects.create(user=user, fingerprint_id=int(slot))
+                FingerprintMapping.objects.create(user=user, sensor_group_id=sensor_group_id, fingerprint_id=int(slot))
                 return JsonResponse({"status": "success", "message": "Enrollment completed."})
 
             except User.DoesNotExist:
@@ -261,6 +423,7 @@ def user_login(request):
 
 
 @login_required
+@reporting_read
 def dashboard(request):
     user = request.user
     context = {
@@ -281,9 +444,10 @@ def dashboard(request):
             semester=current_semester
         ).select_related('course').order_by('course__course_code')
 
-        # Get the student's 5 most recent attendance records
+        # Get the student's 5 most recent attendance records this semester
+        # (semester keeps the query to the current partition)
         recent_attendance = AttendanceRecord.objects.filter(
-            student=user
+            student=user, semester=current_semester
         ).select_related('session__course').order_by('-timestamp')[:5]
 
         context.update({
@@ -300,9 +464,9 @@ def dashboard(request):
 
         # Get the lecturer's 5 most recent sessions, with attendee counts
         recent_sessions = AttendanceSession.objects.filter(
-            lecturer=user
+            lecturer=user, semester=current_semester
         ).select_related('course').annotate(
-            attendee_count=Count('attendees')
+            attendee_count=Count('attendees', filter=Q(attendees__semester=current_semester))
         ).order_by('-start_time')[:5]
 
         context.update({
@@ -328,225 +492,115 @@ def enroll_in_course(request):
         messages.error(request, "Current semester is not set. Please contact admin.")
         return redirect('dashboard')
 
+    # Get already enrolled courses to display on the page, and to check for duplicates
+    enrolled_courses = list(CourseEnrollment.objects.filter(
+        student=request.user, 
+        semester=current_semester
+    ).select_related('course'))
+    form_kwargs = {
+        'user': request.user,
+        'semester': current_semester,
+        'enrolled_course_ids': {enrollment.course_id for enrollment in enrolled_courses},
+    }
+
     if request.method == "POST":
         # Pass the user to the form
-        form = CourseEnrollmentForm(request.POST, user=request.user)
+        form = CourseEnrollmentForm(request.POST, **form_kwargs)
         if form.is_valid():
-            # All validation is done, we can now create the object
-            enrollment = form.save(commit=False)
-            enrollment.student = request.user
-            enrollment.semester = current_semester
-            enrollment.save()
+            # All validation is done; every selected course is enrolled in one go
+            try:
+                course_codes = form.save()
+            except IntegrityError:
+                # A course was deleted after the page was loaded
+                messages.error(request, "The course list changed while you were choosing. Please try again.")
+                return redirect('enroll-course')
 
-            messages.success(request, f"Successfully enrolled in {enrollment.course.course_code}!")
+            messages.success(request, f"Successfully enrolled in {', '.join(course_codes)}!")
             return redirect('enroll-course')
         else:
-            # Form errors will be displayed automatically by the template
-            # We can add a generic error message if we want
-            messages.error(request, "Please correct the errors below.")
+            # Each course's problem is listed with the field
+            messages.error(request, "Please correct the errors below. None of the selected courses were enrolled.")
     else:
         # Pass the user to the form for the initial GET request as well
-        form = CourseEnrollmentForm(user=request.user)
-
-    # Get already enrolled courses to display on the page
-    enrolled_courses = CourseEnrollment.objects.filter(
-        student=request.user, 
-        semester=current_semester
-    ).select_related('course')
+        form = CourseEnrollmentForm(**form_kwargs)
 
     return render(request, 'enroll_course.html', {
         'form': form,
-        'enrolled_courses': enrolled_courses
+        'enrolled_courses': enrolled_courses,
+        'current_semester': current_semester,
     })
 
 
 @csrf_exempt # Disable CSRF for API requests from the scanner
+@device_throttle('session') # Keep one misbehaving scanner from starving the others
+@idempotent # Replay the original response when the scanner retries
 def start_session(request):
     """
     API Endpoint to start an attendance session.
     Expected POST data: {"fingerprint_id": 123, "course_code": "CSC101"}
     """
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+        return device_response(request, {'error': 'Only POST method is allowed'}, status=405)
 
     try:
-        data = json.loads(request.body)
-        fingerprint_id = data.get('fingerprint_id')
-        course_code = data.get('course_code')
-
-        if not fingerprint_id or not course_code:
-            return JsonResponse({'error': 'fingerprint_id and course_code are required.'}, status=400)
-
-        # 1. Identify the user and verify they are a lecturer
-        lecturer = User.objects.get(fingerprintmapping__fingerprint_id=fingerprint_id, user_role='Lecturer')
-
-        # 2. Check if the lecturer is already running a session
-        if AttendanceSession.objects.filter(lecturer=lecturer, is_active=True).exists():
-            return JsonResponse({'error': 'You already have an active session. Please end it first.'}, status=409)
-
-        # 3. Validate that the course exists and is assigned to this lecturer
-        course = lecturer.assigned_courses.get(course_code__iexact=course_code)
-
-        # 4. Get the current semester
-        current = CurrentSemester.objects.select_related('semester').first()
-        if not current or not current.semester:
-            return JsonResponse({'error': 'System error: Current semester is not set.'}, status=500)
-
-        # 5. Create and save the new attendance session
-        session = AttendanceSession.objects.create(
-            course=course,
-            lecturer=lecturer,
-            semester=current.semester,
-            is_active=True
-        )
+        data = decode_payload(request)
+    except PayloadError as e:
+        return device_response(request, {'error': str(e)}, status=400)
 
-        return JsonResponse({
-            'message': 'Attendance session started successfully!',
-            'session_id': session.session_id,
-            'course': course.course_name,
-            'lecturer': str(lecturer)
-        }, status=201)
-
-    except User.DoesNotExist:
-        return JsonResponse({'error': 'Invalid fingerprint or user is not a lecturer.'}, status=403)
-    except Course.DoesNotExist:
-        return JsonResponse({'error': 'Invalid course code or you are not assigned to this course.'}, status=403)
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON format.'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+    return device_response(request, *device_actions.start_session(data, get_request_sensor_group_id(request)))
 
 
+@device_throttle('command')
 def get_session_status(request):
     """
     Checks if there is an active attendance session.
     """
     if request.method == 'GET':
-        # Find the most recent active session. Your logic may vary.
-        active_session = AttendanceSession.objects.filter(is_active=True).first()
-
-        if active_session:
-            # If a session is active, return its details
-            return JsonResponse({
-                "status": "active",
-                "course_code": active_session.course.course_code,
-                "lecturer_fingerprint_id": active_session.lecturer.fingerprintmapping.fingerprint_id
-            }, status=200)
-        else:
-            # If no session is active
-            return JsonResponse({
-                "status": "inactive"
-            }, status=200)
+        return device_response(request, *device_actions.session_status(get_request_sensor_group_id(request)))
 
-    return JsonResponse({"error": "Invalid request method"}, status=405)
+    return device_response(request, {"error": "Invalid request method"}, status=405)
 
 
 @csrf_exempt
+@device_throttle('mark')
+@idempotent
 def mark_attendance(request):
     """
     API Endpoint for a student to mark attendance.
     Expected POST data: {"fingerprint_id": 456, "course_code": "CSC101"}
     """
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+        return device_response(request, {'error': 'Only POST method is allowed'}, status=405)
 
     try:
-        data = json.loads(request.body)
-        fingerprint_id = data.get('fingerprint_id')
-        course_code = data.get('course_code')
-
-        if not fingerprint_id or not course_code:
-            return JsonResponse({'error': 'fingerprint_id and course_code are required.'}, status=400)
-
-        # 1. Find the currently active session for the given course
-        active_session = AttendanceSession.objects.get(course__course_code__iexact=course_code, is_active=True)
-        
-        # 2. Identify the student
-        student = User.objects.get(fingerprintmapping__fingerprint_id=fingerprint_id, user_role='Student')
-        
-        # 3. Verify the student is enrolled in this course for the current semester
-        is_enrolled = CourseEnrollment.objects.filter(
-            student=student, 
-            course=active_session.course,
-            semester=active_session.semester
-        ).exists()
-
-        if not is_enrolled:
-            return JsonResponse({'error': f'Access Denied: You are not enrolled in {active_session.course.course_code}.'}, status=403)
-
-        # 4. Create the attendance record. get_or_create prevents duplicates.
-        record, created = AttendanceRecord.objects.get_or_create(
-            session=active_session,
-            student=student
-        )
-
-        if created:
-            return JsonResponse({
-                'message': 'Attendance marked successfully!',
-                'student': str(student),
-                'course': active_session.course.course_code,
-                'time': record.timestamp.strftime('%H:%M:%S')
-            }, status=201)
-        else:
-            return JsonResponse({'message': 'You have already marked your attendance for this session.'}, status=200)
+        data = decode_payload(request)
+    except PayloadError as e:
+        return device_response(request, {'error': str(e)}, status=400)
 
-    except AttendanceSession.DoesNotExist:
-        return JsonResponse({'error': 'No active attendance session found for this course or session has ended.'}, status=404)
-    except User.DoesNotExist:
-        return JsonResponse({'error': 'Invalid fingerprint or user is not a student.'}, status=403)
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON format.'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+    return device_response(request, *device_actions.mark_attendance(data, get_request_sensor_group_id(request)))
 
 
 @csrf_exempt
+@device_throttle('session')
+@idempotent
 def end_session(request):
     """
     API Endpoint to end an attendance session.
     Expected POST data: {"fingerprint_id": 123}
     """
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+        return device_response(request, {'error': 'Only POST method is allowed'}, status=405)
 
     try:
-        data = json.loads(request.body)
-        fingerprint_id = data.get('fingerprint_id')
-
-        if not fingerprint_id:
-            return JsonResponse({'error': 'fingerprint_id is required.'}, status=400)
-
-        # 1. Identify the lecturer
-        lecturer = User.objects.get(fingerprintmapping__fingerprint_id=fingerprint_id, user_role='Lecturer')
-
-        # 2. Find the session they started that is currently active
-        session_to_end = AttendanceSession.objects.get(lecturer=lecturer, is_active=True)
+        data = decode_payload(request)
+    except PayloadError as e:
+        return device_response(request, {'error': str(e)}, status=400)
 
-        # 3. Close the session
-        session_to_end.is_active = False
-        session_to_end.end_time = timezone.now()
-        session_to_end.save()
-
-        # 4. Get total attendance count for feedback
-        attendance_count = AttendanceRecord.objects.filter(session=session_to_end).count()
-
-        return JsonResponse({
-            'message': 'Session ended successfully.',
-            'course': session_to_end.course.course_code,
-            'total_students_marked': attendance_count
-        }, status=200)
-
-    except User.DoesNotExist:
-        return JsonResponse({'error': 'Invalid fingerprint or user is not a lecturer.'}, status=403)
-    except AttendanceSession.DoesNotExist:
-        return JsonResponse({'error': 'You do not have an active session to end.'}, status=404)
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON format.'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+    return device_response(request, *device_actions.end_session(data, get_request_sensor_group_id(request)))
 
 
 @login_required
+@reporting_read
 def lecturer_course_list(request):
     """
     Displays a list of all courses assigned to the logged-in lecturer.
@@ -565,7 +619,41 @@ def lecturer_course_list(request):
     return render(request, 'attendance/lecturer_course_list.html', context)
 
 
+def get_report_semester(request):
+    """
+    The semester a report is for: ?semester=<id>, or the current semester.
+    """
+    semester_id = request.GET.get('semester')
+    if semester_id and semester_id.isdigit():
+        return get_object_or_404(Semester, pk=semester_id)
+    current = CurrentSemester.objects.select_related('semester').first()
+    if not current:
+        raise Http404("Current semester is not set.")
+    return current.semester
+
+
+def course_attendance_counts(course, semester):
+    """
+    Yields (student, sessions attended) for everyone enrolled in the course that semester.
+    Records are counted on their own, filtered by semester, so only that semester's partition is read.
+    Archived semesters are counted from the archive file.
+    """
+    if archive.is_archived(semester):
+        counts = archive.attendance_counts(semester, course)
+    else:
+        counts = dict(
+            AttendanceRecord.objects.filter(semester=semester, session__course=course)
+            .values('student').annotate(attended=Count('pk')).values_list('student', 'attended')
+        )
+    students = User.objects.filter(
+        courseenrollment__course=course, courseenrollment__semester=semester
+    ).distinct().order_by('last_name', 'first_name')
+    for student in students:
+        yield student, counts.get(student.pk, 0)
+
+
 @login_required
+@reporting_read
 def course_attendance_detail(request, course_id):
     """
     Displays all attendance sessions and records for a specific course.
@@ -580,44 +668,46 @@ def course_attendance_detail(request, course_id):
     # doesn't exist OR if the current user is not in the 'lecturers' list for that course.
     course = get_object_or_404(Course, pk=course_id, lecturers=request.user)
 
+    # One semester at a time (the current one unless ?semester= is given),
+    # so the queries only read that semester's attendance partition
+    semester = get_report_semester(request)
+    semesters = Semester.objects.filter(
+        Q(attendancesession__course=course) | Q(archive__isnull=False)
+    ).distinct().order_by('-pk')
+
     # GET DETAILED SESSION LOG
 
-    # Get all attendance sessions for this course, newest first.
-    # prefetch_related get all related attendance records
-    # and student details in a minimal number of database queries. This avoids the N+1 problem.
-    sessions = AttendanceSession.objects.filter(course=course).order_by('-start_time').prefetch_related('attendees__student')
+    if archive.is_archived(semester):
+        # Closed semester moved out of the database: read its sessions from the archive file
+        sessions = archive.course_sessions(semester, course)
+    else:
+        # Get all attendance sessions for this course, newest first.
+        # prefetch_related get all related attendance records
+        # and student details in a minimal number of database queries. This avoids the N+1 problem.
+        sessions = list(AttendanceSession.objects.filter(course=course, semester=semester).order_by('-start_time').prefetch_related(
+            Prefetch('attendees', queryset=AttendanceRecord.objects.filter(semester=semester).select_related('student'), to_attr='attendee_list')
+        ))
 
     # CALCULATE ATTENDANCE SUMMARY
 
     # Get the total number of sessions held for this course.
-    total_sessions_count = sessions.count()
+    total_sessions_count = len(sessions)
 
     attendance_summary = []
     if total_sessions_count > 0:
-        # Get all students enrolled in the course.
-        # We use distinct() because a student might be enrolled via multiple departments sharing a course.
-        enrolled_students = User.objects.filter(courseenrollment__course=course).distinct()
-
-        # Annotate each student with the count of their attendance records for this specific course.
-        # The filter inside Count() is crucial to ensure we only count attendance for this course.
-        students_with_attendance = enrolled_students.annotate(
-            attended_count=Count(
-                'attendancerecord',
-                filter=Q(attendancerecord__session__course=course)
-            )
-        )
-
         # Build the summary data list for the template
-        for student in students_with_attendance:
-            percentage = (student.attended_count / total_sessions_count) * 100
+        for student, attended_count in course_attendance_counts(course, semester):
+            percentage = (attended_count / total_sessions_count) * 100
             attendance_summary.append({
                 'student': student,
-                'attended_count': student.attended_count,
+                'attended_count': attended_count,
                 'percentage': percentage,
             })
 
     context = {
         'course': course,
+        'semester': semester,
+        'semesters': semesters,
         'sessions': sessions,
         'total_sessions_count': total_sessions_count,
         'attendance_summary': attendance_summary,
@@ -626,6 +716,48 @@ def course_attendance_detail(request, course_id):
 
 
 @login_required
+def live_session(request, session_id):
+    """
+    Live attendance board for one session. The page fills itself from
+    live_session_events, so reloading is never needed.
+    """
+    if request.user.user_role != 'Lecturer':
+        messages.error(request, "You do not have permission to view this page.")
+        return redirect('dashboard')
+
+    session = get_object_or_404(AttendanceSession.objects.select_related('course'), pk=session_id, course__lecturers=request.user)
+    return render(request, 'attendance/live_session.html', {'session': session})
+
+
+async def live_session_events(request, session_id):
+    """
+    Server-Sent Events stream of new attendance records for a session.
+    All watchers share one in-process publisher (see apis/live.py).
+    """
+    user = await request.auser()
+    if not user.is_authenticated or user.user_role != 'Lecturer':
+        return HttpResponse(status=403)
+
+    if not await AttendanceSession.objects.filter(pk=session_id, course__lecturers=user).aexists():
+        return HttpResponse(status=404)
+
+    # Give the connection back now rather than when the stream ends, which can be hours
+    await sync_to_async(release_connections)()
+
+    # The browser sends the last event it saw when it reconnects
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID'))
+    except (TypeError, ValueError):
+        last_event_id = None
+
+    response = StreamingHttpResponse(event_stream(SessionFeed, session_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+
+@login_required
+@reporting_read
 def download_attendance_summary(request, course_id):
     """
     Handles the logic to generate and download an attendance summary as a CSV file.
@@ -638,22 +770,21 @@ def download_attendance_summary(request, course_id):
     course = get_object_or_404(Course, pk=course_id, lecturers=request.user)
 
     # Data Calculation
-    total_sessions_count = AttendanceSession.objects.filter(course=course).count()
+    semester = get_report_semester(request)
+    if archive.is_archived(semester):
+        total_sessions_count = archive.session_count(semester, course)
+    else:
+        total_sessions_count = AttendanceSession.objects.filter(course=course, semester=semester).count()
 
     if total_sessions_count == 0:
         messages.error(request, "No attendance data to download for this course.")
         return redirect('course_attendance_detail', course_id=course.pk)
 
-    enrolled_students = User.objects.filter(courseenrollment__course=course).distinct()
-    students_with_attendance = enrolled_students.annotate(
-        attended_count=Count('attendancerecord', filter=Q(attendancerecord__session__course=course))
-    )
-
     # CSV Generation
     # Create the HttpResponse object with the appropriate CSV headers.
     response = HttpResponse(content_type='text/csv')
     # This header tells the browser to treat the response as a file attachment.
-    response['Content-Disposition'] = f'attachment; filename="attendance_summary_{course.course_code}.csv"'
+    response['Content-Disposition'] = f'attachment; filename="attendance_summary_{course.course_code}_{semester.session.replace("/", "-")}_{semester.name}.csv"'
 
     writer = csv.writer(response)
 
@@ -661,14 +792,110 @@ def download_attendance_summary(request, course_id):
     writer.writerow(['Student Name', 'Matric Number', 'Classes Attended', 'Total Classes', 'Attendance Score (%)'])
 
     # Write data rows
-    for student in students_with_attendance:
-        percentage = (student.attended_count / total_sessions_count) * 100
+    for student, attended_count in course_attendance_counts(course, semester):
+        percentage = (attended_count / total_sessions_count) * 100
         writer.writerow([
             student.get_full_name,
             student.matric_number,
-            student.attended_count,
+            attended_count,
             total_sessions_count,
             f'{percentage:.1f}'  # Format percentage to one decimal place
         ])
 
-    return response
\ No newline at end of file
+    return response
+
+
+@user_passes_test(is_admin)
+@reporting_read
+def faculty_attendance_report(request):
+    """
+    Every student below the attendance threshold in a semester, for one faculty
+    (?faculty=<id>) or the whole school. ?format=csv downloads the list.
+    """
+    semester = get_report_semester(request)
+    faculty = get_object_or_404(Faculty, pk=request.GET['faculty']) if request.GET.get('faculty', '').isdigit() else None
+    report = semester_report(semester, faculty)
+
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="at_risk_{semester.session.replace("/", "-")}_{semester.name}.csv"'
+        writer = csv.writer(response)
+        writer.writerow(['Student Name', 'Matric Number', 'Department', 'Overall Attendance (%)', 'Course', 'Classes Attended', 'Total Classes', 'Course Attendance (%)'])
+        for row in report['at_risk']:
+            student = row['student']
+            for course in row['courses']:
+                writer.writerow([
+                    student.get_full_name,
+                    student.matric_number,
+                    student.department.name if student.department_id else '',
+                    f"{row['rate']:.1f}",
+                    course['course'].course_code,
+                    course['attended'],
+                    course['held'],
+                    f"{course['rate']:.1f}",
+                ])
+        return response
+
+    context = {
+        'report': report,
+        'semester': semester,
+        'semesters': Semester.objects.order_by('-pk'),
+        'faculty': faculty,
+        'faculties': Faculty.objects.order_by('name'),
+    }
+    return render(request, 'attendance/faculty_attendance_report.html', context)
+
+
+@user_passes_test(is_admin)
+@reporting_read
+def attendance_trends(request):
+    """
+    Lists faculties and their departments, linking to their weekly attendance trends.
+    """
+    faculties = Faculty.objects.prefetch_related(Prefetch('department_set', queryset=Department.objects.order_by('name'))).order_by('name')
+    return render(request, 'attendance/attendance_trends_index.html', {'faculties': faculties})
+
+
+@user_passes_test(is_admin)
+@reporting_read
+def faculty_attendance_trends(request, faculty_id):
+    """
+    Weekly attendance across a faculty, and each department's totals.
+    Read from AttendanceRollup only (see apis/rollups.py).
+    """
+    faculty = get_object_or_404(Faculty, pk=faculty_id)
+    semester = get_report_semester(request)
+    rollups = AttendanceRollup.objects.filter(semester=semester, faculty=faculty)
+
+    context = {
+        'title': str(faculty),
+        'semester': semester,
+        'semesters': Semester.objects.order_by('-pk'),
+        'trend': weekly_trend(rollups),
+        'breakdown': [dict(row, name=row['department__name']) for row in breakdown(rollups, 'department__name')],
+        'breakdown_label': 'Department',
+    }
+    return render(request, 'attendance/attendance_trends.html', context)
+
+
+@user_passes_test(is_admin)
+@reporting_read
+def department_attendance_trends(request, department_id):
+    """
+    Weekly attendance across a department's students, and their totals per course.
+    Read from AttendanceRollup only (see apis/rollups.py).
+    """
+    department = get_object_or_404(Department, pk=department_id)
+    semester = get_report_semester(request)
+    rollups = AttendanceRollup.objects.filter(semester=semester, department=department)
+
+    context = {
+        'title': department.name,
+        'semester': semester,
+        'semesters': Semester.objects.order_by('-pk'),
+        'trend': weekly_trend(rollups),
+        'breakdown': [dict(row, name=row['course__course_code']) for row in breakdown(rollups, 'course__course_code')],
+        'breakdown_label': 'Course',
+        'show_sessions': True,
+    }
+    return render(request, 'attendance/attendance_trends.html', context)
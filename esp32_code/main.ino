@@ -9,6 +9,7 @@
 #include <HardwareSerial.h>
 #include <Keypad.h> // Keypad
 #include <ArduinoJson.h>
+#include <WebSocketsClient.h> // arduinoWebSockets by Markus Sattler
 
 // === CONFIGURATION ===
 const char* WIFI_SSID = "YourWifiName";
@@ -55,6 +56,31 @@ int lecturerFingerprintId = 0;
 unsigned long lastPollTime = 0;
 const long pollInterval = 5000; // Poll for new commands every 5 seconds
 
+// === RETRIES ===
+// Every POST carries an Idempotency-Key so the server can replay its first answer
+// if we retry after a dropped connection instead of running the request twice.
+const int MAX_POST_ATTEMPTS = 3;
+const int RETRY_DELAY_MS = 500;
+uint32_t bootId = 0;
+unsigned long requestCounter = 0;
+
+// === PERSISTENT WEBSOCKET ===
+// One open socket to /ws/device/ replaces a TCP connect + HTTP request per scan.
+// HTTP is still used as a fallback whenever the socket is down.
+WebSocketsClient webSocket;
+bool wsConnected = false;
+uint32_t wsRequestId = 0;
+uint32_t wsAwaitingId = 0;
+bool wsReplyReady = false;
+StaticJsonDocument<256> wsReply;
+const int WS_REPLY_TIMEOUT_MS = 5000;
+
+// Enrollment command pushed by the server, run from loop() rather than the socket callback
+bool wsEnrollPending = false;
+int wsEnrollSlot = 0;
+int wsEnrollTaskId = 0;
+String wsEnrollStudent = "";
+
 // === Function to print to Serial and OLED ===
 void showMessage(String msg, bool clear = true, int delay_ms = 0) {
   if (clear) display.clearDisplay();
@@ -77,6 +103,8 @@ void setup() {
   Serial.begin(9600);
   while (!Serial);
 
+  bootId = esp_random(); // Keeps idempotency keys unique across reboots
+
   // Setup onboard LED
   pinMode(LED_PIN, OUTPUT);
   digitalWrite(LED_PIN, LOW);
@@ -124,6 +152,13 @@ void setup() {
   showMessage("Syncing state...", true, 1000);
   syncSessionState();
 
+  // Open the persistent socket; the library reconnects by itself if it drops
+  static String wsHeaders = "X-Device-ID: " + WiFi.macAddress();
+  webSocket.begin(DJANGO_SERVER_IP, DJANGO_SERVER_PORT, "/ws/device/");
+  webSocket.setExtraHeaders(wsHeaders.c_str());
+  webSocket.onEvent(webSocketEvent);
+  webSocket.setReconnectInterval(5000);
+
   // If no session was resumed, show the main menu
   if (!sessionActive) {
     showMenu();
@@ -133,6 +168,7 @@ void setup() {
 void loop() {
 
   ensureWiFiConnected();
+  webSocket.loop();
 
   if (sessionActive) {
     // If a session is active, the device's only job is to wait for fingerprints
@@ -141,7 +177,12 @@ void loop() {
     // If no session is active, listen for keypad input to show the menu
     handleMainMenu();
 
-    if (millis() - lastPollTime >= pollInterval) {
+    if (wsEnrollPending) {
+      // The server pushed an enrollment job down the socket
+      wsEnrollPending = false;
+      runEnrollmentCommand(wsEnrollSlot, wsEnrollTaskId, wsEnrollStudent);
+    } else if (!wsConnected && millis() - lastPollTime >= pollInterval) {
+      // Only poll over HTTP when the socket is down; otherwise commands are pushed
       lastPollTime = millis();
       pollForCommands();
     }
@@ -249,32 +290,63 @@ void startAttendanceSession() {
     return;
   }
   courseCode.toUpperCase();
+
+  // One key for the whole request, so an HTTP retry after a socket timeout can't start the session twice
+  String idempotencyKey = newIdempotencyKey();
+
+  if (wsConnected) {
+    StaticJsonDocument<256> request;
+    request["op"] = "start";
+    request["f"] = fingerId;     // fingerprint_id
+    request["c"] = courseCode;   // course_code
+    request["ik"] = idempotencyKey; // idempotency_key
+    int code = socketRequest(request);
+    if (code == 201) {
+      sessionActive = true;
+      activeCourseCode = courseCode;
+      lecturerFingerprintId = fingerId;
+      setSocketIdle(false);
+      showMessage("Session Started!", true, 2000);
+      return;
+    } else if (code > 0) {
+      showMessage("Start Failed!\n" + wsReply["e"].as<String>(), true, 3000);
+      return;
+    }
+  }
+
   HTTPClient http;
   String apiUrl = "http://" + String(DJANGO_SERVER_IP) + ":" + String(DJANGO_SERVER_PORT) + "/session/start/";
   http.begin(apiUrl);
-  http.addHeader("Content-Type", "application/json");
+  http.addHeader("X-Device-ID", WiFi.macAddress()); // Lets the server rate limit per scanner
+  http.addHeader("Content-Type", "application/msgpack");
+  http.addHeader("Accept", "application/msgpack");
+  http.addHeader("Idempotency-Key", idempotencyKey);
+  http.useHTTP10(true);
 
-  // Create JSON payload using ArduinoJson
+  // Create a MessagePack payload using ArduinoJson, with the server's short field codes
   StaticJsonDocument<200> doc;
-  doc["fingerprint_id"] = fingerId;
-  doc["course_code"] = courseCode;
-  String payload;
-  serializeJson(doc, payload);
-
+  doc["f"] = fingerId;     // fingerprint_id
+  doc["c"] = courseCode;   // course_code
+  uint8_t payload[64];
+  size_t payloadLen = serializeMsgPack(doc, payload, sizeof(payload));
 
   // For debugging, print the payload you are about to send
   Serial.print("Sending payload: ");
-  Serial.println(payload);
+  serializeJson(doc, Serial);
+  Serial.println();
 
-  int httpResponseCode = http.POST(payload);
+  int httpResponseCode = postWithRetry(http, payload, payloadLen);
 
   if (httpResponseCode > 0) { // Check for a positive HTTP status code
-    String responseBody = http.getString();
+    StaticJsonDocument<200> responseDoc;
+    deserializeMsgPack(responseDoc, http.getStream());
+    String responseBody = responseDoc["e"] | "";  // error
     if (httpResponseCode == 201) { // 201 Created
       // Set the state to active
       sessionActive = true;
       activeCourseCode = courseCode;
       lecturerFingerprintId = fingerId;
+      setSocketIdle(false);
       showMessage("Session Started!", true, 2000);
     } else {
       // Received an error response from the server (e.g., 400, 404, 500)
@@ -299,23 +371,46 @@ void markStudentAttendance(int studentId, String courseCode) {
     return; // Stop if we couldn't reconnect
   }
 
+  // One key for the whole request, sent over the socket and on the HTTP fallback
+  String idempotencyKey = newIdempotencyKey();
+
+  if (wsConnected) {
+    StaticJsonDocument<256> request;
+    request["op"] = "mark";
+    request["f"] = studentId;    // fingerprint_id
+    request["c"] = courseCode;   // course_code
+    request["ik"] = idempotencyKey; // idempotency_key
+    int code = socketRequest(request);
+    if (code > 0) {
+      // "m" is the message, "e" the error
+      String message = wsReply.containsKey("m") ? wsReply["m"].as<String>() : wsReply["e"].as<String>();
+      showMessage((code == 201 || code == 200 ? "OK: " : "FAIL: ") + message, true, 2000);
+      return;
+    }
+    // No reply over the socket, fall back to HTTP below
+  }
+
   HTTPClient http;
   String apiUrl = "http://" + String(DJANGO_SERVER_IP) + ":" + String(DJANGO_SERVER_PORT) + "/attendance/mark/";
   http.begin(apiUrl);
-  http.addHeader("Content-Type", "application/json");
+  http.addHeader("X-Device-ID", WiFi.macAddress()); // Lets the server rate limit per scanner
+  http.addHeader("Content-Type", "application/msgpack");
+  http.addHeader("Accept", "application/msgpack");
+  http.addHeader("Idempotency-Key", idempotencyKey);
+  http.useHTTP10(true);
 
   StaticJsonDocument<200> doc;
-  doc["fingerprint_id"] = studentId;
-  doc["course_code"] = courseCode;
-  String payload;
-  serializeJson(doc, payload);
+  doc["f"] = studentId;    // fingerprint_id
+  doc["c"] = courseCode;   // course_code
+  uint8_t payload[64];
+  size_t payloadLen = serializeMsgPack(doc, payload, sizeof(payload));
 
-  int httpResponseCode = http.POST(payload);
-  String responseBody = http.getString();
+  int httpResponseCode = postWithRetry(http, payload, payloadLen);
 
   StaticJsonDocument<200> responseDoc;
-  deserializeJson(responseDoc, responseBody);
-  String message = responseDoc["message"];
+  deserializeMsgPack(responseDoc, http.getStream());
+  // "m" is the message, "e" the error
+  String message = responseDoc.containsKey("m") ? responseDoc["m"].as<String>() : responseDoc["e"].as<String>();
 
   if (httpResponseCode == 201 || httpResponseCode == 200) {
     showMessage("OK: " + message, true, 2000);
@@ -334,17 +429,44 @@ void endAttendanceSession(int fingerId) {
   }
 
   showMessage("Ending session...");
+
+  // One key for the whole request, sent over the socket and on the HTTP fallback
+  String idempotencyKey = newIdempotencyKey();
+
+  if (wsConnected) {
+    StaticJsonDocument<192> request;
+    request["op"] = "end";
+    request["f"] = fingerId;     // fingerprint_id
+    request["ik"] = idempotencyKey; // idempotency_key
+    int code = socketRequest(request);
+    if (code == 200) {
+      showMessage("Session Ended!", true, 2000);
+      sessionActive = false;
+      activeCourseCode = "";
+      lecturerFingerprintId = 0;
+      setSocketIdle(true);
+      return;
+    } else if (code > 0) {
+      showMessage("End Failed!\n" + wsReply["e"].as<String>(), true, 3000);
+      return;
+    }
+  }
+
   HTTPClient http;
   String apiUrl = "http://" + String(DJANGO_SERVER_IP) + ":" + String(DJANGO_SERVER_PORT) + "/session/end/";
   http.begin(apiUrl);
-  http.addHeader("Content-Type", "application/json");
+  http.addHeader("X-Device-ID", WiFi.macAddress()); // Lets the server rate limit per scanner
+  http.addHeader("Content-Type", "application/msgpack");
+  http.addHeader("Accept", "application/msgpack");
+  http.addHeader("Idempotency-Key", idempotencyKey);
+  http.useHTTP10(true);
 
   StaticJsonDocument<100> doc;
-  doc["fingerprint_id"] = fingerId;
-  String payload;
-  serializeJson(doc, payload);
+  doc["f"] = fingerId;     // fingerprint_id
+  uint8_t payload[32];
+  size_t payloadLen = serializeMsgPack(doc, payload, sizeof(payload));
 
-  int httpResponseCode = http.POST(payload);
+  int httpResponseCode = postWithRetry(http, payload, payloadLen);
 
   if (httpResponseCode == 200) {
     showMessage("Session Ended!", true, 2000);
@@ -352,14 +474,47 @@ void endAttendanceSession(int fingerId) {
     sessionActive = false;
     activeCourseCode = "";
     lecturerFingerprintId = 0;
+    setSocketIdle(true);
   } else {
-    String responseBody = http.getString();
+    StaticJsonDocument<200> responseDoc;
+    deserializeMsgPack(responseDoc, http.getStream());
+    String responseBody = responseDoc["e"] | "";  // error
     showMessage("End Failed!\n" + responseBody, true, 3000);
   }
   http.end();
 }
 
 
+// === IDEMPOTENT POST WITH RETRY ===
+String newIdempotencyKey() {
+  requestCounter++;
+  return WiFi.macAddress() + "-" + String(bootId, HEX) + "-" + String(requestCounter);
+}
+
+// Retries connection errors (negative codes) and server backpressure (429/503),
+// reusing the same key and payload
+int postWithRetry(HTTPClient &http, uint8_t *payload, size_t payloadLen) {
+  const char* headerKeys[] = {"Retry-After"};
+  http.collectHeaders(headerKeys, 1);
+
+  int code = http.POST(payload, payloadLen);
+  for (int attempt = 1; attempt < MAX_POST_ATTEMPTS && (code < 0 || code == 429 || code == 503); attempt++) {
+    int waitMs = RETRY_DELAY_MS * attempt;
+    if (code > 0) {
+      // Honour the server's Retry-After (seconds) when it is telling us to back off
+      waitMs = max(waitMs, http.header("Retry-After").toInt() * 1000);
+      Serial.printf("[HTTP] Server busy (%d), retrying...\n", code);
+    } else {
+      Serial.printf("[HTTP] POST failed (%s), retrying...\n", http.errorToString(code).c_str());
+    }
+    delay(waitMs);
+    ensureWiFiConnected();
+    code = http.POST(payload, payloadLen);
+  }
+  return code;
+}
+
+
 // === READ INPUT FROM KEYPAD (with backspace) ===
 String readKeypadInput(String prompt) {
   inputBuffer = "";
@@ -594,19 +749,21 @@ void syncSessionState() {
   HTTPClient http;
   String apiUrl = "http://" + String(DJANGO_SERVER_IP) + ":" + String(DJANGO_SERVER_PORT) + "/session/status/";
   http.begin(apiUrl);
+  http.addHeader("X-Device-ID", WiFi.macAddress()); // Lets the server rate limit per scanner
+  http.addHeader("Accept", "application/msgpack");
+  http.useHTTP10(true); // No chunked encoding, so the body can be parsed straight off the stream
 
   int httpResponseCode = http.GET();
 
   if (httpResponseCode == 200) {
-    String responseBody = http.getString();
     StaticJsonDocument<200> doc;
-    deserializeJson(doc, responseBody);
+    deserializeMsgPack(doc, http.getStream());
 
-    String status = doc["status"];
+    String status = doc["s"];  // status
     if (status == "active") {
       // An active session was found on the server, resume it
-      activeCourseCode = doc["course_code"].as<String>();
-      lecturerFingerprintId = doc["lecturer_fingerprint_id"].as<int>();
+      activeCourseCode = doc["c"].as<String>();        // course_code
+      lecturerFingerprintId = doc["lf"].as<int>();     // lecturer_fingerprint_id
       sessionActive = true;
       Serial.println("Resumed active session for course: " + activeCourseCode);
       showMessage("Resumed Session:\n" + activeCourseCode, true, 2000);
@@ -657,18 +814,23 @@ void reportEnrollmentResult(int taskId, bool success, String message) {
     HTTPClient http;
     String apiUrl = "http://" + String(DJANGO_SERVER_IP) + ":" + String(DJANGO_SERVER_PORT) + "/api/report-enrollment-result/";
     http.begin(apiUrl);
-    http.addHeader("Content-Type", "application/json");
+    http.addHeader("X-Device-ID", WiFi.macAddress()); // Lets the server rate limit per scanner
+    http.addHeader("Content-Type", "application/msgpack");
+    http.addHeader("Accept", "application/msgpack");
+    http.addHeader("Idempotency-Key", newIdempotencyKey());
 
     StaticJsonDocument<200> doc;
-    doc["task_id"] = taskId;
-    doc["status"] = success ? "success" : "error";
-    doc["message"] = message;
+    doc["t"] = taskId;                             // task_id
+    doc["s"] = success ? "success" : "error";      // status
+    doc["m"] = message;                            // message
 
-    String payload;
-    serializeJson(doc, payload);
+    uint8_t payload[128];
+    size_t payloadLen = serializeMsgPack(doc, payload, sizeof(payload));
 
-    Serial.println("Reporting result: " + payload);
-    http.POST(payload); // We send the result but don't need to check the response
+    Serial.print("Reporting result: ");
+    serializeJson(doc, Serial);
+    Serial.println();
+    postWithRetry(http, payload, payloadLen); // We send the result but don't need to check the response
     http.end();
 }
 
@@ -681,37 +843,23 @@ void pollForCommands() {
     HTTPClient http;
     String apiUrl = "http://" + String(DJANGO_SERVER_IP) + ":" + String(DJANGO_SERVER_PORT) + "/api/get-device-command/";
     http.begin(apiUrl);
+    http.addHeader("X-Device-ID", WiFi.macAddress()); // Lets the server rate limit per scanner
+    http.addHeader("Accept", "application/msgpack");
+    http.useHTTP10(true);
 
     int httpResponseCode = http.GET();
 
     if (httpResponseCode == 200) {
-        String responseBody = http.getString();
         StaticJsonDocument<200> doc;
-        deserializeJson(doc, responseBody);
+        deserializeMsgPack(doc, http.getStream());
 
-        String command = doc["command"];
+        String command = doc["x"];  // command
 
         if (command == "enroll") {
-            int slot = doc["slot"];
-            int taskId = doc["task_id"];
-            
-            showMessage("Enroll request for\nslot #" + String(slot), true, 2000);
-
-            // Execute the enrollment process
-            String resultMessage = getFingerprintEnroll(slot);
-            bool success = (resultMessage == "Enrollment successful.");
-
-            if (success) {
-                showMessage("Enrollment OK!", true, 1500);
-            } else {
-                showMessage("Enroll Failed:\n" + resultMessage, true, 3000);
-            }
+            int slot = doc["o"];    // slot
+            int taskId = doc["t"];  // task_id
             
-            // Report the result back to the server
-            reportEnrollmentResult(taskId, success, resultMessage);
-
-            // Return to the main menu
-            showMenu();
+            runEnrollmentCommand(slot, taskId, doc["u"] | "");  // student, sent for campaign tasks
         } else {
             Serial.println("No commands pending.");
         }
@@ -726,4 +874,96 @@ void pollForCommands() {
 void clearOLEDPortion(int x, int y, int width, int height) {
   display.fillRect(x, y, width, height, SSD1306_BLACK); // Black is the default background color
   display.display();  // Push changes to display
-}
\ No newline at end of file
+}
+
+// === WEBSOCKET HELPERS ===
+void webSocketEvent(WStype_t type, uint8_t *payload, size_t length) {
+  switch (type) {
+    case WStype_CONNECTED:
+      wsConnected = true;
+      Serial.println("[WS] Connected");
+      setSocketIdle(!sessionActive);
+      break;
+    case WStype_DISCONNECTED:
+      wsConnected = false;
+      Serial.println("[WS] Disconnected");
+      break;
+    case WStype_BIN: {
+      StaticJsonDocument<256> frame;
+      if (deserializeMsgPack(frame, payload, length)) return;
+
+      if (frame["op"] == "command") {
+        if (frame["x"] == "enroll") {  // command
+          wsEnrollSlot = frame["o"];    // slot
+          wsEnrollTaskId = frame["t"];  // task_id
+          wsEnrollStudent = frame["u"] | "";  // student, sent for campaign tasks
+          wsEnrollPending = true;
+        }
+      } else if (frame["id"].as<uint32_t>() == wsAwaitingId) {
+        wsReply = frame;
+        wsReplyReady = true;
+      }
+      break;
+    }
+    default:
+      break;
+  }
+}
+
+// Sends a request over the socket and waits for the reply with the same id.
+// Returns the reply's status code (reply body in wsReply), or -1 on timeout.
+int socketRequest(JsonDocument &request) {
+  request["id"] = ++wsRequestId;
+  wsAwaitingId = wsRequestId;
+  wsReplyReady = false;
+
+  uint8_t buffer[192];
+  size_t len = serializeMsgPack(request, buffer, sizeof(buffer));
+  if (!webSocket.sendBIN(buffer, len)) return -1;
+
+  unsigned long startTime = millis();
+  while (!wsReplyReady && millis() - startTime < WS_REPLY_TIMEOUT_MS) {
+    webSocket.loop();
+    delay(1);
+  }
+  return wsReplyReady ? wsReply["code"].as<int>() : -1;
+}
+
+// Tells the server whether we can take pushed enrollment commands right now
+void setSocketIdle(bool idle) {
+  if (!wsConnected) return;
+  StaticJsonDocument<32> frame;
+  frame["op"] = idle ? "idle" : "busy";
+  uint8_t buffer[16];
+  size_t len = serializeMsgPack(frame, buffer, sizeof(buffer));
+  webSocket.sendBIN(buffer, len);
+}
+
+// === RUN AN ENROLLMENT COMMAND FROM THE SERVER ===
+void runEnrollmentCommand(int slot, int taskId, String student) {
+    if (student.length() > 0) {
+        // Campaign task: call the next student up to the scanner
+        showMessage("Next to enroll:\n" + student + "\nslot #" + String(slot), true, 3000);
+    } else {
+        showMessage("Enroll request for\nslot #" + String(slot), true, 2000);
+    }
+
+    // Execute the enrollment process
+    String resultMessage = getFingerprintEnroll(slot);
+    bool success = (resultMessage == "Enrollment successful.");
+
+    if (success) {
+        showMessage("Enrollment OK!", true, 1500);
+    } else {
+        showMessage("Enroll Failed:\n" + resultMessage, true, 3000);
+    }
+    
+    // Report the result back to the server
+    reportEnrollmentResult(taskId, success, resultMessage);
+
+    // Return to the main menu
+    showMenu();
+
+    // Ready for the next pushed command
+    setSocketIdle(true);
+}
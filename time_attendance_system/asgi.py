@@ -2,6 +2,8 @@
 ASGI config for time_attendance_system project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django, and /ws/device/ is the scanners' persistent WebSocket.
+Run it with an ASGI server, e.g. ``uvicorn time_attendance_system.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'time_attendance_system.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it uses the models
+from apis.device_socket import device_socket  # noqa: E402
+
+WEBSOCKET_ROUTES = {
+    '/ws/device/': device_socket,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        handler = WEBSOCKET_ROUTES.get(scope['path'])
+        if handler is None:
+            # Closing before accepting rejects the handshake
+            await send({'type': 'websocket.close'})
+            return
+        await handler(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
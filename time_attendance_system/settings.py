@@ -51,16 +51,19 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres', # Trigram lookups for user search
     'apis',
     'smart_selects', # For chaining a model field to another.
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'apis.traffic.TrafficCaptureMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apis.routers.ReplicaStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -104,6 +107,140 @@ DATABASES = {
     }
 }
 
+# Optional read replica for reports, dashboards and exports (see apis/routers.py).
+# Unset means everything reads from the primary.
+REPLICA_DATABASE_HOST = env('REPLICA_DATABASE_HOST', default='')
+if REPLICA_DATABASE_HOST:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        "NAME": env('REPLICA_DATABASE_NAME', default=DATABASE_NAME),
+        "HOST": REPLICA_DATABASE_HOST,
+        "PORT": env('REPLICA_DATABASE_PORT', default=DATABASE_PORT),
+        # Tests read the replica from the primary's test database
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Pooled connections (see apis/db_pool.py). Off means a new connection per request.
+# Every worker process has its own pool per database, so the server needs
+# workers x DATABASE_POOL_MAX_SIZE connections available.
+DATABASE_POOL = env.bool('DATABASE_POOL', default=False)
+if DATABASE_POOL:
+    for database in DATABASES.values():
+        database["OPTIONS"] = {
+            "pool": {
+                "min_size": env.int('DATABASE_POOL_MIN_SIZE', default=2),
+                "max_size": env.int('DATABASE_POOL_MAX_SIZE', default=10),
+                # Seconds a request waits for a free connection before failing
+                "timeout": env.float('DATABASE_POOL_TIMEOUT', default=10.0),
+                # Seconds before an idle connection above min_size is closed
+                "max_idle": env.float('DATABASE_POOL_MAX_IDLE', default=300.0),
+            },
+        }
+        # Check each connection as it is taken from the pool
+        database["CONN_HEALTH_CHECKS"] = True
+# Seconds a pooled connection may be held before it is reported as leaked
+DATABASE_POOL_LEAK_SECONDS = env.float('DATABASE_POOL_LEAK_SECONDS', default=30.0)
+
+DATABASE_ROUTERS = ['apis.routers.ReplicaRouter']
+# Seconds a user keeps reading from the primary after they write, so replica lag never hides their changes
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=10)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+IDEMPOTENCY_CACHE_TIMEOUT = env.int('IDEMPOTENCY_CACHE_TIMEOUT', default=600)  # seconds
+IDEMPOTENCY_CACHE_MAX_ENTRIES = env.int('IDEMPOTENCY_CACHE_MAX_ENTRIES', default=5000)
+
+# Stores device responses so retried POSTs can be replayed (see apis/idempotency.py).
+# It is on the shared CACHE_URL backend, so a retry that lands on another worker
+# still finds the first answer (and its in-flight lock), under its own key prefix.
+IDEMPOTENCY_CACHE = {
+    **env.cache_url('CACHE_URL', default='locmemcache://'),
+    'KEY_PREFIX': 'idempotency',
+    'TIMEOUT': IDEMPOTENCY_CACHE_TIMEOUT,
+}
+if IDEMPOTENCY_CACHE['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+    # Development only: bounded (MAX_ENTRIES, LRU) and per process
+    IDEMPOTENCY_CACHE['LOCATION'] = 'idempotency'
+    IDEMPOTENCY_CACHE['OPTIONS'] = {'MAX_ENTRIES': IDEMPOTENCY_CACHE_MAX_ENTRIES}
+
+CACHES = {
+    # Use a shared backend (e.g. redis:// or filecache://) in production so
+    # device rate limits, idempotency keys and the course catalog are shared by all gunicorn workers.
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+    'idempotency': IDEMPOTENCY_CACHE,
+}
+
+# Device API admission control (see apis/throttling.py)
+# rate is tokens per second, burst is the bucket size, per device.
+DEVICE_THROTTLE_SCOPES = {
+    'session': {'rate': env.float('DEVICE_SESSION_RATE', default=0.5), 'burst': env.int('DEVICE_SESSION_BURST', default=5)},
+    'mark': {'rate': env.float('DEVICE_MARK_RATE', default=2.0), 'burst': env.int('DEVICE_MARK_BURST', default=10)},
+    'command': {'rate': env.float('DEVICE_COMMAND_RATE', default=0.5), 'burst': env.int('DEVICE_COMMAND_BURST', default=5)},
+}
+
+# Maximum number of device requests allowed to run at the same time, across all workers
+# when CACHE_URL is shared (`manage.py check --deploy` warns when it isn't)
+DEVICE_MAX_CONCURRENCY = env.int('DEVICE_MAX_CONCURRENCY', default=8)
+# Seconds a scanner's sensor group is cached for (see apis/sensors.py)
+DEVICE_GROUP_CACHE_TIMEOUT = env.int('DEVICE_GROUP_CACHE_TIMEOUT', default=300)
+# Seconds a cached course catalog is kept; changes made through Django retire it at once
+# on a shared CACHE_URL (see apis/catalog.py)
+COURSE_CATALOG_CACHE_TIMEOUT = env.int('COURSE_CATALOG_CACHE_TIMEOUT', default=86400)
+# Used instead when CACHE_URL is per-process: other workers only see a change once their copy expires
+COURSE_CATALOG_LOCAL_CACHE_TIMEOUT = env.int('COURSE_CATALOG_LOCAL_CACHE_TIMEOUT', default=60)
+
+# Server-side copies of fingerprint templates (see apis/template_vault.py)
+TEMPLATE_VAULT_DIR = env.str('TEMPLATE_VAULT_DIR', default=os.path.join(BASE_DIR, 'template_vault'))
+TEMPLATE_MAX_BYTES = env.int('TEMPLATE_MAX_BYTES', default=4096)
+# Bytes per chunk when streaming templates to a scanner
+TEMPLATE_STREAM_CHUNK_SIZE = env.int('TEMPLATE_STREAM_CHUNK_SIZE', default=64 * 1024)
+# Seconds a scanner's signed vault request is accepted for, either side of its timestamp (see apis/sensors.py)
+DEVICE_SIGNATURE_MAX_AGE = env.int('DEVICE_SIGNATURE_MAX_AGE', default=300)
+
+# Closed semesters archived by the archive_semester command
+ATTENDANCE_ARCHIVE_DIR = env.str('ATTENDANCE_ARCHIVE_DIR', default=os.path.join(BASE_DIR, 'attendance_archive'))
+# Percent attendance below which a student is flagged as at risk (see apis/analytics.py)
+ATTENDANCE_THRESHOLD = env.float('ATTENDANCE_THRESHOLD', default=75.0)
+
+# Device WebSocket (see apis/device_socket.py)
+# How many requests from one socket may run at the same time
+DEVICE_SOCKET_PIPELINE_DEPTH = env.int('DEVICE_SOCKET_PIPELINE_DEPTH', default=4)
+# Seconds between checks for enrollment commands queued by other processes
+DEVICE_SOCKET_COMMAND_POLL = env.float('DEVICE_SOCKET_COMMAND_POLL', default=5.0)
+
+# Live pages pushed over Server-Sent Events (see apis/live.py)
+# Seconds between each publisher's checks for new rows, shared by all watchers
+LIVE_POLL_INTERVAL = env.float('LIVE_POLL_INTERVAL', default=2.0)
+# Seconds between keep-alive comments on an idle stream
+LIVE_HEARTBEAT_INTERVAL = env.float('LIVE_HEARTBEAT_INTERVAL', default=15.0)
+# Seconds an enrollment task's cached state is trusted while it can still change,
+# and once it is final (see apis/live.py set_task_state)
+TASK_STATE_TIMEOUT = env.int('TASK_STATE_TIMEOUT', default=5)
+TASK_STATE_FINAL_TIMEOUT = env.int('TASK_STATE_FINAL_TIMEOUT', default=3600)
+
+# Anonymized request capture for the replay_traffic command (see apis/traffic.py)
+TRAFFIC_CAPTURE = env.bool('TRAFFIC_CAPTURE', default=False)
+TRAFFIC_CAPTURE_DIR = env.str('TRAFFIC_CAPTURE_DIR', default=os.path.join(BASE_DIR, 'traffic'))
+# Fraction of clients (scanners, browser sessions) whose requests are all captured
+TRAFFIC_CAPTURE_SAMPLE = env.float('TRAFFIC_CAPTURE_SAMPLE', default=0.1)
+# Size at which a worker's file is rotated, and how many old files are kept
+TRAFFIC_CAPTURE_MAX_BYTES = env.int('TRAFFIC_CAPTURE_MAX_BYTES', default=50 * 1024 * 1024)
+TRAFFIC_CAPTURE_BACKUPS = env.int('TRAFFIC_CAPTURE_BACKUPS', default=10)
+# Key for the pseudonyms in captured traffic; SECRET_KEY if unset
+TRAFFIC_CAPTURE_KEY = env.str('TRAFFIC_CAPTURE_KEY', default='')
+# Captured fingerprint slots are remapped into 1..TRAFFIC_CAPTURE_SLOTS
+TRAFFIC_CAPTURE_SLOTS = env.int('TRAFFIC_CAPTURE_SLOTS', default=1000)
+
+# Clean-up jobs run by the housekeeping command (see apis/housekeeping.py)
+# Active sessions older than this are closed, for lecturers who forget to scan out
+ATTENDANCE_SESSION_MAX_MINUTES = env.int('ATTENDANCE_SESSION_MAX_MINUTES', default=240)
+# Seconds before a task a device took (or nobody took) without reporting back is timed out
+ENROLLMENT_TASK_TIMEOUT = env.int('ENROLLMENT_TASK_TIMEOUT', default=300)
+# Days finished enrollment tasks are kept
+ENROLLMENT_TASK_RETENTION_DAYS = env.int('ENROLLMENT_TASK_RETENTION_DAYS', default=30)
+# Rows closed, updated or deleted per transaction
+HOUSEKEEPING_BATCH_SIZE = env.int('HOUSEKEEPING_BATCH_SIZE', default=1000)
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators